@@ -0,0 +1,244 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import hashlib
+import json
+import time
+
+from tensorflow.python.platform import gfile
+
+#=================================================================
+#
+#	artifact_utils.py
+#
+#	Bookkeeping for the files written while preparing data, so a stage is only skipped when its
+#	output is known to be complete and up to date.
+#
+#	  manifests    - every finished artifact gets a small json file next to it, path + ".manifest",
+#	                 recording the stage that wrote it, the version of the code and rules of that
+#	                 stage, its parameters, the size, mtime and sha1 of every input, and the size
+#	                 and mtime of the artifact itself. A stage is current only if all of those still
+#	                 match. Files whose size and mtime are unchanged are trusted without hashing
+#	                 them again, so checking a finished pipeline costs a few stat calls.
+#	  hash caches  - the sha1 of a file with no manifest of its own, like a downloaded corpus, is kept
+#	                 in path + ".sha1" with the size and mtime it was computed for, so recording every
+#	                 stage that reads a multi-GB corpus hashes it once rather than once per stage.
+#	  atomic writes - artifacts are written under a temporary name and renamed when complete, and
+#	                 the manifest is written after the rename, so a crashed run never leaves a file
+#	                 that looks finished.
+#	  checkpoints  - long stages save how far they got to path + ".checkpoint" every so often, so
+#	                 an interrupted run can pick up where it stopped (see vocabulary_utils._run_line_stage).
+#
+
+_HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def manifest_path(path):
+  return path + ".manifest"
+
+
+def checkpoint_path(path):
+  return path + ".checkpoint"
+
+
+def temporary_path(path):
+  return path + ".tmp"
+
+
+def hash_cache_path(path):
+  return path + ".sha1"
+
+
+def _stat(path):
+  stat = gfile.Stat(path)
+  return {"size": stat.length, "mtime": stat.mtime_nsec}
+
+
+def _settled(stat):
+  #mtimes have whole second resolution on some filesystems, so a file modified during the current second can
+  #still change without its size or mtime changing. its hash is only cached once that second is over.
+  return stat["mtime"] < int(time.time()) * 10**9
+
+
+def _normalize(value):
+  #round trip through json so freshly built values compare equal to the ones read back from a manifest
+  return json.loads(json.dumps(value, sort_keys=True))
+
+
+def _write_json(path, value):
+  temporary = temporary_path(path)
+  with gfile.GFile(temporary, mode="w") as f:
+    f.write(json.dumps(value, sort_keys=True, indent=1))
+  gfile.Rename(temporary, path, overwrite=True)
+
+
+def _read_json(path):
+  if not gfile.Exists(path):
+    return None
+  with gfile.GFile(path, mode="r") as f:
+    try:
+      return json.loads(f.read())
+    except ValueError:
+      return None
+
+
+def load_manifest(path):
+  return _read_json(manifest_path(path))
+
+
+def _compute_hash(path):
+  sha1 = hashlib.sha1()
+  with gfile.GFile(path, mode="rb") as f:
+    while True:
+      block = f.read(_HASH_BLOCK_SIZE)
+      if not block:
+        break
+      sha1.update(block)
+  return sha1.hexdigest()
+
+
+def file_hash(path):
+  """sha1 of the contents of path.
+
+  The hash of an artifact is cached in its manifest, and the hash of any other file in a hash cache
+  next to it. Either is reused as long as the file keeps the size and mtime it was hashed at.
+  """
+  stat = _stat(path)
+  manifest = load_manifest(path)
+  if manifest is not None:
+    output = manifest.get("output", {})
+    if output.get("size") == stat["size"] and output.get("mtime") == stat["mtime"] and "sha1" in output:
+      return output["sha1"]
+    digest = _compute_hash(path)
+    #the manifest describes the file as it was written, so it only takes the new mtime if the contents are the same.
+    #a file that changed keeps its old description, so is_current still sees the change
+    if (_settled(stat) and output.get("size") == stat["size"] and
+        (output.get("mtime") == stat["mtime"] or output.get("sha1") == digest)):
+      manifest["output"] = dict(stat, sha1=digest)
+      _write_json(manifest_path(path), manifest)
+    return digest
+
+  cached = _read_json(hash_cache_path(path))
+  if cached is not None and cached.get("size") == stat["size"] and cached.get("mtime") == stat["mtime"]:
+    return cached["sha1"]
+  digest = _compute_hash(path)
+  if _settled(stat):
+    _write_json(hash_cache_path(path), dict(stat, sha1=digest))
+  return digest
+
+
+def _describe_input(path):
+  description = _stat(path)
+  description["sha1"] = file_hash(path)
+  return description
+
+
+def _unchanged(path, recorded):
+  #recorded is the size, mtime and maybe sha1 of path when a manifest was written
+  if not gfile.Exists(path):
+    return False
+  stat = _stat(path)
+  if stat["size"] != recorded.get("size"):
+    return False
+  if stat["mtime"] == recorded.get("mtime"):
+    return True
+  #touched, but maybe not changed. without a recorded hash there is no telling, so it counts as changed
+  return "sha1" in recorded and file_hash(path) == recorded["sha1"]
+
+
+def is_current(path, stage, version, inputs, params=None, verbose=True):
+  """True if path was completely written by stage from the same inputs, code version and parameters.
+
+  If verbose, prints why when an existing file is not current.
+  """
+  if not gfile.Exists(path):
+    return False
+  manifest = load_manifest(path)
+  if manifest is None:
+    if verbose:
+      print("%s has no manifest, so it may be incomplete. It will be rebuilt." % path)
+    return False
+
+  reason = None
+  output = manifest.get("output", {})
+  if manifest.get("stage") != stage or manifest.get("version") != _normalize(version):
+    reason = "it was written by an older version of the %s stage" % stage
+  elif manifest.get("params") != _normalize(params or {}):
+    reason = "it was written with different parameters"
+  elif sorted(manifest.get("inputs", {}).keys()) != sorted(_normalize(list(inputs))):
+    reason = "it was written from different input files"
+  elif not _unchanged(path, output):
+    reason = "it changed since it was written"
+  else:
+    for input_path, recorded in manifest["inputs"].items():
+      if not _unchanged(input_path, recorded):
+        reason = "its input %s changed" % input_path
+        break
+  if reason is not None and verbose:
+    print("%s is out of date because %s. It will be rebuilt." % (path, reason))
+  return reason is None
+
+
+def record(path, stage, version, inputs, params=None, details=None):
+  #write the manifest of a finished artifact. details are facts about it worth keeping, like how it was made
+  manifest = {"stage": stage,
+              "version": version,
+              "params": params or {},
+              "inputs": dict((input_path, _describe_input(input_path)) for input_path in inputs),
+              "output": _stat(path)}
+  if details is not None:
+    manifest["details"] = details
+  _write_json(manifest_path(path), manifest)
+
+
+def invalidate(path, derived_paths=()):
+  """Forget that path was built, before it gets rebuilt.
+
+  derived_paths are sidecar files built from path that don't have manifests of their own (count tables,
+  line indexes), which are removed along with the manifest.
+  """
+  for stale_path in (manifest_path(path),) + tuple(derived_paths):
+    if gfile.Exists(stale_path):
+      gfile.Remove(stale_path)
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+  """Yield a temporary path to write path through. It is renamed to path only if the block succeeds."""
+  temporary = temporary_path(path)
+  try:
+    yield temporary
+  except BaseException:
+    if gfile.Exists(temporary):
+      gfile.Remove(temporary)
+    raise
+  gfile.Rename(temporary, path, overwrite=True)
+
+
+def checkpoint_key(stage, version, input_path, params=None):
+  """Identifies the work a checkpoint belongs to, so a checkpoint of other work is never resumed.
+
+  The input is identified by size and mtime rather than by its hash, since the point is to resume
+  without reading the input again.
+  """
+  return _normalize({"stage": stage, "version": version, "input": input_path, "input_stat": _stat(input_path),
+                     "params": params or {}})
+
+
+def load_checkpoint(path, key):
+  #the saved state for key, or None if there is no checkpoint of the same work
+  checkpoint = _read_json(checkpoint_path(path))
+  if checkpoint is None or checkpoint.get("key") != _normalize(key):
+    return None
+  return checkpoint["state"]
+
+
+def save_checkpoint(path, key, state):
+  _write_json(checkpoint_path(path), {"key": key, "state": state})
+
+
+def remove_checkpoint(path):
+  if gfile.Exists(checkpoint_path(path)):
+    gfile.Remove(checkpoint_path(path))
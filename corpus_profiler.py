@@ -0,0 +1,253 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gzip
+import multiprocessing
+import re
+
+import numpy as np
+from tensorflow.python.platform import gfile
+
+import artifact_utils
+import dataset_utils
+import download_utils
+import vocabulary_utils
+
+#=================================================================
+#
+#	corpus_profiler.py
+#
+#	One pass statistics of an integerized corpus, cached next to it.
+#
+#	get_sentence_length_distribution, get_all_chars_in_data_file and get_word_frequency_ratio in
+#	vocabulary_utils each read a whole file on one core, and the last one only answers for a single
+#	word. A CorpusProfile holds all of it for one side of the corpus:
+#
+#	  length_histogram  - number of sentences of every length, straight from the offsets of the
+#	                      binary corpus without reading a token
+#	  id_frequencies    - how often every token id occurs, from np.bincount over the mapped tokens
+#	  byte_histogram    - how often every byte occurs in the cleaned text, from np.bincount over the
+#	                      mapped file
+#
+#	The bincounts are split into chunks counted by a process pool. Profiles are saved as .npz files
+#	next to the corpus with an artifact manifest, so after the first run choosing a maximum sentence
+#	length or checking the rate of unknown words costs nothing.
+#
+#	  python corpus_profiler.py giga-fren.release2.fixed.en.clean.ids_40000 giga-fren.release2.fixed.fr.clean.ids_40000 --workers 8
+#
+
+_PROFILE_VERSION = 1
+_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class CorpusProfile(object):
+  """Length, token id and byte statistics of one side of an integerized corpus."""
+
+  def __init__(self, length_histogram, id_frequencies, byte_histogram=None):
+    self.length_histogram = length_histogram
+    self.id_frequencies = id_frequencies
+    self.byte_histogram = byte_histogram
+
+  @property
+  def num_sentences(self):
+    return int(self.length_histogram.sum())
+
+  @property
+  def num_tokens(self):
+    return int(self.id_frequencies.sum())
+
+  def length_distribution(self, max_length):
+    #same layout as vocabulary_utils.get_sentence_length_distribution: counts for lengths 0 to max_length, then everything longer
+    counts = np.zeros(max_length + 2, dtype=np.int64)
+    kept = self.length_histogram[:max_length + 1]
+    counts[:len(kept)] = kept
+    counts[max_length + 1] = self.length_histogram[max_length + 1:].sum()
+    return counts.tolist()
+
+  def length_coverage(self, max_length):
+    #fraction of the sentences that have at most max_length tokens
+    return self.length_histogram[:max_length + 1].sum() / float(max(self.num_sentences, 1))
+
+  def length_percentile(self, percentile):
+    #the smallest length that at least percentile percent of the sentences fit in
+    cumulative = np.cumsum(self.length_histogram)
+    return int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100.0))
+
+  def word_frequency(self, token_id):
+    #(occurrences, occurrences / tokens) of token_id, like vocabulary_utils.get_word_frequency_ratio
+    found = int(self.id_frequencies[token_id]) if token_id < len(self.id_frequencies) else 0
+    return found, found / float(max(self.num_tokens, 1))
+
+  def unk_rate(self):
+    return self.word_frequency(vocabulary_utils.UNK_ID)[1]
+
+  def characters(self):
+    #the set of bytes in the text, like vocabulary_utils.get_all_chars_in_data_file
+    if self.byte_histogram is None:
+      return None
+    return set(_byte_string(byte) for byte in np.flatnonzero(self.byte_histogram))
+
+  def save(self, path):
+    with artifact_utils.atomic_output(path) as temporary_path:
+      #through a file object, since np.savez adds .npz to a name that doesn't end in it
+      with open(temporary_path, "wb") as f:
+        arrays = {"length_histogram": self.length_histogram, "id_frequencies": self.id_frequencies}
+        if self.byte_histogram is not None:
+          arrays["byte_histogram"] = self.byte_histogram
+        np.savez(f, **arrays)
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as arrays:
+      return cls(arrays["length_histogram"], arrays["id_frequencies"],
+                 arrays["byte_histogram"] if "byte_histogram" in arrays.files else None)
+
+
+def _byte_string(value):
+  return bytes(bytearray([int(value)]))
+
+
+def profile_path(ids_path):
+  return ids_path + ".profile"
+
+
+def text_file_of(ids_path):
+  #the cleaned text an integerized file was made from, ie train.fr.clean for train.fr.clean.ids_40000 and dev.fr.ids_40000
+  text_path = re.sub(r"\.ids_\d+$", "", ids_path)
+  return text_path if text_path.endswith(".clean") else text_path + ".clean"
+
+
+def _count_token_ids(job):
+  #bincount of the token ids in tokens[start:end] of a binary corpus
+  binary_path, start, end, minlength = job
+  corpus = dataset_utils.IntegerizedCorpus(binary_path)
+  return np.bincount(corpus.tokens[start:end], minlength=minlength).astype(np.int64)
+
+
+def _count_bytes(job):
+  #bincount of the bytes in [start, end) of a text file
+  text_path, start, end = job
+  data = np.memmap(text_path, dtype=np.uint8, mode="r", offset=start, shape=(end - start,))
+  return np.bincount(data, minlength=256).astype(np.int64)
+
+
+def _count_gzip_bytes(text_path):
+  #a gzipped file can't be mapped, so it is inflated and counted a chunk at a time
+  counts = np.zeros(256, dtype=np.int64)
+  with gzip.open(text_path, "rb") as f:
+    while True:
+      chunk = f.read(_CHUNK_SIZE)
+      if not chunk:
+        return counts
+      counts += np.bincount(np.frombuffer(chunk, dtype=np.uint8), minlength=256)
+
+
+def _chunks(size, chunk_size):
+  return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def _sum_counts(results, length):
+  total = np.zeros(length, dtype=np.int64)
+  for counts in results:
+    total[:len(counts)] += counts
+  return total
+
+
+def profile_corpus(ids_path, vocabulary_size, text_path=None, workers=1, chunk_size=_CHUNK_SIZE):
+  """The CorpusProfile of an integerized file, computing and caching it unless an up to date one is cached.
+
+  Args:
+    ids_path: the text integerized file. Its binary version is written first if it's missing.
+    vocabulary_size: the vocabulary size the file was integerized with.
+    text_path: the text file to take the byte histogram of. defaults to the cleaned file the ids were made from,
+      and the byte histogram is left out if that doesn't exist.
+    workers: number of processes to count with.
+  """
+  if text_path is None:
+    text_path = text_file_of(ids_path)
+    if not gfile.Exists(text_path):
+      text_path = None
+  binary_path = dataset_utils.maybe_convert_integerized_file_to_binary(ids_path, vocabulary_size)
+  inputs = [binary_path] + ([text_path] if text_path is not None else [])
+  cache_path = profile_path(ids_path)
+  if artifact_utils.is_current(cache_path, "profile", _PROFILE_VERSION, inputs, {"vocabulary_size": vocabulary_size}):
+    return CorpusProfile.load(cache_path)
+
+  print("Profiling %s%s" % (ids_path, "" if text_path is None else " and %s" % text_path))
+  corpus = dataset_utils.IntegerizedCorpus(binary_path)
+  lengths = corpus.lengths
+  length_histogram = np.bincount(lengths) if len(lengths) else np.zeros(1, dtype=np.int64)
+
+  token_jobs = [(binary_path, start, end, vocabulary_size) for start, end in _chunks(corpus.num_tokens, chunk_size)]
+  byte_jobs = []
+  if text_path is not None and not download_utils.is_gzip_file(text_path):
+    byte_jobs = [(text_path, start, end) for start, end in _chunks(gfile.Stat(text_path).length, chunk_size)]
+
+  if workers > 1:
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+      #both kinds of chunks go to the pool at once, so nobody waits between the two counts
+      token_results = pool.map_async(_count_token_ids, token_jobs)
+      byte_results = pool.map_async(_count_bytes, byte_jobs)
+      token_counts, byte_counts = token_results.get(), byte_results.get()
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    token_counts = [_count_token_ids(job) for job in token_jobs]
+    byte_counts = [_count_bytes(job) for job in byte_jobs]
+
+  id_frequencies = _sum_counts(token_counts, vocabulary_size)
+  byte_histogram = None
+  if text_path is not None:
+    byte_histogram = _count_gzip_bytes(text_path) if download_utils.is_gzip_file(text_path) else _sum_counts(byte_counts, 256)
+
+  profile = CorpusProfile(length_histogram.astype(np.int64), id_frequencies, byte_histogram)
+  profile.save(cache_path)
+  artifact_utils.record(cache_path, "profile", _PROFILE_VERSION, inputs, {"vocabulary_size": vocabulary_size})
+  return profile
+
+
+def report(profile, name, max_length=None, vocabulary=None, top_words=10,
+           percentiles=(50, 90, 95, 99, 99.9)):
+  """Print a profile. vocabulary is the reversed vocabulary from vocabulary_utils.initialize_vocabulary."""
+  print("%s: %d sentences, %d tokens" % (name, profile.num_sentences, profile.num_tokens))
+  print("\tsentence length percentiles: %s" % ", ".join("%g%% <= %d" % (p, profile.length_percentile(p)) for p in percentiles))
+  if max_length is not None:
+    print("\t%.2f%% of sentences have at most %d tokens" % (100 * profile.length_coverage(max_length), max_length))
+  print("\tunknown word rate %.4f" % profile.unk_rate())
+  if vocabulary is not None:
+    order = np.argsort(-profile.id_frequencies, kind="mergesort")[:top_words]
+    print("\tmost frequent: %s" % ", ".join("%s %.4f" % (vocabulary[i], profile.word_frequency(i)[1]) for i in order if i < len(vocabulary)))
+  if profile.byte_histogram is not None:
+    print("\t%d distinct bytes, %d non ascii" % (np.count_nonzero(profile.byte_histogram), np.count_nonzero(profile.byte_histogram[128:])))
+
+
+def report_sentence_pairs(source_ids_path, target_ids_path, source_vocabulary_size, target_vocabulary_size,
+                          max_source_length=None, max_target_length=None, workers=1):
+  #profile and report both sides of a corpus
+  source = profile_corpus(source_ids_path, source_vocabulary_size, workers=workers)
+  target = profile_corpus(target_ids_path, target_vocabulary_size, workers=workers)
+  report(source, "source %s" % source_ids_path, max_source_length)
+  report(target, "target %s" % target_ids_path, max_target_length)
+  return source, target
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Profile the two sides of an integerized corpus.")
+  parser.add_argument("source_ids_path")
+  parser.add_argument("target_ids_path")
+  parser.add_argument("--source_vocabulary", help="vocabulary file of the source side, to show its most frequent words")
+  parser.add_argument("--target_vocabulary", help="vocabulary file of the target side, to show its most frequent words")
+  parser.add_argument("--max_source_length", type=int)
+  parser.add_argument("--max_target_length", type=int)
+  parser.add_argument("--workers", type=int, default=1)
+  args = parser.parse_args()
+
+  for ids_path, vocabulary_path, max_length in ((args.source_ids_path, args.source_vocabulary, args.max_source_length),
+                                                (args.target_ids_path, args.target_vocabulary, args.max_target_length)):
+    vocabulary = vocabulary_utils.initialize_vocabulary(vocabulary_path)[1] if vocabulary_path else None
+    vocabulary_size = len(vocabulary) if vocabulary is not None else int(re.search(r"\.ids_(\d+)$", ids_path).group(1))
+    report(profile_corpus(ids_path, vocabulary_size, workers=args.workers), ids_path, max_length, vocabulary)
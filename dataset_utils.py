@@ -0,0 +1,885 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import os
+import re
+import struct
+
+import numpy as np
+from tensorflow.python.platform import gfile
+
+import artifact_utils
+
+#=================================================================
+#
+#	dataset_utils.py
+#
+#	On-disk formats for integerized corpora, and readers for them.
+#
+#	The text .ids_N files written by vocabulary_utils.integerize_sentences need an int() call per
+#	token every time they are loaded. The binary format below stores the same sentences as
+#
+#	  a 64 byte header    - magic, format version, token itemsize, vocabulary size,
+#	                        number of sentences, number of tokens, position of the offsets
+#	  tokens              - every token id of every sentence back to back, as uint16 when the
+#	                        vocabulary fits in it and uint32 otherwise
+#	  offsets             - int64, num_sentences + 1 of them. sentence i is tokens[offsets[i]:offsets[i+1]]
+#
+#	IntegerizedCorpus memory maps such a file, so opening it costs nothing no matter how big it
+#	is, and every sentence is a zero copy slice of the mapped token array. The files are written
+#	and mapped through the local filesystem since np.memmap needs a real file.
+#
+#	SentencePairDataset is the in-memory training set built from them: the same values plus
+#	offsets layout for each side, instead of a list of lists of python ints.
+#
+
+_BINARY_CORPUS_MAGIC = b"NMTIDS01"
+_BINARY_CORPUS_VERSION = 1
+_BINARY_CORPUS_HEADER = struct.Struct("<8sIIqqqq")
+_BINARY_CORPUS_HEADER_SIZE = 64
+
+
+def binary_corpus_path(ids_path):
+  #the binary version of an integerized text file lives right next to it
+  return ids_path + ".bin"
+
+
+def token_dtype_for_vocabulary(vocabulary_size):
+  return np.uint16 if vocabulary_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def parse_integerized_lines(lines):
+  """Parse a block of lines from a text integerized file into one array.
+
+  integerize_sentences writes " ".join(ids) + "\n", so a non empty line holds one more id than
+  it has spaces, and the whole block can be split and converted to one array in one call.
+
+  Returns:
+    a pair (ids, lengths): every id in the block as an int64 array, and the number of ids on each line
+  """
+  lengths = np.array([line.count(b" ") + 1 if len(line.strip()) else 0 for line in lines], dtype=np.int64)
+  try:
+    ids = np.array(b"".join(lines).split(), dtype=np.int64)
+  except ValueError:
+    raise ValueError("Unexpected formatting in integerized lines, found a token that is not an id")
+  if len(ids) != lengths.sum():
+    raise ValueError("Unexpected formatting in integerized lines, found %d ids where %d were expected" % (len(ids), lengths.sum()))
+  return ids, lengths
+
+
+class IntegerizedCorpusWriter(object):
+  """Writes sentences of token ids to the binary corpus format.
+
+  Use it as a context manager, or call close() when done. The header is filled in on close,
+  so a file that was never closed will not open as a corpus.
+  """
+
+  def __init__(self, path, vocabulary_size):
+    self.path = path
+    self.vocabulary_size = vocabulary_size
+    self.dtype = np.dtype(token_dtype_for_vocabulary(vocabulary_size))
+    self._offsets = [np.zeros(1, dtype=np.int64)]
+    self._num_tokens = 0
+    self._file = open(path, "wb")
+    self._file.write(b"\0" * _BINARY_CORPUS_HEADER_SIZE)
+
+  def write(self, token_ids):
+    #write a single sentence
+    self.write_block(np.asarray(token_ids, dtype=np.int64), np.array([len(token_ids)], dtype=np.int64))
+
+  def write_block(self, ids, lengths):
+    #write many sentences at once. ids holds all of their tokens back to back, lengths the size of each one
+    ids = np.asarray(ids)
+    if len(ids) and (ids.min() < 0 or ids.max() >= self.vocabulary_size):
+      raise ValueError("Token ids must be in [0, %d) to be written to %s" % (self.vocabulary_size, self.path))
+    self._file.write(ids.astype(self.dtype).tobytes())
+    self._offsets.append(self._num_tokens + np.cumsum(lengths, dtype=np.int64))
+    self._num_tokens += int(np.sum(lengths))
+
+  def close(self):
+    if self._file is None:
+      return
+    offsets = np.concatenate(self._offsets)
+    #keep the offsets 8 byte aligned so they can be mapped as int64
+    position = self._file.tell()
+    padding = (-position) % 8
+    self._file.write(b"\0" * padding)
+    offsets_position = position + padding
+    self._file.write(offsets.tobytes())
+
+    self._file.seek(0)
+    self._file.write(_BINARY_CORPUS_HEADER.pack(_BINARY_CORPUS_MAGIC, _BINARY_CORPUS_VERSION, self.dtype.itemsize,
+                                                self.vocabulary_size, len(offsets) - 1, self._num_tokens, offsets_position))
+    self._file.close()
+    self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      #don't leave a half written corpus behind that looks complete
+      self._file.close()
+      self._file = None
+      os.remove(self.path)
+
+
+class IntegerizedCorpus(object):
+  """Read only, memory mapped view of a binary integerized corpus.
+
+  corpus[i] is sentence i as a numpy array that points straight into the mapped file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, "rb") as f:
+      header = f.read(_BINARY_CORPUS_HEADER_SIZE)
+    if len(header) < _BINARY_CORPUS_HEADER.size:
+      raise ValueError("%s is too short to be a binary integerized corpus" % path)
+    magic, version, itemsize, vocabulary_size, num_sentences, num_tokens, offsets_position = _BINARY_CORPUS_HEADER.unpack(header[:_BINARY_CORPUS_HEADER.size])
+    if magic != _BINARY_CORPUS_MAGIC:
+      raise ValueError("%s is not a binary integerized corpus, or was never closed by its writer" % path)
+    if version != _BINARY_CORPUS_VERSION:
+      raise ValueError("%s has format version %d, but only version %d is supported" % (path, version, _BINARY_CORPUS_VERSION))
+
+    self.vocabulary_size = vocabulary_size
+    self.dtype = np.dtype({2: np.uint16, 4: np.uint32}[itemsize])
+    self.num_tokens = num_tokens
+    if num_tokens:
+      self.tokens = np.memmap(path, dtype=self.dtype, mode="r", offset=_BINARY_CORPUS_HEADER_SIZE, shape=(num_tokens,))
+    else:
+      self.tokens = np.zeros(0, dtype=self.dtype)
+    self.offsets = np.memmap(path, dtype=np.int64, mode="r", offset=offsets_position, shape=(num_sentences + 1,))
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("Sentence %d is out of range for a corpus of %d sentences" % (index, len(self)))
+    return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+  @property
+  def lengths(self):
+    #number of tokens in each sentence
+    return np.diff(self.offsets)
+
+
+def convert_integerized_file_to_binary(ids_path, output_path, vocabulary_size, block_size=200000, report_frequency=2000000):
+  """Write the binary version of a text integerized file, streaming it a block of lines at a time."""
+  print("Writing binary integerized corpus %s from %s" % (output_path, ids_path))
+  with artifact_utils.atomic_output(output_path) as temporary_path:
+    with gfile.GFile(ids_path, mode="rb") as source:
+      with IntegerizedCorpusWriter(temporary_path, vocabulary_size) as writer:
+        block = []
+        counter = 0
+        for line in source:
+          block.append(line)
+          counter += 1
+          if len(block) == block_size:
+            writer.write_block(*parse_integerized_lines(block))
+            block = []
+          if counter % report_frequency == 0:
+            print("Converted line %d" % counter)
+        if block:
+          writer.write_block(*parse_integerized_lines(block))
+  return output_path
+
+
+def record_binary_corpus(ids_path, vocabulary_size):
+  #write the manifest of the finished binary corpus of ids_path
+  artifact_utils.record(binary_corpus_path(ids_path), "binary", _BINARY_CORPUS_VERSION, [ids_path],
+                        {"vocabulary_size": vocabulary_size})
+
+
+def maybe_convert_integerized_file_to_binary(ids_path, vocabulary_size):
+  #writes the binary corpus next to ids_path unless an up to date one is already there. returns its path.
+  output_path = binary_corpus_path(ids_path)
+  if artifact_utils.is_current(output_path, "binary", _BINARY_CORPUS_VERSION, [ids_path],
+                               {"vocabulary_size": vocabulary_size}):
+    print("Binary integerized corpus %s already exists. Skipping this step..." % output_path)
+  else:
+    artifact_utils.invalidate(output_path)
+    convert_integerized_file_to_binary(ids_path, output_path, vocabulary_size)
+    record_binary_corpus(ids_path, vocabulary_size)
+  return output_path
+
+
+class SortedHashSet(object):
+  """A set of 64 bit hashes kept as one sorted uint64 array, 8 bytes per member instead of a python int and a set slot.
+
+  Hashes are added a block at a time. Only the block is sorted, and its new hashes are inserted into the array
+  at their searchsorted positions, a linear merge rather than a sort of the whole set. So a stream of n hashes
+  added in blocks of b costs O(n * n / b) copying, which numpy does at memory speed.
+  """
+
+  def __init__(self):
+    self.hashes = np.zeros(0, dtype=np.uint64)
+
+  def __len__(self):
+    return len(self.hashes)
+
+  def add_block(self, hashes):
+    """Add a block of hashes. Returns a boolean mask of the ones that were new, counting only the first of repeats in the block."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    values, first = np.unique(hashes, return_index=True)
+    #where each distinct hash of the block goes in the array, which also tells whether it is there already
+    positions = np.searchsorted(self.hashes, values)
+    present = np.zeros(len(values), dtype=bool)
+    if len(self.hashes):
+      present = self.hashes[np.minimum(positions, len(self.hashes) - 1)] == values
+    new = np.zeros(len(hashes), dtype=bool)
+    new[first[~present]] = True
+    self.hashes = np.insert(self.hashes, positions[~present], values[~present])
+    return new
+
+
+def _mix64(x):
+  #splitmix64's finalizer, a bijection on uint64 that spreads every input bit over the output. wraps around like the C.
+  x = x + np.uint64(0x9E3779B97F4A7C15)
+  x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+  x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+  return x ^ (x >> np.uint64(31))
+
+
+def _sentence_hashes(corpus, start, end):
+  #every token is mixed with its position in the sentence, and the mixed tokens of a sentence are summed, all
+  #vectorized over the block. a cumulative sum differenced at the offsets does the sums, empty sentences included.
+  offsets = np.asarray(corpus.offsets[start:end + 1], dtype=np.int64)
+  relative = offsets - offsets[0]
+  lengths = np.diff(offsets)
+  positions = np.arange(relative[-1], dtype=np.int64) - np.repeat(relative[:-1], lengths)
+  #tokens and positions are below 2^32, so this is one distinct uint64 for every (token, position)
+  keys = np.asarray(corpus.tokens[offsets[0]:offsets[-1]]).astype(np.uint64) | (positions.astype(np.uint64) << np.uint64(32))
+  sums = np.zeros(len(keys) + 1, dtype=np.uint64)
+  np.cumsum(_mix64(keys), out=sums[1:])
+  return sums[relative[1:]] - sums[relative[:-1]], lengths.astype(np.uint64)
+
+
+def pair_hashes(source_corpus, target_corpus, start, end, chunk_size=100000):
+  #64 bit hashes of the (source, target) pairs start to end of two aligned corpora, chunk_size pairs at a time. the
+  #lengths go into the hash so that moving a token from the end of the source to the start of the target changes it
+  hashes = []
+  for chunk_start in range(start, end, chunk_size):
+    chunk_end = min(chunk_start + chunk_size, end)
+    source_sums, source_lengths = _sentence_hashes(source_corpus, chunk_start, chunk_end)
+    target_sums, target_lengths = _sentence_hashes(target_corpus, chunk_start, chunk_end)
+    hashes.append(_mix64(_mix64(_mix64(source_sums ^ source_lengths) ^ target_sums) ^ target_lengths))
+  return np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+
+
+def deduplicated_path(ids_path):
+  #train.fr.clean.ids_40000 becomes train.fr.clean.dedup.ids_40000, so it is still named after its vocabulary size
+  return re.sub(r"(\.ids_\d+)$", r".dedup\1", ids_path) if re.search(r"\.ids_\d+$", ids_path) else ids_path + ".dedup"
+
+
+def _write_ids_lines(text_file, values, offsets):
+  for i in range(len(offsets) - 1):
+    text_file.write(b" ".join(str(token).encode("ascii") for token in values[offsets[i]:offsets[i + 1]].tolist()))
+    text_file.write(b"\n")
+
+
+def deduplicate_pairs(source_ids_path, target_ids_path, source_output_path, target_output_path, block_size=1000000,
+                      report_frequency=5000000):
+  """Write the pairs of two aligned integerized files without exact duplicate pairs, keeping the first of every repeat.
+
+  The binary corpora of both files are read a block of pairs at a time, every pair is hashed to 64 bits with
+  numpy (see pair_hashes) and checked against a SortedHashSet of the pairs seen so far. Both text and binary versions of the outputs are
+  written. Two different pairs share a hash with a probability of about n^2 / 2^65, which is negligible for
+  any corpus that fits on disk.
+
+  Returns:
+    a pair (pairs, duplicates), the number of pairs read and the number that were dropped
+  """
+  source_corpus = IntegerizedCorpus(binary_corpus_path(source_ids_path))
+  target_corpus = IntegerizedCorpus(binary_corpus_path(target_ids_path))
+  if len(source_corpus) != len(target_corpus):
+    raise ValueError("%s has %d sentences but %s has %d" % (source_ids_path, len(source_corpus), target_ids_path, len(target_corpus)))
+
+  seen = SortedHashSet()
+  duplicates = 0
+  with artifact_utils.atomic_output(source_output_path) as source_text_path, \
+       artifact_utils.atomic_output(target_output_path) as target_text_path, \
+       artifact_utils.atomic_output(binary_corpus_path(source_output_path)) as source_binary_path, \
+       artifact_utils.atomic_output(binary_corpus_path(target_output_path)) as target_binary_path:
+    with gfile.GFile(source_text_path, mode="wb") as source_text, gfile.GFile(target_text_path, mode="wb") as target_text, \
+         IntegerizedCorpusWriter(source_binary_path, source_corpus.vocabulary_size) as source_writer, \
+         IntegerizedCorpusWriter(target_binary_path, target_corpus.vocabulary_size) as target_writer:
+      for start in range(0, len(source_corpus), block_size):
+        end = min(start + block_size, len(source_corpus))
+        kept = np.nonzero(seen.add_block(pair_hashes(source_corpus, target_corpus, start, end)))[0] + start
+        duplicates += (end - start) - len(kept)
+        for corpus, text_file, writer in ((source_corpus, source_text, source_writer), (target_corpus, target_text, target_writer)):
+          values, offsets = _gather_ragged(corpus.tokens, corpus.offsets, kept)
+          _write_ids_lines(text_file, values, offsets)
+          writer.write_block(values, np.diff(offsets))
+        if end // report_frequency != start // report_frequency:
+          print("Deduplicated %d pairs, %d duplicates so far" % (end, duplicates))
+  return len(source_corpus), duplicates
+
+
+_DEDUPLICATION_VERSION = 1
+
+
+def maybe_deduplicate_pairs(source_ids_path, target_ids_path):
+  """The paths of the deduplicated versions of two aligned integerized files, writing them unless they are up to date.
+
+  The binary corpora of the inputs have to exist already (see maybe_convert_integerized_file_to_binary).
+  """
+  source_output_path, target_output_path = deduplicated_path(source_ids_path), deduplicated_path(target_ids_path)
+  inputs = [binary_corpus_path(source_ids_path), binary_corpus_path(target_ids_path)]
+  vocabulary_sizes = [IntegerizedCorpus(path).vocabulary_size for path in inputs]
+  #the binary outputs get the manifests maybe_convert_integerized_file_to_binary would give them, so it accepts them
+  if (all(artifact_utils.is_current(path, "deduplicate", _DEDUPLICATION_VERSION, inputs) for path in (source_output_path, target_output_path)) and
+      all(artifact_utils.is_current(binary_corpus_path(path), "binary", _BINARY_CORPUS_VERSION, [path], {"vocabulary_size": vocabulary_size})
+          for path, vocabulary_size in zip((source_output_path, target_output_path), vocabulary_sizes))):
+    details = artifact_utils.load_manifest(source_output_path)["details"]
+    print("Deduplicated pairs %s and %s already exist. Skipping this step..." % (source_output_path, target_output_path))
+  else:
+    print("Removing duplicate pairs from %s and %s" % (source_ids_path, target_ids_path))
+    for path in (source_output_path, target_output_path):
+      artifact_utils.invalidate(path, [line_index_path(path)])
+      artifact_utils.invalidate(binary_corpus_path(path))
+    pairs, duplicates = deduplicate_pairs(source_ids_path, target_ids_path, source_output_path, target_output_path)
+    details = {"pairs": pairs, "duplicates": duplicates}
+    for path, vocabulary_size in zip((source_output_path, target_output_path), vocabulary_sizes):
+      artifact_utils.record(path, "deduplicate", _DEDUPLICATION_VERSION, inputs, details=details)
+      record_binary_corpus(path, vocabulary_size)
+  print("%d of %d sentence pairs were exact duplicates (%.2f%%)" % (details["duplicates"], details["pairs"],
+                                                                    100. * details["duplicates"] / max(details["pairs"], 1)))
+  return source_output_path, target_output_path
+
+
+_LENGTHS_VERSION = 1
+
+
+def sentence_lengths_path(ids_path):
+  #the token count of every sentence of an integerized file is cached right next to it
+  return ids_path + ".lengths.npy"
+
+
+def count_line_tokens(ids_path, chunk_size=64 * 1024 * 1024):
+  """Number of ids on every line of a text integerized file, without parsing a single id.
+
+  A non empty line holds one more id than it has spaces (see parse_integerized_lines), so a chunk of the
+  file is counted with a cumulative sum of its spaces read at its line breaks.
+  """
+  lengths = []
+  carry = b""
+  with gfile.GFile(ids_path, mode="rb") as f:
+    while True:
+      chunk = f.read(chunk_size)
+      data = carry + chunk
+      if not chunk:
+        if data:
+          data += b"\n"
+        cut = len(data)
+      else:
+        cut = data.rfind(b"\n") + 1
+      carry = data[cut:]
+      block = np.frombuffer(data[:cut], dtype=np.uint8)
+      if len(block):
+        line_ends = np.flatnonzero(block == ord("\n"))
+        spaces = np.cumsum(block == ord(" "))[line_ends]
+        line_spaces = np.diff(np.concatenate([[0], spaces]))
+        line_bytes = np.diff(np.concatenate([[-1], line_ends])) - 1
+        lengths.append(np.where(line_bytes > 0, line_spaces + 1, 0))
+      if not chunk:
+        break
+  return np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+
+def sentence_lengths(ids_path):
+  """The number of tokens in every sentence of an integerized file, from its sidecar, which is written on first use.
+
+  The lengths come from the offsets of the binary corpus when it is up to date, and from counting the spaces
+  of the text file otherwise. They are stored in the smallest integer type that holds them.
+  """
+  path = sentence_lengths_path(ids_path)
+  if artifact_utils.is_current(path, "lengths", _LENGTHS_VERSION, [ids_path]):
+    return np.load(path)
+  binary_path = binary_corpus_path(ids_path)
+  if gfile.Exists(binary_path) and artifact_utils.is_current(binary_path, "binary", _BINARY_CORPUS_VERSION, [ids_path],
+                                                             {"vocabulary_size": IntegerizedCorpus(binary_path).vocabulary_size},
+                                                             verbose=False):
+    lengths = IntegerizedCorpus(binary_path).lengths
+  else:
+    lengths = count_line_tokens(ids_path)
+  lengths = lengths.astype(_smallest_token_dtype(lengths))
+  with artifact_utils.atomic_output(path) as temporary_path:
+    #through a file object, since np.save adds .npy to a name that doesn't end in it
+    with open(temporary_path, "wb") as f:
+      np.save(f, lengths)
+  artifact_utils.record(path, "lengths", _LENGTHS_VERSION, [ids_path])
+  return lengths
+
+
+class PairLengthHistogram(object):
+  """Number of sentence pairs for every (source length, target length), to see what length limits keep.
+
+  Lengths of max_length or more share the last bin, so limits are only exact below max_length. kept()
+  applies the same filter as load_dataset_in_memory, where the target gets an _EOS appended.
+  """
+
+  def __init__(self, source_lengths, target_lengths, max_length=1024):
+    assert len(source_lengths) == len(target_lengths), "Source has %d sentences but target has %d" % (len(source_lengths), len(target_lengths))
+    self.max_length = max_length
+    self.num_pairs = len(source_lengths)
+    source_bins = np.minimum(source_lengths, max_length).astype(np.int64)
+    target_bins = np.minimum(target_lengths, max_length).astype(np.int64)
+    histogram = np.bincount(source_bins * (max_length + 1) + target_bins, minlength=(max_length + 1) ** 2)
+    #cumulative[s, t] is the number of pairs with source length < s and target length < t
+    self.cumulative = np.zeros((max_length + 2, max_length + 2), dtype=np.int64)
+    self.cumulative[1:, 1:] = histogram.reshape(max_length + 1, max_length + 1).cumsum(0).cumsum(1)
+
+  def kept(self, max_source_sentence_length, max_target_sentence_length):
+    #number of pairs with source length <= max_source_sentence_length and target length + 1 < max_target_sentence_length
+    source_limit = max(0, min(max_source_sentence_length + 1, self.max_length))
+    target_limit = max(0, min(max_target_sentence_length - 1, self.max_length))
+    return int(self.cumulative[source_limit, target_limit])
+
+  def kept_ratio(self, max_source_sentence_length, max_target_sentence_length):
+    return self.kept(max_source_sentence_length, max_target_sentence_length) / float(max(self.num_pairs, 1))
+
+
+def _smallest_token_dtype(values):
+  return token_dtype_for_vocabulary(int(values.max()) + 1 if len(values) else 0)
+
+
+def _gather_ragged(tokens, offsets, indices, append_id=None):
+  """Copy the rows indices of a ragged (tokens, offsets) array into a new contiguous ragged array.
+
+  Every position is computed up front so the copy is one fancy indexing call. If append_id is given
+  it is added to the end of every row.
+
+  Returns:
+    a pair (values, row_offsets)
+  """
+  indices = np.asarray(indices, dtype=np.int64)
+  starts = np.asarray(offsets[indices], dtype=np.int64)
+  lengths = np.asarray(offsets[indices + 1], dtype=np.int64) - starts
+  out_lengths = lengths + (1 if append_id is not None else 0)
+
+  row_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+  np.cumsum(out_lengths, out=row_offsets[1:])
+
+  #position of every copied token within its row, then shifted to where the row starts in tokens
+  source_positions = np.arange(lengths.sum(), dtype=np.int64)
+  copied_row_starts = np.cumsum(lengths) - lengths
+  source_positions += np.repeat(starts - copied_row_starts, lengths)
+
+  destination_positions = np.arange(lengths.sum(), dtype=np.int64)
+  destination_positions += np.repeat(row_offsets[:-1] - copied_row_starts, lengths)
+
+  values = np.empty(row_offsets[-1], dtype=np.int64)
+  values[destination_positions] = tokens[source_positions]
+  if append_id is not None:
+    values[row_offsets[1:] - 1] = append_id
+  return values.astype(_smallest_token_dtype(values)), row_offsets
+
+
+class SentencePairDataset(object):
+  """Compact in-memory set of (source ids, target ids) training pairs.
+
+  Each side is a contiguous numpy array of token ids plus an int64 offsets array, so a pair costs
+  two or four bytes per token instead of a python int and a list slot per token. Sentence lengths
+  are precomputed for filtering and bucketing.
+
+  It behaves like the list of pairs it replaces: len(dataset), dataset[i] and random.choice(dataset)
+  all work, and dataset[i] gives back a (source_ids, target_ids) pair of python lists.
+  """
+
+  def __init__(self, source_values, source_offsets, target_values, target_offsets):
+    assert len(source_offsets) == len(target_offsets), "Source and target need the same number of sentences"
+    self.source_values = source_values
+    self.source_offsets = source_offsets
+    self.target_values = target_values
+    self.target_offsets = target_offsets
+    self.source_lengths = np.diff(source_offsets)
+    self.target_lengths = np.diff(target_offsets)
+
+  @classmethod
+  def from_corpora(cls, source_corpus, target_corpus, indices, target_append_id=None):
+    #builds the dataset from the pairs indices of two aligned IntegerizedCorpus files
+    source_values, source_offsets = _gather_ragged(source_corpus.tokens, source_corpus.offsets, indices)
+    target_values, target_offsets = _gather_ragged(target_corpus.tokens, target_corpus.offsets, indices, append_id=target_append_id)
+    return cls(source_values, source_offsets, target_values, target_offsets)
+
+  def __len__(self):
+    return len(self.source_offsets) - 1
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("Pair %d is out of range for a dataset of %d pairs" % (index, len(self)))
+    return self.source(index).tolist(), self.target(index).tolist()
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def source(self, index):
+    #the source sentence as a numpy view, without converting to python ints
+    return self.source_values[self.source_offsets[index]:self.source_offsets[index + 1]]
+
+  def target(self, index):
+    return self.target_values[self.target_offsets[index]:self.target_offsets[index + 1]]
+
+  @property
+  def nbytes(self):
+    return sum(a.nbytes for a in (self.source_values, self.source_offsets, self.target_values, self.target_offsets,
+                                   self.source_lengths, self.target_lengths))
+
+
+class SentencePairDatasetBuilder(object):
+  """Collects pairs one at a time into growing typed arrays, then freezes them into a SentencePairDataset."""
+
+  def __init__(self):
+    self._source_values = array.array("i")
+    self._target_values = array.array("i")
+    self._source_lengths = array.array("i")
+    self._target_lengths = array.array("i")
+
+  def append(self, source_ids, target_ids):
+    self._source_values.extend(source_ids)
+    self._target_values.extend(target_ids)
+    self._source_lengths.append(len(source_ids))
+    self._target_lengths.append(len(target_ids))
+
+  def __len__(self):
+    return len(self._source_lengths)
+
+  def build(self):
+    def freeze(values, lengths):
+      values = np.frombuffer(values, dtype=np.int32) if len(values) else np.zeros(0, dtype=np.int32)
+      offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+      if len(lengths):
+        np.cumsum(np.frombuffer(lengths, dtype=np.int32), out=offsets[1:])
+      return values.astype(_smallest_token_dtype(values)), offsets
+    source_values, source_offsets = freeze(self._source_values, self._source_lengths)
+    target_values, target_offsets = freeze(self._target_values, self._target_lengths)
+    return SentencePairDataset(source_values, source_offsets, target_values, target_offsets)
+
+
+_LINE_INDEX_MAGIC = b"NMTLIDX2"
+_LINE_INDEX_HEADER = struct.Struct("<8sqqq")
+
+
+def line_index_path(path):
+  #the persisted line index of a text file lives right next to it
+  return path + ".lineidx"
+
+
+class LineIndex(object):
+  """Byte offset of the start of every line in a text file.
+
+  With it, line i of a multi-GB file is one seek and one readline away, without reading anything before it.
+  Indexes are saved next to the file they describe (see for_file), as a small header holding the size and
+  mtime of the indexed file and the number of lines, followed by the int64 offsets.
+  """
+
+  def __init__(self, offsets, file_size, file_mtime=None):
+    self.offsets = offsets
+    self.file_size = file_size
+    self.file_mtime = file_mtime
+
+  @classmethod
+  def for_file(cls, path):
+    """Load the saved index for path, building and saving it first if it is missing or out of date.
+
+    An index is out of date when the size or mtime of the file changed since it was built, since a file
+    rewritten in place can keep its size while its lines move. Indexes in an older format are rebuilt too.
+    """
+    index_path = line_index_path(path)
+    stat = gfile.Stat(path)
+    if gfile.Exists(index_path):
+      try:
+        index = cls.load(index_path)
+      except ValueError:
+        index = None
+      if index is not None and index.file_size == stat.length and index.file_mtime == stat.mtime_nsec:
+        return index
+      print("Line index %s is out of date. Rebuilding it." % index_path)
+    else:
+      print("Building line index %s" % index_path)
+    index = cls.build(path)
+    index.save(index_path)
+    return index
+
+  @classmethod
+  def load(cls, index_path):
+    with open(index_path, "rb") as f:
+      header = f.read(_LINE_INDEX_HEADER.size)
+    if len(header) < _LINE_INDEX_HEADER.size or header[:len(_LINE_INDEX_MAGIC)] != _LINE_INDEX_MAGIC:
+      raise ValueError("%s is not a line index, or was written in an older format" % index_path)
+    _, file_size, file_mtime, num_lines = _LINE_INDEX_HEADER.unpack(header)
+    if num_lines:
+      offsets = np.memmap(index_path, dtype=np.int64, mode="r", offset=_LINE_INDEX_HEADER.size, shape=(num_lines,))
+    else:
+      offsets = np.zeros(0, dtype=np.int64)
+    return cls(offsets, file_size, file_mtime)
+
+  def save(self, index_path):
+    #written through artifact_utils.atomic_output, so an interrupted save never leaves a truncated index
+    with artifact_utils.atomic_output(index_path) as temporary_path:
+      with gfile.GFile(temporary_path, mode="wb") as f:
+        f.write(_LINE_INDEX_HEADER.pack(_LINE_INDEX_MAGIC, self.file_size, self.file_mtime or 0, len(self.offsets)))
+        f.write(np.asarray(self.offsets, dtype=np.int64).tobytes())
+
+  def line_start(self, line_number):
+    #byte offset where line_number starts. asking for the line after the last one gives the end of the file
+    if line_number >= len(self.offsets):
+      return self.file_size
+    return int(self.offsets[line_number])
+
+  @classmethod
+  def build(cls, path, chunk_size=64 * 1024 * 1024):
+    #finds the line breaks a chunk at a time with numpy rather than one readline call per line
+    #the mtime is taken before reading, so a file that changes while it is indexed looks out of date afterwards
+    file_mtime = gfile.Stat(path).mtime_nsec
+    line_starts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with gfile.GFile(path, mode="rb") as f:
+      while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+          break
+        line_breaks = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord(b"\n"))
+        line_starts.append(line_breaks.astype(np.int64) + position + 1)
+        position += len(chunk)
+    offsets = np.concatenate(line_starts)
+    #a line break at the very end of the file doesn't start another line
+    if len(offsets) > 1 and offsets[-1] == position:
+      offsets = offsets[:-1]
+    elif position == 0:
+      offsets = offsets[:0]
+    return cls(offsets, position, file_mtime)
+
+  def __len__(self):
+    return len(self.offsets)
+
+
+class TextIntegerizedCorpus(object):
+  """Random access to the sentences of a text integerized file through a LineIndex.
+
+  It indexes like IntegerizedCorpus, but every access is a seek into the file, so nothing but the
+  index is held in memory.
+  """
+
+  def __init__(self, path, line_index=None):
+    self.path = path
+    self.line_index = line_index if line_index is not None else LineIndex.for_file(path)
+    self._file = gfile.GFile(path, mode="rb")
+
+  def __len__(self):
+    return len(self.line_index)
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("Sentence %d is out of range for a corpus of %d sentences" % (index, len(self)))
+    self._file.seek(int(self.line_index.offsets[index]))
+    return np.array(self._file.readline().split(), dtype=np.int64)
+
+  def close(self):
+    self._file.close()
+
+
+def open_integerized_corpus(ids_path):
+  #the memory mapped binary corpus if it has been written, otherwise the text file through its saved line index
+  binary_path = binary_corpus_path(ids_path)
+  if gfile.Exists(binary_path):
+    return IntegerizedCorpus(binary_path)
+  return TextIntegerizedCorpus(ids_path)
+
+
+class StreamingSentencePairSource(object):
+  """Samples random training pairs from aligned integerized files without loading them.
+
+  Pairs are drawn uniformly from the window [start, start + max_size) of the files, and the ones that
+  do not fit the length limits are thrown away, the same filter load_dataset_in_memory applies. Only a
+  buffer of buffer_size pairs is held in memory at a time. Refilling it reads a sorted batch of random
+  lines, so the disk is walked forwards rather than jumped around.
+  """
+
+  def __init__(self,
+               source_corpus,
+               target_corpus,
+               max_source_sentence_length,
+               max_target_sentence_length,
+               start=0,
+               max_size=None,
+               buffer_size=10000,
+               target_append_id=None,
+               seed=None,
+               max_refill_attempts=100):
+    assert len(source_corpus) == len(target_corpus), "Source file has %d sentences but target file has %d" % (len(source_corpus), len(target_corpus))
+    self.source_corpus = source_corpus
+    self.target_corpus = target_corpus
+    self.max_source_sentence_length = max_source_sentence_length
+    self.max_target_sentence_length = max_target_sentence_length
+    self.start = min(start, len(source_corpus))
+    self.end = len(source_corpus) if not max_size else min(len(source_corpus), self.start + max_size)
+    if self.end <= self.start:
+      raise ValueError("No sentence pairs left in the files after skipping the first %d" % start)
+    self.buffer_size = buffer_size
+    self.target_append_id = target_append_id
+    self.max_refill_attempts = max_refill_attempts
+    self._random = np.random.RandomState(seed)
+    self._buffer = []
+    self.used_sentence_pairs = 0
+    self.unused_sentence_pairs = 0
+    self.consumed = 0
+
+  def __len__(self):
+    #number of candidate pairs in the window, before the length filter
+    return self.end - self.start
+
+  def _refill(self):
+    for _ in range(self.max_refill_attempts):
+      indices = np.sort(self._random.randint(self.start, self.end, size=self.buffer_size))
+      for i in indices:
+        source_ids = self.source_corpus[i].tolist()
+        target_ids = self.target_corpus[i].tolist()
+        if self.target_append_id is not None:
+          target_ids.append(self.target_append_id)
+        #same comparison as load_dataset_in_memory: the target gets a _GO symbol prepended later
+        if len(source_ids) <= self.max_source_sentence_length and len(target_ids) < self.max_target_sentence_length:
+          self._buffer.append((source_ids, target_ids))
+          self.used_sentence_pairs += 1
+        else:
+          self.unused_sentence_pairs += 1
+      if self._buffer:
+        self._random.shuffle(self._buffer)
+        return
+    raise ValueError("No sentence pairs within the length limits (%d, %d) were found after sampling %d pairs" %
+                     (self.max_source_sentence_length, self.max_target_sentence_length, self.max_refill_attempts * self.buffer_size))
+
+  def sample(self, size):
+    #returns a list of size random (source_ids, target_ids) pairs
+    pairs = []
+    while len(pairs) < size:
+      if not self._buffer:
+        self._refill()
+      pairs.append(self._buffer.pop())
+    self.consumed += size
+    return pairs
+
+  def report_consumed(self):
+    print("\tconsumed %d training pairs from %s" % (self.consumed, self.source_corpus.path))
+
+
+class MixedSentencePairSource(object):
+  """Samples training pairs from several corpora at once, each with a sampling weight.
+
+  Every batch is split between the corpora with a multinomial draw over the normalized weights, and each
+  part is drawn from that corpus's own StreamingSentencePairSource. So the corpora are read lazily where
+  they are, through their binary files or line indexes, instead of being concatenated into one file, and
+  each of them holds its own buffer.
+  """
+
+  def __init__(self, sources, weights, names=None, seed=None):
+    assert len(sources) == len(weights) and len(sources) > 0, "Every corpus needs a weight"
+    weights = np.asarray(weights, dtype=np.float64)
+    if (weights < 0).any() or weights.sum() <= 0:
+      raise ValueError("Corpus weights must be non negative and not all zero, got %s" % weights.tolist())
+    self.sources = sources
+    self.probabilities = weights / weights.sum()
+    self.names = names if names is not None else [source.source_corpus.path for source in sources]
+    self.consumed = np.zeros(len(sources), dtype=np.int64)
+    self._random = np.random.RandomState(seed)
+
+  def __len__(self):
+    return sum(len(source) for source in self.sources)
+
+  def sample(self, size):
+    #returns a list of size random (source_ids, target_ids) pairs, drawn from the corpora by weight
+    counts = self._random.multinomial(size, self.probabilities)
+    pairs = []
+    for source, count in zip(self.sources, counts):
+      if count:
+        pairs.extend(source.sample(count))
+    self.consumed += counts
+    self._random.shuffle(pairs)
+    return pairs
+
+  def report_consumed(self):
+    total = max(int(self.consumed.sum()), 1)
+    for name, consumed, probability in zip(self.names, self.consumed, self.probabilities):
+      print("\tconsumed %d training pairs (%.2f%%, weight %.2f%%) from %s" % (consumed, 100. * consumed / total, 100. * probability, name))
+
+
+class ReservoirSampler(object):
+  """Uniform random sample of size items from a stream of unknown length, in one pass (Li's Algorithm L).
+
+  Instead of drawing a random number for every item, it draws how many items to skip before the next
+  one that enters the sample, so items that are skipped never need to be built. For every item of the
+  stream call next_slot(), and only if it returns a slot build the item and put() it there. When the
+  items come in blocks, take() does the same for a whole block.
+  """
+
+  def __init__(self, size, seed=None):
+    self.size = size
+    self.items = []
+    self.seen = 0
+    self._random = np.random.RandomState(seed)
+    self._weight = 1.
+    self._next = size
+
+  def _uniform(self):
+    #in (0, 1), so its log is finite
+    value = 0.
+    while value == 0.:
+      value = self._random.random_sample()
+    return value
+
+  def _skip(self):
+    #the position of the next item that enters the full reservoir
+    self._weight *= np.exp(np.log(self._uniform()) / self.size)
+    self._next += int(np.floor(np.log(self._uniform()) / np.log1p(-self._weight))) + 1
+
+  def next_slot(self):
+    """Count one more item of the stream. Returns the slot it takes in the sample, or None if it isn't sampled."""
+    taken = self.take(1)
+    return taken[0][1] if taken else None
+
+  def take(self, count):
+    """Count the next count items of the stream at once, in time proportional to the number sampled.
+
+    Returns:
+      a list of (offset, slot) for the items that enter the sample, offset counting from the first of the
+      count items. Items are put() in this order, since a later one can take the slot of an earlier one.
+    """
+    taken = []
+    position = self.seen
+    end = self.seen + count
+    self.seen = end
+    while position < end and self.size > 0:
+      if position < self.size:
+        slot = position
+        if position == self.size - 1:
+          self._next = position
+          self._skip()
+      elif self._next < end:
+        position = self._next
+        self._skip()
+        slot = self._random.randint(self.size)
+      else:
+        break
+      taken.append((position - (end - count), slot))
+      position += 1
+    return taken
+
+  def put(self, slot, item):
+    if slot == len(self.items):
+      self.items.append(item)
+    else:
+      self.items[slot] = item
@@ -19,29 +19,257 @@ from __future__ import division
 from __future__ import print_function
 
 import gzip
+import hashlib
 import os
 import tarfile
+import threading
+from multiprocessing.pool import ThreadPool
 
+from six.moves import http_client
+from six.moves import queue
 from six.moves import urllib
 from tensorflow.python.platform import gfile
 import tensorflow as tf
 
+import artifact_utils
+
 
 # URLs for WMT data.
 _WMT_ENFR_TRAIN_URL = "http://www.statmt.org/wmt10/training-giga-fren.tar"
 _WMT_ENFR_DEV_URL = "http://www.statmt.org/wmt15/dev-v2.tgz"
 
-def maybe_download(directory, filename, url):
-  """Download filename from url unless it's already in directory."""
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+_DOWNLOAD_READ_SIZE = 1024 * 1024
+_DOWNLOAD_RETRIES = 5
+_DOWNLOAD_ERRORS = (IOError, OSError, http_client.HTTPException)
+
+
+def mirror_url(url, mirror_base_url=None):
+  """The address of url on a mirror that serves the same paths as the original host.
+
+  ie with mirror_base_url http://fileserver:8000/wmt, http://www.statmt.org/wmt15/dev-v2.tgz is fetched from
+  http://fileserver:8000/wmt/wmt15/dev-v2.tgz. A file:// base URL works too.
+  """
+  if not mirror_base_url:
+    return url
+  return mirror_base_url.rstrip("/") + urllib.parse.urlparse(url).path
+
+
+def parse_checksums(spec):
+  #parses "filename:sha256,filename:sha256" into a dictionary
+  checksums = {}
+  for entry in spec.split(","):
+    if entry.strip():
+      filename, digest = entry.strip().rsplit(":", 1)
+      checksums[filename] = digest.lower()
+  return checksums
+
+
+def _open_url(url, start=None, end=None, timeout=60):
+  #opens url, asking for the byte range [start, end) if start is given
+  request = urllib.request.Request(url)
+  if start is not None:
+    request.add_header("Range", "bytes=%d-%s" % (start, "" if end is None else end - 1))
+  return urllib.request.urlopen(request, timeout=timeout)
+
+
+def _probe_url(url):
+  #returns the size of the file at url (None if the server doesn't say) and whether it honours range requests
+  response = _open_url(url, 0, 1)
+  try:
+    content_range = response.info().get("Content-Range")
+    if response.getcode() == 206 and content_range:
+      total = content_range.split("/")[-1].strip()
+      #"bytes 0-0/*" is a range without a size, which can't be split into chunks
+      return (int(total), True) if total.isdigit() else (None, False)
+    length = response.info().get("Content-Length")
+    return (int(length) if length else None), False
+  finally:
+    response.close()
+
+
+class _DownloadProgress(object):
+  #thread safe byte counter that prints every 5% of the download
+
+  def __init__(self, filename, total_bytes, done_bytes=0):
+    self.filename = filename
+    self.total_bytes = total_bytes
+    self.done_bytes = done_bytes
+    self._lock = threading.Lock()
+    self._last_report = -1
+
+  def add(self, num_bytes):
+    with self._lock:
+      self.done_bytes += num_bytes
+      if self.total_bytes:
+        percent = 100 * self.done_bytes // self.total_bytes
+        if percent // 5 > self._last_report:
+          self._last_report = percent // 5
+          print("Downloaded %d%% of %s (%d of %d bytes)" % (percent, self.filename, self.done_bytes, self.total_bytes))
+
+
+def _copy_response(response, out, progress):
+  #copies the body of response to out, returning the number of bytes copied
+  copied = 0
+  while True:
+    data = response.read(_DOWNLOAD_READ_SIZE)
+    if not data:
+      return copied
+    out.write(data)
+    copied += len(data)
+    progress.add(len(data))
+
+
+def _fetch_chunk(job):
+  #downloads the byte range [start, end) of url into the same range of part_path, retrying on errors
+  url, part_path, start, end, progress = job
+  for attempt in range(1, _DOWNLOAD_RETRIES + 1):
+    copied = 0
+    try:
+      response = _open_url(url, start, end)
+      try:
+        if response.getcode() != 206:
+          raise IOError("%s stopped honouring range requests" % url)
+        with open(part_path, "r+b") as out:
+          out.seek(start)
+          copied = _copy_response(response, out, progress)
+      finally:
+        response.close()
+      if copied != end - start:
+        raise IOError("got %d of the %d bytes asked for" % (copied, end - start))
+      return start
+    except _DOWNLOAD_ERRORS as e:
+      progress.add(-copied)
+      if attempt == _DOWNLOAD_RETRIES:
+        raise
+      print("Fetching bytes %d-%d of %s failed (%s). Retrying." % (start, end, url, e))
+
+
+def _download_in_chunks(url, filepath, part_path, size, connections):
+  """Download url into part_path in chunks fetched by several connections at once.
+
+  Every finished chunk is saved in a checkpoint, so a download that died resumes with the chunks it was
+  missing. The checkpoint is keyed by the file name and size rather than the url, so switching mirrors
+  keeps the progress.
+  """
+  key = {"filename": os.path.basename(filepath), "size": size, "chunk_size": _DOWNLOAD_CHUNK_SIZE}
+  chunks = [(start, min(start + _DOWNLOAD_CHUNK_SIZE, size)) for start in range(0, size, _DOWNLOAD_CHUNK_SIZE)]
+
+  state = artifact_utils.load_checkpoint(filepath, key)
+  done = set(state["done"]) if state is not None and gfile.Exists(part_path) else set()
+  if not gfile.Exists(part_path):
+    open(part_path, "wb").close()
+  with open(part_path, "r+b") as part_file:
+    #a sparse file of the final size, so every chunk can be written at its own offset
+    part_file.truncate(size)
+
+  pending = [(start, end) for start, end in chunks if start not in done]
+  if done:
+    print("Resuming download of %s, %d of %d chunks left" % (filepath, len(pending), len(chunks)))
+  progress = _DownloadProgress(os.path.basename(filepath), size, size - sum(end - start for start, end in pending))
+  pool = ThreadPool(processes=max(1, min(connections, len(pending))))
+  try:
+    jobs = [(url, part_path, start, end, progress) for start, end in pending]
+    for start in pool.imap_unordered(_fetch_chunk, jobs):
+      done.add(start)
+      artifact_utils.save_checkpoint(filepath, key, {"done": sorted(done)})
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _download_whole(url, filepath, part_path, size):
+  #for servers that don't honour range requests. there is nothing to resume from, so it starts over every time.
+  response = _open_url(url)
+  try:
+    with open(part_path, "wb") as out:
+      _copy_response(response, out, _DownloadProgress(os.path.basename(filepath), size))
+  finally:
+    response.close()
+
+
+def _file_sha256(path):
+  sha256 = hashlib.sha256()
+  with open(path, "rb") as f:
+    while True:
+      block = f.read(16 * 1024 * 1024)
+      if not block:
+        return sha256.hexdigest()
+      sha256.update(block)
+
+
+def maybe_download(directory, filename, url, sha256=None, mirror_base_url=None, connections=4):
+  """Download filename from url unless it's already in directory.
+
+  The file is fetched into filename + ".part" and only renamed once its size, and its sha256 if one is
+  given, have been checked. A download manifest is written next to it then (see artifact_utils), which is
+  what marks the file as complete. When the server honours range requests the file is fetched in chunks
+  over several connections, and an interrupted download resumes with the chunks it was missing.
+
+  A file that is already in directory without a manifest is kept if it has the expected sha256, or
+  without checking if no sha256 is given, and the server is not contacted.
+
+  Args:
+    directory: where to put the file.
+    filename: name of the file in directory.
+    url: where to download it from.
+    sha256: expected sha256 hex digest of the file, or None to only check its size.
+    mirror_base_url: fetch the file from this mirror instead of the host in url (see mirror_url).
+    connections: number of chunks fetched at once.
+
+  Returns:
+    the path to the file
+
+  Raises:
+    ValueError: if the downloaded file does not have the expected size or sha256.
+  """
   if not os.path.exists(directory):
     print("Creating directory %s" % directory)
     os.mkdir(directory)
   filepath = os.path.join(directory, filename)
-  if not os.path.exists(filepath):
-    print("Downloading %s to %s" % (url, filepath))
-    filepath, _ = urllib.request.urlretrieve(url, filepath)
-    statinfo = os.stat(filepath)
-    print("Successfully downloaded", filename, statinfo.st_size, "bytes")
+  params = {"sha256": sha256} if sha256 else {}
+  if artifact_utils.is_current(filepath, "download", 1, [], params, verbose=False):
+    return filepath
+
+  if gfile.Exists(filepath):
+    #downloaded before downloads had manifests. files are only renamed into place once complete.
+    if sha256 is None:
+      print("%s already exists. Keeping it." % filepath)
+      artifact_utils.record(filepath, "download", 1, [], params)
+      return filepath
+    digest = _file_sha256(filepath)
+    if digest == sha256.lower():
+      print("%s has the expected sha256. Keeping it." % filepath)
+      artifact_utils.record(filepath, "download", 1, [], params)
+      return filepath
+    print("sha256 of %s is %s but expected %s. Downloading it again." % (filepath, digest, sha256))
+    gfile.Remove(filepath)
+
+  source_url = mirror_url(url, mirror_base_url)
+  size, ranges = _probe_url(source_url)
+  part_path = filepath + ".part"
+  print("Downloading %s to %s" % (source_url, filepath))
+  if ranges:
+    _download_in_chunks(source_url, filepath, part_path, size, connections)
+  else:
+    _download_whole(source_url, filepath, part_path, size)
+
+  downloaded_size = gfile.Stat(part_path).length
+  if size is not None and downloaded_size != size:
+    gfile.Remove(part_path)
+    artifact_utils.remove_checkpoint(filepath)
+    raise ValueError("Downloaded %d bytes of %s but expected %d" % (downloaded_size, source_url, size))
+  if sha256 is not None:
+    digest = _file_sha256(part_path)
+    if digest != sha256.lower():
+      gfile.Remove(part_path)
+      artifact_utils.remove_checkpoint(filepath)
+      raise ValueError("sha256 of %s is %s but expected %s" % (source_url, digest, sha256))
+
+  gfile.Rename(part_path, filepath, overwrite=True)
+  artifact_utils.remove_checkpoint(filepath)
+  artifact_utils.record(filepath, "download", 1, [], params)
+  print("Successfully downloaded", filename, downloaded_size, "bytes")
   return filepath
 
 
@@ -54,45 +282,154 @@ def gunzip_file(gz_path, new_path):
         new_file.write(line)
 
 
-def get_wmt_enfr_train_set(directory):
-  """Download the WMT en-fr training corpus to directory unless it's there."""
+def is_gzip_file(path):
+  return path.endswith(".gz")
+
+
+class GzipLineReader(object):
+  """Iterates over the lines of a gzipped file, decompressing it on a background thread.
+
+  The thread inflates the file a chunk at a time and hands blocks of whole lines to the reader through
+  a bounded queue. zlib releases the GIL while it inflates, so decompression overlaps with whatever the
+  reader does with the lines, and at most max_queued_blocks chunks worth of lines are held in memory.
+  Lines keep their line breaks, like iterating over a file does.
+  """
+
+  def __init__(self, path, chunk_size=1024 * 1024, max_queued_blocks=16):
+    self.path = path
+    self._queue = queue.Queue(maxsize=max_queued_blocks)
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._inflate, args=(chunk_size,))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    #waits for room in the queue, unless the reader has been closed. returns False if it was.
+    while not self._stop.is_set():
+      try:
+        self._queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _inflate(self, chunk_size):
+    try:
+      with gzip.open(self.path, "rb") as gz_file:
+        remainder = b""
+        while True:
+          chunk = gz_file.read(chunk_size)
+          if not chunk:
+            break
+          lines = (remainder + chunk).split(b"\n")
+          remainder = lines.pop()
+          if lines and not self._put([line + b"\n" for line in lines]):
+            return
+        if remainder:
+          self._put([remainder])
+      self._put(None)
+    except Exception as e:
+      #handed to the reader, which raises it
+      self._put(e)
+
+  def __iter__(self):
+    while True:
+      block = self._queue.get()
+      if block is None:
+        return
+      if isinstance(block, Exception):
+        raise block
+      for line in block:
+        yield line
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def _maybe_download_wmt_file(directory, filename, url, checksums=None, **download_options):
+  #download_options are passed on to maybe_download. checksums maps file names to their expected sha256.
+  return maybe_download(directory, filename, url, sha256=(checksums or {}).get(filename), **download_options)
+
+
+def _extract_wmt_enfr_train_tar(directory, **download_options):
+  #downloads the training tar and extracts the two gzipped files in it
+  corpus_file = _maybe_download_wmt_file(directory, "training-giga-fren.tar",
+                                         _WMT_ENFR_TRAIN_URL, **download_options)
+  print("Extracting tar file %s" % corpus_file)
+  with tarfile.open(corpus_file, "r") as corpus_tar:
+    def is_within_directory(directory, target):
+        
+        abs_directory = os.path.abspath(directory)
+        abs_target = os.path.abspath(target)
+    
+        prefix = os.path.commonprefix([abs_directory, abs_target])
+        
+        return prefix == abs_directory
+    
+    #no keyword only arguments and no numeric_owner, which python 2's tarfile doesn't have
+    def safe_extract(tar, path=".", members=None):
+    
+        for member in tar.getmembers():
+            member_path = os.path.join(path, member.name)
+            if not is_within_directory(path, member_path):
+                raise Exception("Attempted Path Traversal in Tar File")
+    
+        tar.extractall(path, members) 
+        
+    
+    safe_extract(corpus_tar, directory)
+
+
+def get_wmt_enfr_train_set(directory, **download_options):
+  """Download the WMT en-fr training corpus to directory unless it's there.
+
+  download_options are mirror_base_url, connections and checksums, a dictionary of the expected sha256
+  of each downloaded file by name (see maybe_download).
+  """
   train_path = os.path.join(directory, "giga-fren.release2.fixed")
   if not (gfile.Exists(train_path +".fr") and gfile.Exists(train_path +".en")):
-    corpus_file = maybe_download(directory, "training-giga-fren.tar",
-                                 _WMT_ENFR_TRAIN_URL)
-    print("Extracting tar file %s" % corpus_file)
-    with tarfile.open(corpus_file, "r") as corpus_tar:
-      def is_within_directory(directory, target):
-          
-          abs_directory = os.path.abspath(directory)
-          abs_target = os.path.abspath(target)
-      
-          prefix = os.path.commonprefix([abs_directory, abs_target])
-          
-          return prefix == abs_directory
-      
-      def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-      
-          for member in tar.getmembers():
-              member_path = os.path.join(path, member.name)
-              if not is_within_directory(path, member_path):
-                  raise Exception("Attempted Path Traversal in Tar File")
-      
-          tar.extractall(path, members, numeric_owner=numeric_owner) 
-          
-      
-      safe_extract(corpus_tar, directory)
+    if not (gfile.Exists(train_path + ".fr.gz") and gfile.Exists(train_path + ".en.gz")):
+      _extract_wmt_enfr_train_tar(directory, **download_options)
     gunzip_file(train_path + ".fr.gz", train_path + ".fr")
     gunzip_file(train_path + ".en.gz", train_path + ".en")
   return train_path
 
 
-def get_wmt_enfr_dev_set(directory):
-  """Download the WMT en-fr training corpus to directory unless it's there."""
+def get_wmt_enfr_train_files(directory, decompress=True, **download_options):
+  """Download the WMT en-fr training corpus to directory unless it's there.
+
+  download_options are as for get_wmt_enfr_train_set.
+
+  Returns:
+    the paths of the english and the french training files. If decompress is False and the corpus was
+    not decompressed by an earlier run, these are the .gz files, which vocabulary_utils reads as streams
+    (see GzipLineReader) instead of writing the uncompressed corpus to disk first.
+  """
+  train_path = os.path.join(directory, "giga-fren.release2.fixed")
+  if decompress or (gfile.Exists(train_path + ".fr") and gfile.Exists(train_path + ".en")):
+    get_wmt_enfr_train_set(directory, **download_options)
+    return train_path + ".en", train_path + ".fr"
+  if not (gfile.Exists(train_path + ".fr.gz") and gfile.Exists(train_path + ".en.gz")):
+    _extract_wmt_enfr_train_tar(directory, **download_options)
+  return train_path + ".en.gz", train_path + ".fr.gz"
+
+
+def get_wmt_enfr_dev_set(directory, **download_options):
+  """Download the WMT en-fr training corpus to directory unless it's there.
+
+  download_options are as for get_wmt_enfr_train_set.
+  """
   dev_name = "newstest2013"
   dev_path = os.path.join(directory, dev_name)
   if not (gfile.Exists(dev_path + ".fr") and gfile.Exists(dev_path + ".en")):
-    dev_file = maybe_download(directory, "dev-v2.tgz", _WMT_ENFR_DEV_URL)
+    dev_file = _maybe_download_wmt_file(directory, "dev-v2.tgz", _WMT_ENFR_DEV_URL, **download_options)
     print("Extracting tgz file %s" % dev_file)
     with tarfile.open(dev_file, "r:gz") as dev_tar:
       fr_dev_file = dev_tar.getmember("dev/" + dev_name + ".fr")
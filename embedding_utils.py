@@ -0,0 +1,362 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from tensorflow.python.platform import gfile
+
+import artifact_utils
+
+#=================================================================
+#
+#	embedding_utils.py
+#
+#	Pretrained word vectors, aligned to our vocabulary files.
+#
+#	An embedding file holds vectors for millions of words, of which a vocabulary uses a few tens of
+#	thousands. load_pretrained_matrix reads it once, keeps only the vocabulary words, and saves the
+#	result as a .npy matrix whose row i is the vector of vocabulary id i. The matrix is named after a
+#	hash of the vocabulary, the embedding file and the sizes, and has an artifact manifest, so every
+#	later graph build memory maps it instead of reading the embedding file again.
+#
+#	Readers, one per format, copy the vectors of the vocabulary words into the matrix:
+#
+#	  glove           text, "word v1 ... vn" per line
+#	  word2vec .bin   "count dim" header line, then "word " and dim little endian float32 per word
+#	  fasttext .bin   a fastText model: its dictionary and input matrix, see read_fasttext_model
+#	  .vec / .txt     text with a "count dim" header line, as word2vec and fastText write them
+#
+#	The binary files are memory mapped and only the rows of vocabulary words are ever read.
+#
+
+_EMBEDDING_CACHE_VERSION = 1
+_PARSE_BLOCK_LINES = 10000
+
+
+def read_vocabulary_words(vocabulary_path, limit=None):
+  #the words of a vocabulary file in id order, as written by vocabulary_utils.create_vocabulary
+  words = []
+  with gfile.GFile(vocabulary_path, mode="rb") as f:
+    for line in f:
+      words.append(line.strip())
+      if limit is not None and len(words) == limit:
+        break
+  return words
+
+
+def embedding_cache_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size):
+  """Where the matrix of embedding_path aligned to vocabulary_path is cached, next to the vocabulary.
+
+  The name holds a hash of the vocabulary contents and of the embedding file's name and size, so changing
+  either one gives a different file instead of a stale matrix.
+  """
+  key = json.dumps({"vocabulary": artifact_utils.file_hash(vocabulary_path),
+                    "embedding_file": os.path.abspath(embedding_path),
+                    "embedding_size": gfile.Stat(embedding_path).length,
+                    "algorithm": algorithm,
+                    "num_symbols": num_symbols,
+                    "embed_size": embed_size}, sort_keys=True)
+  return "%s.%s_%s.npy" % (vocabulary_path, algorithm, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+
+def _parse_vector_block(rests, embed_size, embedding_path):
+  #parses the vector parts of a block of lines in one call, like dataset_utils.parse_integerized_lines
+  values = np.fromstring(b" ".join(rests), dtype=np.float32, sep=" ")
+  if len(values) != len(rests) * embed_size:
+    raise ValueError("Expected %d dimensional vectors in %s, but a block of %d lines held %d values" %
+                     (embed_size, embedding_path, len(rests), len(values)))
+  return values.reshape(len(rests), embed_size)
+
+
+def read_text_vectors(embedding_path, word_ids, matrix, skip_header=False):
+  """Copy the vectors of the words in word_ids from a text embedding file into their rows of matrix.
+
+  Lines are "word v1 v2 ... vn", as GloVe and the .vec files of fastText write them. Only the lines of
+  wanted words are kept, and their vectors are parsed a block at a time by numpy, so the millions of other
+  lines are never turned into floats.
+
+  Returns:
+    a boolean array, True for the rows of matrix that were found
+  """
+  found = np.zeros(len(matrix), dtype=bool)
+  rows, rests = [], []
+  with gfile.GFile(embedding_path, mode="rb") as f:
+    if skip_header:
+      f.readline()
+    for line in f:
+      word, _, rest = line.rstrip(b"\r\n").partition(b" ")
+      row = word_ids.get(word)
+      if row is None or found[row]:
+        continue
+      found[row] = True
+      rows.append(row)
+      rests.append(rest)
+      if len(rows) == _PARSE_BLOCK_LINES:
+        matrix[rows] = _parse_vector_block(rests, matrix.shape[1], embedding_path)
+        rows, rests = [], []
+  if rows:
+    matrix[rows] = _parse_vector_block(rests, matrix.shape[1], embedding_path)
+  return found
+
+
+def read_text_vectors_with_header(embedding_path, word_ids, matrix):
+  #the text format of word2vec and the .vec files of fastText, whose first line is "count dim"
+  return read_text_vectors(embedding_path, word_ids, matrix, skip_header=True)
+
+
+def _check_dimension(dimension, matrix, embedding_path):
+  if dimension != matrix.shape[1]:
+    raise ValueError("%s holds %d dimensional vectors, but the embedding size is %d" % (embedding_path, dimension, matrix.shape[1]))
+
+
+def _map_file(embedding_path):
+  with open(embedding_path, "rb") as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _word2vec_binary_entries(mapped, embedding_path):
+  #(dimension, iterator over the (word, offset of its vector) of every word) of a mapped binary word2vec file
+  header_end = mapped.find(b"\n")
+  count, dimension = [int(value) for value in mapped[:header_end].split()]
+  vector_bytes = 4 * dimension
+
+  def entries():
+    position = header_end + 1
+    for _ in range(count):
+      word_end = mapped.find(b" ", position)
+      if word_end < 0 or word_end + 1 + vector_bytes > len(mapped):
+        raise ValueError("%s ends before its %d words" % (embedding_path, count))
+      #word2vec writes a newline after each vector, which some other writers leave out
+      yield mapped[position:word_end].lstrip(b"\n"), word_end + 1
+      position = word_end + 1 + vector_bytes
+  return dimension, entries()
+
+
+def read_word2vec_binary(embedding_path, word_ids, matrix):
+  """Copy the vectors of the words in word_ids from a binary word2vec file into their rows of matrix.
+
+  The file is memory mapped and its word index scanned once, stepping over the vectors of other words, so
+  of a multi GB file only the vocabulary rows are read.
+
+  Returns:
+    a boolean array, True for the rows of matrix that were found
+  """
+  found = np.zeros(len(matrix), dtype=bool)
+  mapped = _map_file(embedding_path)
+  try:
+    dimension, entries = _word2vec_binary_entries(mapped, embedding_path)
+    _check_dimension(dimension, matrix, embedding_path)
+    for word, offset in entries:
+      row = word_ids.get(word)
+      if row is not None and not found[row]:
+        matrix[row] = np.frombuffer(mapped[offset:offset + 4 * dimension], dtype="<f4")
+        found[row] = True
+  finally:
+    mapped.close()
+  return found
+
+
+_FASTTEXT_MAGIC = 793712314
+_FASTTEXT_VERSION = 12
+#dim, ws, epoch, minCount, neg, wordNgrams, loss, model, bucket, minn, maxn, lrUpdateRate, then t
+_FASTTEXT_ARGS = struct.Struct("<12id")
+
+
+def _fasttext_hash(ngram):
+  #FNV-1a over the bytes of the ngram, each sign extended like the char of the C++ implementation
+  h = 2166136261
+  for byte in bytearray(ngram):
+    h = ((h ^ (byte | 0xffffff00 if byte >= 0x80 else byte)) * 16777619) & 0xffffffff
+  return h
+
+
+def fasttext_subword_rows(word, nwords, bucket, minn, maxn, pruned=None):
+  """The input matrix rows of the character ngrams of word, as fastText's Dictionary::computeSubwords finds them.
+
+  Ngrams are taken over "<word>" and never start inside a utf-8 character. pruned is the ngram index map
+  of a pruned model, whose other ngrams have no rows.
+  """
+  word = bytearray(b"<" + word + b">")
+  rows = []
+  for i in range(len(word)):
+    if word[i] & 0xC0 == 0x80:
+      continue
+    j, n = i, 1
+    while j < len(word) and n <= maxn:
+      j += 1
+      while j < len(word) and word[j] & 0xC0 == 0x80:
+        j += 1
+      if n >= minn and not (n == 1 and (i == 0 or j == len(word))):
+        h = _fasttext_hash(word[i:j]) % bucket
+        if pruned is not None:
+          h = pruned.get(h)
+        if h is not None:
+          rows.append(nwords + h)
+      n += 1
+  return rows
+
+
+def _read_fasttext_header(embedding_path):
+  #the arguments, dictionary words and input matrix position of a fastText model, as a dictionary
+  mapped = _map_file(embedding_path)
+  try:
+    magic, version = struct.unpack_from("<ii", mapped, 0)
+    if magic != _FASTTEXT_MAGIC or version != _FASTTEXT_VERSION:
+      raise ValueError("%s is not a version %d fastText model" % (embedding_path, _FASTTEXT_VERSION))
+    args = _FASTTEXT_ARGS.unpack_from(mapped, 8)
+    position = 8 + _FASTTEXT_ARGS.size
+    size, nwords, _, _, prune_size = struct.unpack_from("<iiiqq", mapped, position)
+    position += 28
+
+    #words come first, most frequent first, then labels
+    words = []
+    for word_id in range(size):
+      word_end = mapped.find(b"\0", position)
+      if word_id < nwords:
+        words.append(mapped[position:word_end])
+      #the count and entry type follow the word
+      position = word_end + 1 + 9
+    pruned = None
+    if prune_size >= 0:
+      pairs = np.frombuffer(mapped[position:position + 8 * prune_size], dtype="<i4").reshape(-1, 2)
+      pruned = dict(zip(pairs[:, 0].tolist(), pairs[:, 1].tolist()))
+      position += 8 * prune_size
+    quantized = struct.unpack_from("<?", mapped, position)[0]
+    if quantized:
+      raise ValueError("%s is a quantized fastText model, whose vectors can't be read directly" % embedding_path)
+    rows, columns = struct.unpack_from("<qq", mapped, position + 1)
+  finally:
+    mapped.close()
+  return {"dimension": args[0], "bucket": args[8], "minn": args[9], "maxn": args[10], "words": words,
+          "pruned": pruned, "matrix_offset": position + 17, "matrix_shape": (rows, columns)}
+
+
+def read_fasttext_model(embedding_path, word_ids, matrix):
+  """Copy the vectors of the words in word_ids from a fastText .bin model into their rows of matrix.
+
+  The model header and dictionary are scanned once, and the input matrix, which also holds a row for every
+  hashed character ngram bucket, is memory mapped. A word's vector is the mean of its own row and its ngram
+  rows, as fastText's getWordVector computes it, so vocabulary words that fastText never saw still get a
+  vector from their ngrams and every row is found unless the model has no ngrams.
+
+  Returns:
+    a boolean array, True for the rows of matrix that were found
+  """
+  header = _read_fasttext_header(embedding_path)
+  _check_dimension(header["dimension"], matrix, embedding_path)
+  _check_dimension(header["matrix_shape"][1], matrix, embedding_path)
+  input_matrix = np.memmap(embedding_path, dtype="<f4", mode="r", offset=header["matrix_offset"], shape=header["matrix_shape"])
+  model_ids = dict((word, i) for i, word in enumerate(header["words"]))
+  nwords = len(header["words"])
+
+  found = np.zeros(len(matrix), dtype=bool)
+  for word, row in word_ids.items():
+    model_id = model_ids.get(word)
+    #the end of sentence token has no ngrams in fastText's dictionary
+    subwords = [] if word == b"</s>" else fasttext_subword_rows(word, nwords, header["bucket"], header["minn"],
+                                                               header["maxn"], header["pruned"])
+    if model_id is not None:
+      subwords = [model_id] + subwords
+    if subwords:
+      matrix[row] = input_matrix[sorted(subwords)].mean(axis=0)
+      found[row] = True
+  return found
+
+
+def read_word2vec_vectors(embedding_path, word_ids, matrix):
+  #.bin files are binary, anything else the text format
+  if embedding_path.endswith(".bin"):
+    return read_word2vec_binary(embedding_path, word_ids, matrix)
+  return read_text_vectors_with_header(embedding_path, word_ids, matrix)
+
+
+def read_fasttext_vectors(embedding_path, word_ids, matrix):
+  #.bin files are models, anything else a .vec file
+  if embedding_path.endswith(".bin"):
+    return read_fasttext_model(embedding_path, word_ids, matrix)
+  return read_text_vectors_with_header(embedding_path, word_ids, matrix)
+
+
+def read_embedding_words(embedding_path, algorithm, limit=None):
+  """The words of an embedding file in the order it lists them, which for the released files is most frequent first.
+
+  Binary files are scanned like their readers scan them, and no vector is parsed.
+  """
+  words = []
+  if embedding_path.endswith(".bin") and algorithm == "fasttext":
+    words = _read_fasttext_header(embedding_path)["words"][:limit]
+  elif embedding_path.endswith(".bin") and algorithm == "word2vec":
+    mapped = _map_file(embedding_path)
+    try:
+      for word, _ in _word2vec_binary_entries(mapped, embedding_path)[1]:
+        if limit is not None and len(words) == limit:
+          break
+        words.append(word)
+    finally:
+      mapped.close()
+  else:
+    with gfile.GFile(embedding_path, mode="rb") as f:
+      if algorithm != "glove":
+        f.readline()
+      for line in f:
+        if limit is not None and len(words) == limit:
+          break
+        words.append(line.partition(b" ")[0].rstrip(b"\r\n"))
+  return words
+
+
+#the reader of each embedding algorithm, for load_pretrained_matrix
+READERS = {"glove": read_text_vectors,
+           "word2vec": read_word2vec_vectors,
+           "fasttext": read_fasttext_vectors}
+
+
+def _save_matrix(path, matrix):
+  with artifact_utils.atomic_output(path) as temporary_path:
+    #through a file object, since np.save adds .npy to a name that doesn't end in it
+    with open(temporary_path, "wb") as f:
+      np.save(f, matrix)
+
+
+def load_pretrained_matrix(vocabulary_path, embedding_path, num_symbols, embed_size, reader=read_text_vectors,
+                           algorithm="glove", special_words=(), allow_missing=False):
+  """The vectors of the first num_symbols vocabulary words as a read only memory mapped float32 matrix.
+
+  The matrix is built by reader(embedding_path, word_ids, matrix) the first time, and loaded from its cache
+  (see embedding_cache_path) after that. Rows of special_words, and of missing words if allow_missing, are
+  zeros for the caller to fill in.
+
+  Raises:
+    KeyError: if a vocabulary word has no vector and allow_missing is False.
+  """
+  cache_path = embedding_cache_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)
+  inputs = [vocabulary_path, embedding_path]
+  params = {"algorithm": algorithm, "num_symbols": num_symbols, "embed_size": embed_size}
+  if not artifact_utils.is_current(cache_path, "embeddings", _EMBEDDING_CACHE_VERSION, inputs, params):
+    print("Reading the %s vectors of %s from %s" % (algorithm, vocabulary_path, embedding_path))
+    words = read_vocabulary_words(vocabulary_path, limit=num_symbols)
+    word_ids = dict((word, i) for i, word in enumerate(words) if word not in special_words)
+    matrix = np.zeros((num_symbols, embed_size), dtype=np.float32)
+    found = reader(embedding_path, word_ids, matrix)
+    missing = [word for word, i in word_ids.items() if not found[i]]
+    if missing and not allow_missing:
+      raise KeyError("%d vocabulary words did not occur in the embedding file %s, for example %s" %
+                     (len(missing), embedding_path, ", ".join(repr(word) for word in sorted(missing)[:10])))
+    if missing:
+      print("%d of %d vocabulary words have no vector in %s" % (len(missing), len(word_ids), embedding_path))
+    _save_matrix(cache_path, matrix)
+    artifact_utils.record(cache_path, "embeddings", _EMBEDDING_CACHE_VERSION, inputs, params,
+                          {"missing_rows": sorted(word_ids[word] for word in missing)})
+  return np.load(cache_path, mmap_mode="r")
+
+
+def missing_rows(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size):
+  #the rows of a cached matrix whose words had no vector
+  manifest = artifact_utils.load_manifest(embedding_cache_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size))
+  return manifest["details"]["missing_rows"]
@@ -1,5 +1,7 @@
+import weakref
 import tensorflow as tf
 import numpy as np
+import glove_trainer
 import vocabulary_utils
 from tensorflow.python import shape
 from tensorflow.python.ops import embedding_ops
@@ -29,28 +31,60 @@ FLAGS = tf.app.flags.FLAGS
 #                           inputs, effectively just consulting the lookup table for each token and
 #							getting its vector representation
 #
+#	3) Word2vec, fasttext - Like glove, from the .bin or text files those programs write. They are
+#                           usually trained on other corpora, so vocabulary words without a vector
+#                           start out random.
+#
 
 #if FLAGS.embedding_type == "glove":
 #	W = tf.constant(embedding, name="glove_trained_weight_embeddings")
 
+#Pretrained embeddings are not given to their variables as constant initializers, since a constant of
+#vocabulary x embedding size floats would be stored in the GraphDef and in every .meta file the saver
+#writes. The variables start at zero, and initialize_pretrained_embeddings assigns the pretrained
+#values through a placeholder once the session exists. The entries are kept per graph and weakly, so
+#they go away with their graph; each is (variable name, placeholder name, assign op name, function
+#returning the numpy matrix). Names rather than tensors, since a tensor would keep its graph alive.
+_PRETRAINED_EMBEDDINGS = weakref.WeakKeyDictionary()
+
+#embedding algorithms whose embeddings start from the vectors of an embedding file
+PRETRAINED_ALGORITHMS = ['glove', 'word2vec', 'fasttext']
+
+
+def _register_pretrained_embeddings(variable, load_matrix):
+  entries = _PRETRAINED_EMBEDDINGS.setdefault(variable.graph, [])
+  for variable_name, _, _, _ in entries:
+    if variable_name == variable.op.name:
+      return
+  placeholder = tf.placeholder(variable.dtype.base_dtype, shape=variable.get_shape(), name=variable.op.name.split("/")[-1] + "_pretrained")
+  entries.append((variable.op.name, placeholder.name, variable.assign(placeholder).op.name, load_matrix))
+
+
+def initialize_pretrained_embeddings(session):
+  """Assign the pretrained values of every embedding variable of the session's graph. Run it after initializing fresh variables."""
+  for variable_name, placeholder_name, assign_op_name, load_matrix in _PRETRAINED_EMBEDDINGS.get(session.graph, []):
+    print("Assigning pretrained embeddings to %s" % variable_name)
+    session.run(session.graph.get_operation_by_name(assign_op_name),
+                feed_dict={session.graph.get_tensor_by_name(placeholder_name): load_matrix()})
 
 
-def _determine_embedding_and_vocabulary_file(embed_language, embed_algorithm):
+def _determine_embedding_and_vocabulary_file(embed_language, embed_algorithm, embed_size):
   if embed_language is None:
     assert embed_algorithm == "network", "If there is no passed embedding language, you must not pass None to embed_algorithm because it expects to use a pretrained embedding file to initialize tensors."
     return None, None
   
   elif embed_language == "source":
     vocab_file = FLAGS.data_dir + "/vocabulary_" + str(FLAGS.from_vocab_size) + ".from"
-    if embed_algorithm == 'glove':
-      embed_file = FLAGS.glove_encoder_embedding_file
+    embed_file = getattr(FLAGS, embed_algorithm + "_encoder_embedding_file")
   
   elif embed_language == "target":
     vocab_file = FLAGS.data_dir + "/vocabulary_" + str(FLAGS.to_vocab_size) + ".to"
-    if embed_algorithm == 'glove':
-      embed_file = FLAGS.glove_decoder_embedding_file
+    embed_file = getattr(FLAGS, embed_algorithm + "_decoder_embedding_file")
   else:
     raise ValueError("Embed language must be None, source or target")
+  if embed_algorithm == 'glove' and FLAGS.train_glove_embeddings:
+    #written by translate.train through glove_trainer.train_glove_embeddings
+    embed_file = glove_trainer.trained_vectors_path(vocab_file, embed_size)
   return embed_file, vocab_file
 
 
@@ -67,7 +101,7 @@ def get_word_embeddings(inputs,
 
   if embed_algorithm != "network":
     print("determining embedding file. embed language is %s" % embed_language)
-    embed_file, vocab_file = _determine_embedding_and_vocabulary_file(embed_language, embed_algorithm)
+    embed_file, vocab_file = _determine_embedding_and_vocabulary_file(embed_language, embed_algorithm, embed_size)
 
   #No unsupervised learning algorithm
   if embed_algorithm == "network":
@@ -93,8 +127,8 @@ def get_word_embeddings(inputs,
       else: 
         return embedded_inputs, emb
 
-  elif embed_algorithm == 'glove':
-    print("\tWord embeddings will be initialized by glove")
+  elif embed_algorithm in PRETRAINED_ALGORITHMS:
+    print("\tWord embeddings will be initialized by %s" % embed_algorithm)
 
     if train_embeddings:
       print("\tWord embeddings will still be trained by backprop")
@@ -102,10 +136,12 @@ def get_word_embeddings(inputs,
       print("\tWord embeddings will NOT be trained by backprop")
 
     with variable_scope.variable_scope(scope_name) as scope:
-      emb = tf.get_variable(scope_name+"_glove_embeddings",
-                            initializer=vocabulary_utils.initialize_glove_embeddings_tensor(num_symbols, embed_size, embed_file, vocab_file, dtype=dtype),
+      emb = tf.get_variable(scope_name + "_" + embed_algorithm + "_embeddings",
+                            shape=[num_symbols, embed_size],
+                            initializer=tf.zeros_initializer(),
                             trainable=train_embeddings,
                             dtype=dtype)
+      _register_pretrained_embeddings(emb, lambda: vocabulary_utils.pretrained_embeddings_matrix(num_symbols, embed_size, embed_file, vocab_file, embed_algorithm))
 
       #get the embedded inputs from the lookup table
       #these will be trained by backpropagation only if train_embeddings is enabled.
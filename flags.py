@@ -57,15 +57,29 @@ tf.app.flags.DEFINE_integer("steps_per_checkpoint", 300, #change me to 300
 
 #Dataset Flags
 
-#TODO - this right now is useless until i dynamically load datasets.
 tf.app.flags.DEFINE_boolean("load_train_set_in_memory", True,
                             "If True, loads training set into memory. Otherwise, reads batches by opening files and reading appropriate lines.")
 
+tf.app.flags.DEFINE_integer("train_stream_buffer_size", 10000,
+                            "When the training set is not loaded into memory, how many randomly sampled sentence pairs are held in memory at a time.")
+
+tf.app.flags.DEFINE_string("extra_train_corpora", "",
+                           "More integerized training corpora to stream from along with the prepared one, made with the same vocabularies, as source_ids:target_ids:weight triples separated by commas. Needs load_train_set_in_memory=False. Batches are drawn from the corpora in proportion to their weights.")
+
+tf.app.flags.DEFINE_float("train_corpus_weight", 1.0,
+                          "Sampling weight of the prepared training corpus when extra_train_corpora are given.")
+
 tf.app.flags.DEFINE_integer("max_train_data_size", 200000,
                             "Limit on the size of training data (0: no limit).")
 
 tf.app.flags.DEFINE_integer("train_offset", 0,
                             "ignore the first train_offset lines of the training file when loading the training set or getting randomly")
+
+tf.app.flags.DEFINE_boolean("sample_train_set", False,
+                            "If True and the training set is loaded into memory, max_train_data_size pairs are sampled uniformly at random from all the pairs within the length limits instead of taking the first lines of the files. The sample is written next to the training files and reused.")
+
+tf.app.flags.DEFINE_integer("train_sample_seed", 0,
+                            "Random seed of the training sample when sample_train_set is True. The same seed always gives the same sample.")
 #==========================================================================================
 
 
@@ -79,6 +93,36 @@ tf.app.flags.DEFINE_integer("max_source_sentence_length", 35, #I like long sente
 tf.app.flags.DEFINE_integer("max_target_sentence_length", 45,
                             "the maximum number of tokens in the target sentence training example in order for the sentence pair to be able to be used in the dataset")
 
+tf.app.flags.DEFINE_integer("preprocess_workers", 1,
+                            "Number of processes used to clean, count and integerize the dataset files. Files are split into line-aligned shards, so the output is the same for any number of workers.")
+
+tf.app.flags.DEFINE_string("download_mirror", "",
+                           "Base URL of a mirror serving the same paths as the dataset hosts, ie http://fileserver:8000 or file:///data/mirror. Empty downloads from the original hosts.")
+
+tf.app.flags.DEFINE_integer("download_connections", 4,
+                            "Number of chunks of a dataset file downloaded at once, when the server allows range requests.")
+
+tf.app.flags.DEFINE_string("download_checksums", "",
+                           "Expected sha256 of downloaded files, as filename:sha256 pairs separated by commas. Files without one are only checked against the size the server reports.")
+
+tf.app.flags.DEFINE_boolean("read_compressed_corpus", False,
+                            "If True, the downloaded training corpus is left gzipped and decompressed on a background thread while it is cleaned, instead of being written to disk uncompressed first.")
+
+tf.app.flags.DEFINE_boolean("fused_preprocessing", False,
+                            "If True, each dataset file is cleaned and tokenized in a single streaming pass that counts tokens into a token cache, and the vocabulary and integerized files are built from that cache instead of from .clean files.")
+
+tf.app.flags.DEFINE_boolean("write_clean_files", False,
+                            "With fused_preprocessing, also write the .clean text files. They are not needed by the fused pipeline.")
+
+tf.app.flags.DEFINE_integer("vocabulary_counter_capacity", 0,
+                            "If more than 0, vocabularies are counted with at most this many token counters per preprocessing worker instead of one per distinct token, followed by a second pass that counts the candidates exactly. For corpora whose distinct tokens don't fit in memory. A few times the vocabulary size is usually enough for an exact vocabulary.")
+
+tf.app.flags.DEFINE_boolean("deduplicate_train_set", False,
+                            "If True, exact duplicate sentence pairs are removed from the integerized training set, keeping the first of each. The deduplicated files are written next to the integerized ones and reused.")
+
+tf.app.flags.DEFINE_boolean("profile_corpus", False,
+                            "If True, print the sentence length percentiles, unknown word rates and byte statistics of the training set before training. Profiles are cached next to the integerized files, so this is only slow the first time.")
+
 
 
 
@@ -86,7 +130,7 @@ tf.app.flags.DEFINE_integer("max_target_sentence_length", 45,
 #Was 1024, 512
 #===========================Word Embeddings=====================================
 tf.app.flags.DEFINE_string("embedding_algorithm", "network",
-                            "glove, or network. The first three are unsupervised trainers implemented by other programs. the latter is a network layer trained only by backprop")
+                            "glove, word2vec, fasttext, or network. glove reads the glove embedding files, or trains them on the training set with glove_trainer.py if train_glove_embeddings is set. word2vec and fasttext read the vectors of a model trained elsewhere from the word2vec/fasttext embedding files, either their binary .bin format or the text format. network is an embedding layer trained only by backprop")
 
 tf.app.flags.DEFINE_boolean("train_embeddings", True,
                             "Whether or not to continue training the glove embeddings from backpropagation or to leave them be")
@@ -103,6 +147,36 @@ tf.app.flags.DEFINE_string("glove_encoder_embedding_file", "../translator/GloVe/
 tf.app.flags.DEFINE_string("glove_decoder_embedding_file", "../translator/GloVe/build/rob_vectors_25it_200vec_target.txt",
                             "The output file for Glove-trained word embeddings on the dataset.")
 
+tf.app.flags.DEFINE_string("word2vec_encoder_embedding_file", "",
+                            "Word2vec vectors for the source vocabulary, a binary .bin file or the text format.")
+
+tf.app.flags.DEFINE_string("word2vec_decoder_embedding_file", "",
+                            "Word2vec vectors for the target vocabulary, a binary .bin file or the text format.")
+
+tf.app.flags.DEFINE_string("fasttext_encoder_embedding_file", "",
+                            "FastText vectors for the source vocabulary, a .bin model or a .vec file. A .bin model also gives vectors to words it never saw, from their character ngrams.")
+
+tf.app.flags.DEFINE_string("fasttext_decoder_embedding_file", "",
+                            "FastText vectors for the target vocabulary, a .bin model or a .vec file. A .bin model also gives vectors to words it never saw, from their character ngrams.")
+
+tf.app.flags.DEFINE_boolean("train_glove_embeddings", False,
+                            "Train the glove embeddings on the integerized training set with glove_trainer.py instead of reading the glove embedding files. They are written next to the vocabulary files and reused while up to date.")
+
+tf.app.flags.DEFINE_integer("glove_window_size", 10,
+                            "How many tokens to either side of a word count as its context when training glove embeddings.")
+
+tf.app.flags.DEFINE_integer("glove_iterations", 25,
+                            "Passes of AdaGrad over the cooccurrence counts when training glove embeddings.")
+
+tf.app.flags.DEFINE_boolean("substitute_unknown_words", False,
+                            "Integerize source words outside the vocabulary, in training and in decode mode, as their nearest vocabulary word in the encoder's pretrained embedding file instead of _UNK. Needs a glove, word2vec or fasttext embedding_algorithm.")
+
+tf.app.flags.DEFINE_float("unk_substitution_min_similarity", 0.5,
+                            "The least cosine similarity between an unknown word and its nearest vocabulary word for it to be substituted.")
+
+tf.app.flags.DEFINE_integer("unk_substitution_max_words", 500000,
+                            "How many of the most frequent words of the embedding file can get a substitute.")
+
 
 
 
@@ -196,16 +270,33 @@ def flag_test():
         permitted = ['nematus', 'mirror', 'top_layer_mirror', 'bahdanu']
         assert flags.decoder_state_initializer in permitted, "Decoder state initializer %s is invalid" % flags.decoder_state_initializer
 
+    def validate_preprocessing_flags(flags):
+        assert flags.preprocess_workers >= 1, "You need at least one preprocessing worker"
+        assert flags.vocabulary_counter_capacity == 0 or flags.vocabulary_counter_capacity >= max(flags.from_vocab_size, flags.to_vocab_size), "The vocabulary counter capacity must be at least the vocabulary size"
+        assert flags.download_connections >= 1, "Downloads need at least one connection"
+        assert flags.train_stream_buffer_size >= 1, "The training stream buffer must hold at least one sentence pair"
+        assert not flags.extra_train_corpora or not flags.load_train_set_in_memory, "Extra training corpora are only streamed, set load_train_set_in_memory to False"
+        assert flags.train_corpus_weight >= 0, "Corpus weights can't be negative"
+
     def validate_softmax_sample_size(flags):
         assert flags.sampled_softmax_size <= flags.to_vocab_size, "Sampled softmax must not use more labels than there are target vocabulary words."
 
     def validate_embedding_algorithm(flags):
-        permitted = ['network', 'glove']
+        permitted = ['network', 'glove', 'word2vec', 'fasttext']
         assert flags.embedding_algorithm in permitted, "Embedding algorithm %s is not supported" % flags.embedding_algorithm
 
-        if flags.embedding_algorithm == 'glove':
+        if flags.embedding_algorithm == 'glove' and not flags.train_glove_embeddings:
             assert os.path.isfile(os.path.join(os.getcwd(), flags.glove_encoder_embedding_file)), "Glove embedding file %s does not exist in the file system" % os.path.join(os.getcwd(), flags.glove_encoder_embedding_file)
             assert os.path.isfile(os.path.join(os.getcwd(), flags.glove_decoder_embedding_file)), "Glove embedding file %s does not exist in the file system" % os.path.join(os.getcwd(), flags.glove_decoder_embedding_file)
+        assert flags.glove_window_size >= 1 and flags.glove_iterations >= 1, "Glove training needs a window and at least one iteration"
+        if flags.embedding_algorithm in ['word2vec', 'fasttext']:
+            for side in ['encoder', 'decoder']:
+                embedding_file = getattr(flags, "%s_%s_embedding_file" % (flags.embedding_algorithm, side))
+                assert os.path.isfile(embedding_file), "%s embedding file %s does not exist in the file system" % (flags.embedding_algorithm, embedding_file)
+        if flags.substitute_unknown_words:
+            assert flags.embedding_algorithm in ['glove', 'word2vec', 'fasttext'], "Unknown words are substituted using a pretrained embedding file, so embedding_algorithm can't be network"
+            assert not flags.train_glove_embeddings, "Glove embeddings trained on the vocabulary have no words outside it to substitute"
+            assert -1. <= flags.unk_substitution_min_similarity <= 1., "unk_substitution_min_similarity is a cosine similarity, between -1 and 1"
     f = tf.app.flags.FLAGS
 
     validate_learning_rate_flags(f)
@@ -214,5 +305,6 @@ def flag_test():
     validate_encoder_api(f)
     validate_decoder_state_initializer(f)
     validate_softmax_sample_size(f)
+    validate_preprocessing_flags(f)
     validate_embedding_algorithm(f)
     print("Flag inputs are valid.")
\ No newline at end of file
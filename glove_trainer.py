@@ -0,0 +1,296 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+from tensorflow.python.platform import gfile
+
+import artifact_utils
+import dataset_utils
+import embedding_utils
+
+#=================================================================
+#
+#	glove_trainer.py
+#
+#	GloVe word vectors (Pennington et al. 2014) trained straight from our integerized files, so the
+#	vectors line up with the vocabulary ids without going through another tool.
+#
+#	  counting  - worker processes each take a range of sentences of the binary corpus and count
+#	              every pair of ids at most window apart, weighted by 1 / distance, in both directions.
+#	              Pairs are built a block of sentences at a time with numpy, summed, and flushed to a
+#	              sorted chunk file whenever max_buffered_pairs is reached, so memory stays bounded.
+#	  merging   - the chunks are merged on disk one range of rows at a time into one cooccurrence file.
+#	  training  - AdaGrad on the weighted least squares GloVe cost, over shuffled minibatches of the
+#	              memory mapped cooccurrences, vectorized with numpy.
+#
+#	The vectors are written as a text file of "word v1 ... vn" lines in vocabulary order, which is what
+#	vocabulary_utils.glove_embeddings_matrix reads.
+#
+#	  python glove_trainer.py giga-fren.release2.fixed.en.clean.ids_40000 vocabulary_40000.from --embed_size 512 --workers 8
+#
+
+_COOCCURRENCE_MAGIC = b"NMTCOOC1"
+_COOCCURRENCE_HEADER = struct.Struct("<8sqq")
+_COOCCURRENCE_HEADER_SIZE = 64
+_COOCCURRENCE_DTYPE = np.dtype([("row", "<i4"), ("col", "<i4"), ("value", "<f4")])
+_COOCCURRENCE_VERSION = 1
+_GLOVE_VERSION = 1
+
+
+class CooccurrenceWriter(object):
+  """Writes (row, col, value) records sorted by row and col, the header being filled in on close."""
+
+  def __init__(self, path, vocabulary_size):
+    self.path = path
+    self.vocabulary_size = vocabulary_size
+    self.count = 0
+    self._file = open(path, "wb")
+    self._file.write(b"\0" * _COOCCURRENCE_HEADER_SIZE)
+
+  def write(self, keys, values):
+    #keys are row * vocabulary_size + col, in increasing order
+    records = np.empty(len(keys), dtype=_COOCCURRENCE_DTYPE)
+    records["row"] = keys // self.vocabulary_size
+    records["col"] = keys % self.vocabulary_size
+    records["value"] = values
+    self._file.write(records.tobytes())
+    self.count += len(keys)
+
+  def close(self):
+    self._file.seek(0)
+    self._file.write(_COOCCURRENCE_HEADER.pack(_COOCCURRENCE_MAGIC, self.count, self.vocabulary_size))
+    self._file.close()
+
+
+def load_cooccurrences(path):
+  """Memory map a cooccurrence file. Returns (records, vocabulary_size), records having row, col and value fields."""
+  with open(path, "rb") as f:
+    magic, count, vocabulary_size = _COOCCURRENCE_HEADER.unpack(f.read(_COOCCURRENCE_HEADER.size))
+  if magic != _COOCCURRENCE_MAGIC:
+    raise ValueError("%s is not a cooccurrence file, or was never closed by its writer" % path)
+  if not count:
+    return np.zeros(0, dtype=_COOCCURRENCE_DTYPE), vocabulary_size
+  return np.memmap(path, dtype=_COOCCURRENCE_DTYPE, mode="r", offset=_COOCCURRENCE_HEADER_SIZE, shape=(count,)), vocabulary_size
+
+
+def _sum_by_key(keys, values):
+  #sorted unique keys and the sum of the values of each
+  unique_keys, inverse = np.unique(keys, return_inverse=True)
+  return unique_keys, np.bincount(inverse, weights=values).astype(np.float32)
+
+
+def _block_pairs(tokens, lengths, window_size, vocabulary_size):
+  #keys and weights of every ordered pair of tokens at most window_size apart within the same sentence
+  sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+  tokens = tokens.astype(np.int64)
+  keys, values = [], []
+  for distance in range(1, window_size + 1):
+    same_sentence = np.flatnonzero(sentence_ids[:-distance] == sentence_ids[distance:]) if len(tokens) > distance else np.zeros(0, dtype=np.int64)
+    left, right = tokens[same_sentence], tokens[same_sentence + distance]
+    weight = np.float32(1. / distance)
+    keys.extend([left * vocabulary_size + right, right * vocabulary_size + left])
+    values.extend([np.full(len(same_sentence), weight, dtype=np.float32)] * 2)
+  return np.concatenate(keys), np.concatenate(values)
+
+
+def _count_shard(job):
+  #counts the sentences [start, end) of a binary corpus into sorted chunk files, returning their paths
+  binary_path, start, end, window_size, vocabulary_size, max_buffered_pairs, chunk_prefix, block_sentences = job
+  corpus = dataset_utils.IntegerizedCorpus(binary_path)
+  chunk_paths = []
+  buffered_keys, buffered_values, buffered = [], [], 0
+
+  def flush():
+    keys, values = _sum_by_key(np.concatenate(buffered_keys), np.concatenate(buffered_values))
+    chunk_path = "%s%d" % (chunk_prefix, len(chunk_paths))
+    writer = CooccurrenceWriter(chunk_path, vocabulary_size)
+    writer.write(keys, values)
+    writer.close()
+    chunk_paths.append(chunk_path)
+
+  for block_start in range(start, end, block_sentences):
+    block_end = min(block_start + block_sentences, end)
+    tokens = corpus.tokens[corpus.offsets[block_start]:corpus.offsets[block_end]]
+    keys, values = _block_pairs(np.asarray(tokens), np.diff(corpus.offsets[block_start:block_end + 1]), window_size, vocabulary_size)
+    buffered_keys.append(keys)
+    buffered_values.append(values)
+    buffered += len(keys)
+    if buffered >= max_buffered_pairs:
+      flush()
+      buffered_keys, buffered_values, buffered = [], [], 0
+  if buffered:
+    flush()
+  return chunk_paths
+
+
+def _merge_chunks(chunk_paths, output_path, vocabulary_size, max_merged_pairs):
+  #merges sorted chunk files a range of rows at a time, so only about max_merged_pairs records are in memory
+  chunks = [load_cooccurrences(path)[0] for path in chunk_paths]
+  total = sum(len(chunk) for chunk in chunks)
+  num_ranges = max(1, min(vocabulary_size, -(-total // max_merged_pairs)))
+  row_bounds = np.linspace(0, vocabulary_size, num_ranges + 1).astype(np.int64)
+  writer = CooccurrenceWriter(output_path, vocabulary_size)
+  try:
+    for low, high in zip(row_bounds[:-1], row_bounds[1:]):
+      keys, values = [], []
+      for chunk in chunks:
+        rows = chunk["row"]
+        part = chunk[np.searchsorted(rows, low):np.searchsorted(rows, high)]
+        keys.append(part["row"].astype(np.int64) * vocabulary_size + part["col"])
+        values.append(part["value"])
+      if sum(len(k) for k in keys):
+        writer.write(*_sum_by_key(np.concatenate(keys), np.concatenate(values)))
+  finally:
+    writer.close()
+  return writer.count
+
+
+def count_cooccurrences(ids_path, vocabulary_size, output_path, window_size=10, workers=1, max_buffered_pairs=20000000,
+                        block_sentences=20000):
+  """Count the weighted cooccurrences of the ids of an integerized file into output_path, unless it is up to date.
+
+  max_buffered_pairs bounds the pairs each worker holds before flushing a chunk, and how many records the
+  merge holds at once, at 12 to 16 bytes each.
+  """
+  binary_path = dataset_utils.maybe_convert_integerized_file_to_binary(ids_path, vocabulary_size)
+  params = {"window_size": window_size, "vocabulary_size": vocabulary_size}
+  if artifact_utils.is_current(output_path, "cooccurrence", _COOCCURRENCE_VERSION, [binary_path], params):
+    print("Cooccurrence counts %s already exist. Skipping this step..." % output_path)
+    return output_path
+
+  corpus = dataset_utils.IntegerizedCorpus(binary_path)
+  print("Counting cooccurrences within %d tokens in %s" % (window_size, binary_path))
+  bounds = np.linspace(0, len(corpus), max(workers, 1) + 1).astype(np.int64)
+  jobs = [(binary_path, int(start), int(end), window_size, vocabulary_size, max_buffered_pairs,
+           "%s.chunk%d_" % (output_path, i), block_sentences)
+          for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])) if end > start]
+  if workers > 1 and len(jobs) > 1:
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+      chunk_lists = pool.map(_count_shard, jobs)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    chunk_lists = [_count_shard(job) for job in jobs]
+  chunk_paths = [path for chunk_list in chunk_lists for path in chunk_list]
+
+  print("Merging %d chunks of cooccurrence counts" % len(chunk_paths))
+  with artifact_utils.atomic_output(output_path) as temporary_path:
+    count = _merge_chunks(chunk_paths, temporary_path, vocabulary_size, max_buffered_pairs)
+  for path in chunk_paths:
+    os.remove(path)
+  artifact_utils.record(output_path, "cooccurrence", _COOCCURRENCE_VERSION, [binary_path], params)
+  print("Wrote %d nonzero cooccurrences to %s" % (count, output_path))
+  return output_path
+
+
+def _adagrad_step(vectors, squares, biases, bias_squares, ids, gradients, bias_gradients, learning_rate):
+  #the gradients of a minibatch are summed per id before the step, so a frequent word takes one step of at
+  #most learning_rate per batch rather than one for each of its thousands of pairs in the batch
+  unique_ids, inverse = np.unique(ids, return_inverse=True)
+  summed = np.zeros((len(unique_ids), vectors.shape[1]), dtype=np.float32)
+  np.add.at(summed, inverse, gradients)
+  summed_biases = np.bincount(inverse, weights=bias_gradients, minlength=len(unique_ids)).astype(np.float32)
+  squares[unique_ids] += summed ** 2
+  bias_squares[unique_ids] += summed_biases ** 2
+  vectors[unique_ids] -= learning_rate * summed / np.sqrt(squares[unique_ids])
+  biases[unique_ids] -= learning_rate * summed_biases / np.sqrt(bias_squares[unique_ids])
+
+
+def train_glove(cooccurrence_path, embed_size, iterations=25, x_max=100., alpha=0.75, learning_rate=0.05,
+                batch_size=4096, shuffle_block_size=1000000, seed=0, report_frequency=1):
+  """Train GloVe vectors with AdaGrad on a cooccurrence file.
+
+  Every iteration visits all cooccurrences once, in blocks of shuffle_block_size taken in random order and
+  shuffled within, so only a block is read from the mapped file at a time.
+
+  Returns:
+    the vocabulary_size x embed_size float32 matrix of word plus context vectors
+  """
+  records, vocabulary_size = load_cooccurrences(cooccurrence_path)
+  random = np.random.RandomState(seed)
+  #the initialization and the AdaGrad accumulators start where the reference implementation starts them
+  words = ((random.rand(vocabulary_size, embed_size) - 0.5) / embed_size).astype(np.float32)
+  contexts = ((random.rand(vocabulary_size, embed_size) - 0.5) / embed_size).astype(np.float32)
+  word_biases = ((random.rand(vocabulary_size) - 0.5) / embed_size).astype(np.float32)
+  context_biases = ((random.rand(vocabulary_size) - 0.5) / embed_size).astype(np.float32)
+  word_squares = np.ones_like(words)
+  context_squares = np.ones_like(contexts)
+  word_bias_squares = np.ones_like(word_biases)
+  context_bias_squares = np.ones_like(context_biases)
+
+  block_starts = np.arange(0, len(records), shuffle_block_size)
+  for iteration in range(iterations):
+    cost = 0.
+    for block_start in random.permutation(block_starts):
+      block = np.array(records[block_start:block_start + shuffle_block_size])
+      block = block[random.permutation(len(block))]
+      for batch_start in range(0, len(block), batch_size):
+        batch = block[batch_start:batch_start + batch_size]
+        rows, cols, values = batch["row"], batch["col"], batch["value"]
+        word_vectors, context_vectors = words[rows], contexts[cols]
+        difference = np.einsum("ij,ij->i", word_vectors, context_vectors) + word_biases[rows] + context_biases[cols] - np.log(values)
+        weighted = np.minimum(1., (values / x_max) ** alpha) * difference
+        cost += 0.5 * np.dot(weighted, difference)
+
+        _adagrad_step(words, word_squares, word_biases, word_bias_squares, rows, weighted[:, None] * context_vectors, weighted, learning_rate)
+        _adagrad_step(contexts, context_squares, context_biases, context_bias_squares, cols, weighted[:, None] * word_vectors, weighted, learning_rate)
+    if (iteration + 1) % report_frequency == 0:
+      print("GloVe iteration %d, cost %.6f" % (iteration + 1, cost / max(len(records), 1)))
+  return words + contexts
+
+
+def write_vectors(vectors, vocabulary_path, output_path):
+  #one "word v1 ... vn" line per vocabulary word, in id order
+  words = embedding_utils.read_vocabulary_words(vocabulary_path, limit=len(vectors))
+  with artifact_utils.atomic_output(output_path) as temporary_path:
+    with gfile.GFile(temporary_path, mode="wb") as f:
+      for word, vector in zip(words, vectors):
+        f.write(word + b" " + " ".join("%.6f" % value for value in vector).encode("ascii") + b"\n")
+
+
+def trained_vectors_path(vocabulary_path, embed_size):
+  #where train_glove_embeddings puts the vectors of a vocabulary
+  return "%s.glove%d.txt" % (vocabulary_path, embed_size)
+
+
+def train_glove_embeddings(ids_path, vocabulary_path, vocabulary_size, embed_size, window_size=10, iterations=25,
+                           workers=1, x_max=100., alpha=0.75, learning_rate=0.05, seed=0):
+  """Count, train and write the GloVe vectors of an integerized file, unless they are up to date. Returns their path."""
+  output_path = trained_vectors_path(vocabulary_path, embed_size)
+  cooccurrence_path = "%s.cooc%d" % (ids_path, window_size)
+  params = {"embed_size": embed_size, "iterations": iterations, "x_max": x_max, "alpha": alpha,
+            "learning_rate": learning_rate, "seed": seed}
+  count_cooccurrences(ids_path, vocabulary_size, cooccurrence_path, window_size=window_size, workers=workers)
+  if artifact_utils.is_current(output_path, "glove", _GLOVE_VERSION, [cooccurrence_path, vocabulary_path], params):
+    print("GloVe vectors %s already exist. Skipping this step..." % output_path)
+    return output_path
+  print("Training %d dimensional GloVe vectors for %s" % (embed_size, vocabulary_path))
+  vectors = train_glove(cooccurrence_path, embed_size, iterations=iterations, x_max=x_max, alpha=alpha,
+                        learning_rate=learning_rate, seed=seed)
+  write_vectors(vectors, vocabulary_path, output_path)
+  artifact_utils.record(output_path, "glove", _GLOVE_VERSION, [cooccurrence_path, vocabulary_path], params)
+  return output_path
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Train GloVe vectors on an integerized file, aligned with its vocabulary.")
+  parser.add_argument("ids_path")
+  parser.add_argument("vocabulary_path")
+  parser.add_argument("--vocabulary_size", type=int, help="defaults to the number of words in the vocabulary file")
+  parser.add_argument("--embed_size", type=int, default=200)
+  parser.add_argument("--window_size", type=int, default=10)
+  parser.add_argument("--iterations", type=int, default=25)
+  parser.add_argument("--workers", type=int, default=1)
+  args = parser.parse_args()
+
+  vocabulary_size = args.vocabulary_size or len(embedding_utils.read_vocabulary_words(args.vocabulary_path))
+  print("Wrote %s" % train_glove_embeddings(args.ids_path, args.vocabulary_path, vocabulary_size, args.embed_size,
+                                            window_size=args.window_size, iterations=args.iterations, workers=args.workers))
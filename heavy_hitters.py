@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import six
+
+#=================================================================
+#
+#	heavy_hitters.py
+#
+#	Frequent item counting in bounded memory, for corpora whose long tail of distinct tokens
+#	(typos, urls, numbers glued to words) doesn't fit in a dict.
+#
+#	MisraGriesSummary keeps at most capacity counters. Counts are added a block at a time; when
+#	there are more than capacity counters, the (capacity + 1)th largest count is subtracted from
+#	every counter and the ones that reach zero are dropped. Every subtraction removes at least
+#	capacity + 1 times its value from the total, so the sum of all subtractions, error, is at most
+#	total / (capacity + 1). For every item
+#
+#	  count in the summary  <=  true count  <=  count in the summary + error
+#
+#	and every item that occurs more than error times is in the summary. Summaries of different
+#	parts of a corpus can be merged and keep the same bound (Agarwal et al., Mergeable Summaries),
+#	so shards are counted by separate processes.
+#
+
+class MisraGriesSummary(object):
+  """Approximate counts of the most frequent items of a stream, in at most capacity counters."""
+
+  def __init__(self, capacity, counts=None, error=0, total=0):
+    assert capacity >= 1, "A summary needs at least one counter"
+    self.capacity = capacity
+    self.counts = dict(counts or {})
+    self.error = error
+    self.total = total
+
+  def __len__(self):
+    return len(self.counts)
+
+  def update(self, counts):
+    """Add a mapping of item to count, ie the Counter of one block of the stream."""
+    for item, count in six.iteritems(counts):
+      self.counts[item] = self.counts.get(item, 0) + count
+      self.total += count
+    self._shrink()
+
+  def merge(self, other):
+    #the items of other were already counted into other.total, so only the counters and errors are added
+    for item, count in six.iteritems(other.counts):
+      self.counts[item] = self.counts.get(item, 0) + count
+    self.total += other.total
+    self.error += other.error
+    self._shrink()
+
+  def _shrink(self):
+    if len(self.counts) <= self.capacity:
+      return
+    values = np.fromiter(six.itervalues(self.counts), dtype=np.int64, count=len(self.counts))
+    #the (capacity + 1)th largest count. subtracting it leaves at most capacity positive counters
+    decrement = int(np.partition(values, len(values) - self.capacity - 1)[len(values) - self.capacity - 1])
+    self.counts = dict((item, count - decrement) for item, count in six.iteritems(self.counts) if count > decrement)
+    self.error += decrement
+
+  def error_bound(self):
+    #the guaranteed bound on error, whatever the stream was
+    return self.total // (self.capacity + 1)
+
+  def candidates(self):
+    #every item that may occur more than error times, most frequent first
+    return sorted(self.counts, key=lambda item: (-self.counts[item], item))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Timing checks for the preprocessing functions in vocabulary_utils.
+
+Each benchmark runs the current implementation next to the implementation it replaced,
+verifies the outputs are identical, and prints the throughput of both. Run it on a slice
+of the real corpus, for example
+
+  python preprocessing_benchmarks.py clean giga-fren.release2.fixed.fr --language fr --max_lines 200000
+  python preprocessing_benchmarks.py tokenize giga-fren.release2.fixed.fr.clean
+
+tokenizer_regression_corpus.txt holds the awkward cases for the tokenizer (every separator,
+runs of separators, the two byte degree sign, tabs and odd whitespace) and should always
+pass the tokenize benchmark. tokenizer_regression_expected.jsonl holds the tokens the original
+tokenizer gave for each of its lines, which tests/test_tokenizer_regression.py checks.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import re
+import time
+
+import vocabulary_utils
+
+
+def _reference_clean_sentence(sentence, language="en"):
+  #clean_sentence as it was written before the rule tables, one re.sub pass per rule.
+  sentence = sentence.lower()
+  sentence = re.sub("’", "'", sentence)
+  if language == "en":
+    sentence = re.sub('0', ' zero ', sentence)
+    sentence = re.sub('1', ' one ', sentence)
+    sentence = re.sub('2', ' two ', sentence)
+    sentence = re.sub('3', ' three ', sentence)
+    sentence = re.sub('4', ' four ', sentence)
+    sentence = re.sub('5', ' five ', sentence)
+    sentence = re.sub('6', ' six ', sentence)
+    sentence = re.sub('7', ' seven ', sentence)
+    sentence = re.sub('8', ' eight ', sentence)
+    sentence = re.sub('9', ' nine ', sentence)
+  elif language == "fr":
+    sentence = re.sub('É', 'é', sentence)
+    sentence = re.sub('È', 'è', sentence)
+    sentence = re.sub('Ë', 'ë', sentence)
+    sentence = re.sub("Ê", "ê", sentence)
+    sentence = re.sub('À', 'à', sentence)
+    sentence = re.sub('Á', 'á', sentence)
+    sentence = re.sub('Â', 'â', sentence)
+    sentence = re.sub('Î', 'î', sentence)
+    sentence = re.sub('Ï', 'ï', sentence)
+    sentence = re.sub('Ö', 'ö', sentence)
+    sentence = re.sub('Ô', 'ô', sentence)
+    sentence = re.sub('Ó', 'ó', sentence)
+    sentence = re.sub('Ò', 'ò', sentence)
+    sentence = re.sub('Û', 'û', sentence)
+    sentence = re.sub('Ü', 'ü', sentence)
+    sentence = re.sub('Ù', 'ù', sentence)
+    sentence = re.sub('Ç', 'ç', sentence)
+    sentence = re.sub('Œ', 'œ', sentence)
+    sentence = re.sub('0', ' zéro ', sentence)
+    sentence = re.sub('1', ' un ', sentence)
+    sentence = re.sub('2', ' deux ', sentence)
+    sentence = re.sub('3', ' trois ', sentence)
+    sentence = re.sub('4', ' quatre ', sentence)
+    sentence = re.sub('5', ' cinq ', sentence)
+    sentence = re.sub('6', ' six ', sentence)
+    sentence = re.sub('7', ' sept ', sentence)
+    sentence = re.sub('8', ' huit ', sentence)
+    sentence = re.sub('9', ' neuf ', sentence)
+  else:
+    raise ValueError("No reference rules for language %s" % language)
+  return sentence
+
+
+def _reference_vanilla_ft_tokenizer(text):
+  #vanilla_ft_tokenizer as it was written before the compiled pattern, one str.replace per separator.
+  tokens = []
+  seperators = ("(", ")", "?", "!", "@", "#", "$", "%", "^", "&", "*", "[", "]", "'", '"', '~',
+                ".", ",", ":", ";", "-", "_", "=", "+", "{", "}", "<", ">", "/", "\\", "|", "°")
+
+  def split(txt, seps):
+    for sep in seps:
+      txt = txt.replace(sep, " "+sep+" ")
+    return [i.strip() for i in txt.split(" ")]
+
+  for split_by_space in text.strip().split():
+    tokens.extend(split(split_by_space, seperators))
+  return [i for i in tokens if i]
+
+
+def _read_lines(input_file, max_lines):
+  lines = []
+  with open(input_file, "rb") as f:
+    for line in f:
+      lines.append(line)
+      if max_lines and len(lines) >= max_lines:
+        break
+  return lines
+
+
+def _time_function(function, repeats):
+  #returns the result of the last run and the best wall time over all runs
+  best = float("inf")
+  result = None
+  for _ in range(repeats):
+    start = time.time()
+    result = function()
+    best = min(best, time.time() - start)
+  return result, best
+
+
+def _report(name, reference_time, new_time, num_lines):
+  print("%s over %d lines:" % (name, num_lines))
+  print("\treference: %.3fs (%.0f lines/sec)" % (reference_time, num_lines / max(reference_time, 1e-9)))
+  print("\tcurrent:   %.3fs (%.0f lines/sec)" % (new_time, num_lines / max(new_time, 1e-9)))
+  print("\tspeedup:   %.2fx" % (reference_time / max(new_time, 1e-9)))
+
+
+def benchmark_clean_sentence(input_file, language="en", max_lines=100000, repeats=3):
+  """Compare clean_sentences against the chained re.sub version on the first max_lines of input_file.
+
+  Raises:
+    AssertionError: if the two implementations disagree on any line.
+  """
+  lines = _read_lines(input_file, max_lines)
+
+  reference, reference_time = _time_function(lambda: [_reference_clean_sentence(line, language) for line in lines], repeats)
+  current, current_time = _time_function(lambda: vocabulary_utils.clean_sentences(lines, language), repeats)
+
+  for line_number, (expected, actual) in enumerate(zip(reference, current)):
+    assert expected == actual, "clean_sentence differs from the reference on line %d:\n%r\n%r" % (line_number + 1, expected, actual)
+
+  _report("clean_sentence (%s)" % language, reference_time, current_time, len(lines))
+  return reference_time, current_time
+
+
+def benchmark_tokenizer(input_file, max_lines=100000, repeats=3):
+  """Compare vanilla_ft_tokenize_lines against the replace-loop tokenizer on the first max_lines of input_file.
+
+  Raises:
+    AssertionError: if the two tokenizers disagree on any token of any line.
+  """
+  lines = _read_lines(input_file, max_lines)
+
+  reference, reference_time = _time_function(lambda: [_reference_vanilla_ft_tokenizer(line) for line in lines], repeats)
+  current, current_time = _time_function(lambda: vocabulary_utils.vanilla_ft_tokenize_lines(lines), repeats)
+
+  for line_number, (expected, actual) in enumerate(zip(reference, current)):
+    assert expected == actual, "vanilla_ft_tokenizer differs from the reference on line %d:\n%r\n%r" % (line_number + 1, expected, actual)
+    assert vocabulary_utils.vanilla_ft_tokenizer(lines[line_number]) == expected, "single line tokenizer differs from the batch on line %d" % (line_number + 1)
+
+  _report("vanilla_ft_tokenizer", reference_time, current_time, len(lines))
+  return reference_time, current_time
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark preprocessing functions against the implementations they replaced.")
+  parser.add_argument("benchmark", choices=["clean", "tokenize"])
+  parser.add_argument("input_file")
+  parser.add_argument("--language", default="en")
+  parser.add_argument("--max_lines", type=int, default=100000)
+  parser.add_argument("--repeats", type=int, default=3)
+  args = parser.parse_args()
+
+  if args.benchmark == "clean":
+    benchmark_clean_sentence(args.input_file, args.language, args.max_lines, args.repeats)
+  elif args.benchmark == "tokenize":
+    benchmark_tokenizer(args.input_file, args.max_lines, args.repeats)
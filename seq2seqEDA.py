@@ -423,9 +423,8 @@ class seq2seqEDA(object):
         directly examining the buckets and randomly choosing from them. if false,
         will randomly choose lines fitting the sizing parameters of the bucket_id
         that was passed. notice that this will be slower.
-      use_all_rows - ignore batch size and use every training sentence pair in data
-
-      #TODO - finish implementing getting a batch from not the file
+      use_all_rows - ignore batch size and use every training sentence pair in data. only used when
+        loading from memory.
 
     Returns:
       The triple (encoder_inputs, decoder_inputs, target_weights) for
@@ -434,8 +433,7 @@ class seq2seqEDA(object):
     if load_from_memory:
       return self.get_batch_from_memory(data, use_all_rows=use_all_rows)
     else:
-      raise NotImplementedError("Need to write get back from file method. use the memory flag now")
-      #return self.get_batch_from_file(data, use_all_rows=use_all_rows, source_path=None, target_path=None, max_size=None)
+      return self.get_batch_from_file(data)
 
 
   #Create placeholder variables for the encoder/decoder inputs
@@ -481,7 +479,7 @@ class seq2seqEDA(object):
 
 
 
-  def prepare_encoder_and_decoder_inputs(self, data, size=None):
+  def prepare_encoder_and_decoder_inputs(self, data, size=None, sample=True):
     """Cleaning encoder and decoder inputs amounts to padding the inputs to the size of the max sentence for
     both the encoder and decoder, as well as adding a go symbol to the beginning of the decoder sentence.
     This function will also reverse the input encoder sentence. """
@@ -490,6 +488,7 @@ class seq2seqEDA(object):
     #self - the seq2seq class
     #data - sentence integer training pairs as a list of tuples
     #size - int, the number of data rows to read
+    #sample - if true, rows are chosen at random from data. otherwise the first size rows are used in order
     encoder_inputs = []
     decoder_inputs = []
     encoder_input_lengths = [] #we'll need this to pass to the dynamic rnn's as their sequence length arguments
@@ -497,7 +496,7 @@ class seq2seqEDA(object):
 
     # Get a random batch of encoder and decoder inputs from data
     for _ in xrange(size):
-      encoder_input, decoder_input = random.choice(data)
+      encoder_input, decoder_input = random.choice(data) if sample else data[_]
 
       # Encoder inputs are padded temporarily
       encoder_pad = [vocabulary_utils.PAD_ID] * (self.max_encoder_length - len(encoder_input))
@@ -566,7 +565,7 @@ class seq2seqEDA(object):
     return default_weights
 
 
-  def get_batch_from_memory(self, data, use_all_rows=False):
+  def get_batch_from_memory(self, data, use_all_rows=False, sample=True):
     """Get a random batch of data from the specified bucket, prepare for step.
 
     To feed data in step(..) it must be a list of batch-major vectors, while
@@ -574,12 +573,14 @@ class seq2seqEDA(object):
     function is to re-index data cases to be in the proper format for feeding.
 
     Args:
-      data: list of tuple pairs of input and output data that we use to create a batch.
+      data: list of tuple pairs of input and output data that we use to create a batch, or a
+        dataset_utils.SentencePairDataset, which indexes the same way.
       load_from_memory : boolean - if true, loads the dataset from memory by
         directly examining the buckets and randomly choosing from them. if false,
         will randomly choose lines fitting the sizing parameters
         that was passed. notice that this will be slower.
       use_all_rows : boolean - if true, ignores batch size and loads entire dataset in "data"
+      sample : boolean - if true, pairs are chosen from data at random. if false, they are taken in order.
 
     Returns:
       The quintuple (encoder_inputs, decoder_inputs, encoder_input_lengths, decoder_input_lengths, target_weights) for
@@ -587,7 +588,7 @@ class seq2seqEDA(object):
     """
     encoder_size = self.max_encoder_length
     decoder_size = self.max_decoder_length
-    encoder_inputs, decoder_inputs, encoder_input_lengths, decoder_input_lengths = self.prepare_encoder_and_decoder_inputs(data, size=self.batch_size if not use_all_rows else len(data))
+    encoder_inputs, decoder_inputs, encoder_input_lengths, decoder_input_lengths = self.prepare_encoder_and_decoder_inputs(data, size=self.batch_size if not use_all_rows else len(data), sample=sample)
 
     # Now we create batch-major vectors from the data selected above.
     batch_encoder_inputs = []
@@ -617,5 +618,15 @@ class seq2seqEDA(object):
     return batch_encoder_inputs, batch_decoder_inputs, encoder_input_lengths, decoder_input_lengths, batch_weights_old
 
 
-  def get_batch_from_file(self, data, source_path, target_path, max_size):
-    raise NotImplementedError
+  def get_batch_from_file(self, data):
+    """Get a random batch of data from a file backed pair source, prepare for step.
+
+    Args:
+      data: a dataset_utils.StreamingSentencePairSource, which samples random pairs that fit the
+        length limits straight from the integerized files.
+
+    Returns:
+      The same quintuple as get_batch_from_memory.
+    """
+    pairs = data.sample(self.batch_size)
+    return self.get_batch_from_memory(pairs, use_all_rows=True, sample=False)
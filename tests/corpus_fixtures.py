@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+#=================================================================
+#
+#	corpus_fixtures.py
+#
+#	Synthetic corpora and scratch directories shared by the tests. The tests run from the repository
+#	root under python 2 and tensorflow 1.x:
+#
+#	  python -m unittest discover -s tests
+#
+
+_WORDS = [b"the", b"cat", b"sat", b"on", b"a", b"mat", b"de", b"la", b"le", b"chat",
+          b"caf\xc3\xa9", b"d\xc3\xa9j\xc3\xa0", b"na\xc3\xafve", b"\xc3\xa9t\xc3\xa9", b"gar\xc3\xa7on",
+          b"\xe6\x9d\xb1\xe4\xba\xac", b"\xe2\x80\x94", b"42", b"3.14", b"l'homme", b"it's", b"(hello)", b"end."]
+
+
+class ScratchDirectoryTestCase(unittest.TestCase):
+  """A test case with a fresh directory for its files, removed afterwards."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix="nmt_test_")
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def path(self, name):
+    return os.path.join(self.directory, name)
+
+  def read_bytes(self, name):
+    with open(self.path(name), "rb") as f:
+      return f.read()
+
+
+def synthetic_lines(num_lines, seed=0, max_words=20, words=_WORDS):
+  #num_lines lines of random words, some of them empty, as bytes without newlines
+  random = np.random.RandomState(seed)
+  lines = []
+  for _ in range(num_lines):
+    length = random.randint(0, max_words + 1) if random.rand() > 0.05 else 0
+    lines.append(b" ".join(words[i] for i in random.randint(0, len(words), size=length)))
+  return lines
+
+
+def write_synthetic_corpus(path, num_lines, seed=0, long_line_words=0, final_newline=False):
+  """Write a corpus with empty lines, multi byte utf-8 and, if long_line_words, one line of that many words.
+
+  The last line has no newline unless final_newline. Returns the lines written.
+  """
+  lines = synthetic_lines(num_lines, seed)
+  if long_line_words:
+    lines.insert(len(lines) // 3, b" ".join(synthetic_lines(1, seed + 1, max_words=long_line_words)[0].split() or [b"x"]) +
+                 b" " + b" ".join([b"caf\xc3\xa9"] * long_line_words))
+  with open(path, "wb") as f:
+    f.write(b"\n".join(lines) + (b"\n" if final_newline else b""))
+  return lines
+
+
+def write_vocabulary(path, words, special_words=(b"_PAD", b"_GO", b"_EOS", b"_UNK")):
+  #a vocabulary file as create_vocabulary writes it, special words first
+  with open(path, "wb") as f:
+    f.write(b"\n".join(list(special_words) + list(words)) + b"\n")
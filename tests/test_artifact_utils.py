@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+import artifact_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_synthetic_corpus
+
+
+class _Interrupted(Exception):
+  pass
+
+
+class _CountingLineFunction(object):
+  """Upper cases lines, counting the calls and raising _Interrupted on call fail_at."""
+
+  def __init__(self, fail_at=None):
+    self.calls = 0
+    self.fail_at = fail_at
+
+  def __call__(self, line):
+    self.calls += 1
+    if self.calls == self.fail_at:
+      raise _Interrupted()
+    return line.upper()
+
+
+def _set_mtime(path, seconds_ago):
+  #mtimes in the past, so they differ by whole seconds and the hashes of the files can be cached
+  when = time.time() - seconds_ago
+  os.utime(path, (when, when))
+
+
+class CheckpointResumeTest(ScratchDirectoryTestCase):
+  """A line stage interrupted after a checkpoint resumes from it and writes what an uninterrupted run writes."""
+
+  def setUp(self):
+    super(CheckpointResumeTest, self).setUp()
+    self.lines = write_synthetic_corpus(self.path("corpus.en"), 95)
+    self.key = artifact_utils.checkpoint_key("upper", 1, self.path("corpus.en"))
+
+  def run_stage(self, output_name, line_function, key=None):
+    return vocabulary_utils._run_line_stage(line_function, self.path("corpus.en"), self.path(output_name), 0, None,
+                                            key or self.key, checkpoint_frequency=10)
+
+  def test_resume_matches_uninterrupted_run(self):
+    self.assertEqual(95, self.run_stage("expected", _CountingLineFunction()))
+
+    interrupted = _CountingLineFunction(fail_at=47)
+    with self.assertRaises(_Interrupted):
+      self.run_stage("resumed", interrupted)
+    self.assertFalse(os.path.exists(self.path("resumed")))
+    self.assertEqual({"input_offset": sum(len(line) + 1 for line in self.lines[:40]), "lines": 40,
+                      "output_offset": sum(len(line) + 1 for line in self.lines[:40])},
+                     artifact_utils.load_checkpoint(self.path("resumed"), dict(self.key, start=0, end=None)))
+
+    resumed = _CountingLineFunction()
+    self.assertEqual(95, self.run_stage("resumed", resumed))
+    #only the lines after the last checkpoint are processed again
+    self.assertEqual(55, resumed.calls)
+    self.assertEqual(self.read_bytes("expected"), self.read_bytes("resumed"))
+
+    #a finished stage is not run again
+    finished = _CountingLineFunction()
+    self.assertEqual(95, self.run_stage("resumed", finished))
+    self.assertEqual(0, finished.calls)
+
+  def test_checkpoint_of_other_work_is_not_resumed(self):
+    with self.assertRaises(_Interrupted):
+      self.run_stage("output", _CountingLineFunction(fail_at=47))
+    restarted = _CountingLineFunction()
+    self.run_stage("output", restarted, key=artifact_utils.checkpoint_key("upper", 1, self.path("corpus.en"), {"other": 1}))
+    self.assertEqual(95, restarted.calls)
+
+    with self.assertRaises(_Interrupted):
+      self.run_stage("changed", _CountingLineFunction(fail_at=47))
+    _set_mtime(self.path("corpus.en"), 100)
+    restarted = _CountingLineFunction()
+    self.run_stage("changed", restarted, key=artifact_utils.checkpoint_key("upper", 1, self.path("corpus.en")))
+    self.assertEqual(95, restarted.calls)
+
+
+class IsCurrentTest(ScratchDirectoryTestCase):
+  """A recorded artifact stays current until its inputs, parameters or contents change."""
+
+  def setUp(self):
+    super(IsCurrentTest, self).setUp()
+    for name, contents in (("input", b"some input\n"), ("output", b"some output\n")):
+      with open(self.path(name), "wb") as f:
+        f.write(contents)
+      _set_mtime(self.path(name), 100)
+    artifact_utils.record(self.path("output"), "stage", 1, [self.path("input")], {"size": 3})
+
+  def is_current(self, params=None):
+    return artifact_utils.is_current(self.path("output"), "stage", 1, [self.path("input")], params or {"size": 3})
+
+  def rewrite(self, name, contents):
+    stat = os.stat(self.path(name))
+    with open(self.path(name), "wb") as f:
+      f.write(contents)
+    self.assertEqual(stat.st_size, os.path.getsize(self.path(name)))
+    _set_mtime(self.path(name), 50)
+
+  def test_parameters_and_version(self):
+    self.assertTrue(self.is_current())
+    self.assertFalse(self.is_current({"size": 4}))
+    self.assertFalse(artifact_utils.is_current(self.path("output"), "stage", 2, [self.path("input")], {"size": 3}))
+    self.assertFalse(artifact_utils.is_current(self.path("output"), "stage", 1, [self.path("output")], {"size": 3}))
+
+  def test_input_changed_with_the_same_size(self):
+    _set_mtime(self.path("input"), 70)
+    self.assertTrue(self.is_current(), "touched, but the contents are the same")
+    self.rewrite("input", b"some INPUT\n")
+    self.assertFalse(self.is_current())
+
+  def test_output_changed_with_the_same_size(self):
+    #the output hash is cached in its manifest when a later stage reads it
+    artifact_utils.file_hash(self.path("output"))
+    _set_mtime(self.path("output"), 70)
+    self.assertTrue(self.is_current(), "touched, but the contents are the same")
+    self.rewrite("output", b"some OUTPUT\n")
+    self.assertFalse(self.is_current())
+    #and hashing it again doesn't make the changed file look recorded
+    artifact_utils.file_hash(self.path("output"))
+    self.assertFalse(self.is_current())
+
+  def test_output_touched_without_a_hash(self):
+    _set_mtime(self.path("output"), 70)
+    self.assertFalse(self.is_current())
+
+  def test_input_hash_is_cached(self):
+    self.assertEqual(artifact_utils.file_hash(self.path("input")),
+                     artifact_utils.load_manifest(self.path("output"))["inputs"][self.path("input")]["sha1"])
+    self.assertTrue(os.path.exists(artifact_utils.hash_cache_path(self.path("input"))))
+    #a cached hash is what record uses, so it isn't computed again
+    with open(artifact_utils.hash_cache_path(self.path("input")), "rb") as f:
+      cached = f.read().replace(artifact_utils.file_hash(self.path("input")).encode("ascii"), b"0" * 40)
+    with open(artifact_utils.hash_cache_path(self.path("input")), "wb") as f:
+      f.write(cached)
+    artifact_utils.record(self.path("output"), "stage", 1, [self.path("input")], {"size": 3})
+    self.assertEqual("0" * 40, artifact_utils.load_manifest(self.path("output"))["inputs"][self.path("input")]["sha1"])
+
+  def test_recently_written_files_are_not_cached(self):
+    with open(self.path("fresh"), "wb") as f:
+      f.write(b"abc\n")
+    first = artifact_utils.file_hash(self.path("fresh"))
+    self.assertFalse(os.path.exists(artifact_utils.hash_cache_path(self.path("fresh"))))
+    with open(self.path("fresh"), "wb") as f:
+      f.write(b"xyz\n")
+    self.assertNotEqual(first, artifact_utils.file_hash(self.path("fresh")))
@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+import dataset_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _random_sentences(count, vocabulary_size, seed=0):
+  #sentences of ids with every tenth one empty
+  random = np.random.RandomState(seed)
+  return [random.randint(0, vocabulary_size, size=random.randint(1, 30)).tolist() if i % 10 else [] for i in range(count)]
+
+
+class BinaryCorpusTest(ScratchDirectoryTestCase):
+  """IntegerizedCorpus reads back what IntegerizedCorpusWriter wrote, and what the text file holds."""
+
+  def check_corpus(self, corpus, sentences):
+    self.assertEqual(len(sentences), len(corpus))
+    self.assertEqual([len(sentence) for sentence in sentences], corpus.lengths.tolist())
+    for i, sentence in enumerate(sentences):
+      self.assertEqual(sentence, corpus[i].tolist())
+    self.assertEqual(sentences[-1], corpus[-1].tolist())
+    self.assertRaises(IndexError, lambda: corpus[len(sentences)])
+
+  def test_round_trip(self):
+    for vocabulary_size, dtype in ((1000, np.uint16), (70000, np.uint32)):
+      sentences = _random_sentences(200, vocabulary_size)
+      path = self.path("corpus_%d.bin" % vocabulary_size)
+      with dataset_utils.IntegerizedCorpusWriter(path, vocabulary_size) as writer:
+        #single sentences and blocks of them can be mixed
+        for sentence in sentences[:50]:
+          writer.write(sentence)
+        for start in range(50, len(sentences), 37):
+          block = sentences[start:start + 37]
+          writer.write_block(np.array(sum(block, []), dtype=np.int64), [len(sentence) for sentence in block])
+      corpus = dataset_utils.IntegerizedCorpus(path)
+      self.assertEqual(dtype, corpus.dtype)
+      self.assertEqual(vocabulary_size, corpus.vocabulary_size)
+      self.check_corpus(corpus, sentences)
+
+  def test_only_empty_sentences(self):
+    with dataset_utils.IntegerizedCorpusWriter(self.path("empty.bin"), 10) as writer:
+      for _ in range(3):
+        writer.write([])
+    self.check_corpus(dataset_utils.IntegerizedCorpus(self.path("empty.bin")), [[], [], []])
+
+  def test_bad_headers(self):
+    writer = dataset_utils.IntegerizedCorpusWriter(self.path("unclosed.bin"), 10)
+    writer.write([1, 2, 3])
+    writer._file.flush()
+    self.assertRaises(ValueError, dataset_utils.IntegerizedCorpus, self.path("unclosed.bin"))
+    writer.close()
+    self.assertEqual([1, 2, 3], dataset_utils.IntegerizedCorpus(self.path("unclosed.bin"))[0].tolist())
+
+    with open(self.path("unclosed.bin"), "rb") as f:
+      contents = f.read()
+    with open(self.path("wrong_magic.bin"), "wb") as f:
+      f.write(b"NMTIDS99" + contents[8:])
+    self.assertRaises(ValueError, dataset_utils.IntegerizedCorpus, self.path("wrong_magic.bin"))
+    with open(self.path("short.bin"), "wb") as f:
+      f.write(contents[:20])
+    self.assertRaises(ValueError, dataset_utils.IntegerizedCorpus, self.path("short.bin"))
+
+  def test_writer_rejects_ids_outside_the_vocabulary(self):
+    def write_past_the_vocabulary():
+      with dataset_utils.IntegerizedCorpusWriter(self.path("bad.bin"), 10) as writer:
+        writer.write([1, 10])
+    self.assertRaises(ValueError, write_past_the_vocabulary)
+    #a writer that failed leaves nothing behind
+    self.assertFalse(os.path.exists(self.path("bad.bin")))
+
+  def test_conversion_matches_parse_of_the_text_file(self):
+    sentences = _random_sentences(500, 1000, seed=3)
+    for final_newline in (True, False):
+      ids_path = self.path("train.ids_1000.%d" % final_newline)
+      with open(ids_path, "wb") as f:
+        f.write(b"\n".join(b" ".join(b"%d" % i for i in sentence) for sentence in sentences) + (b"\n" if final_newline else b""))
+      with open(ids_path, "rb") as f:
+        ids, lengths = dataset_utils.parse_integerized_lines(f.readlines())
+      parsed = np.split(ids, np.cumsum(lengths)[:-1])
+      self.assertEqual(sentences, [sentence.tolist() for sentence in parsed])
+
+      #small blocks so the conversion spans several of them
+      dataset_utils.convert_integerized_file_to_binary(ids_path, dataset_utils.binary_corpus_path(ids_path), 1000, block_size=7)
+      self.check_corpus(dataset_utils.IntegerizedCorpus(dataset_utils.binary_corpus_path(ids_path)), sentences)
+
+  def test_parse_rejects_malformed_lines(self):
+    self.assertRaises(ValueError, dataset_utils.parse_integerized_lines, [b"1 2 x\n"])
+    self.assertRaises(ValueError, dataset_utils.parse_integerized_lines, [b"1  2\n"])
+    ids, lengths = dataset_utils.parse_integerized_lines([])
+    self.assertEqual(([], []), (ids.tolist(), lengths.tolist()))
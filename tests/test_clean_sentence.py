@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import unittest
+
+import preprocessing_benchmarks
+import vocabulary_utils
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CORPUS_PATH = os.path.join(_ROOT, "tokenizer_regression_corpus.txt")
+
+#the regression corpus is mostly lowercase, so these exercise the digit and uppercase accent rules
+_EXTRA_LINES = [
+    "0123456789",
+    "WMT10 a 22 520 000 paires, 3.14 et 1e9",
+    "ÉCOLE ÈRE NOËL FÊTE À Á Â ÎLE MAÏS ÖL CÔTE ÓÒ ÛÜÙ ÇA ŒUVRE",
+    "L’ÉTÉ 2010 n’était pas À 9°C",
+    "Œ0É1È2Ç",
+]
+
+
+def _corpus_lines():
+  with open(_CORPUS_PATH, "rb") as f:
+    lines = f.read().split(b"\n")
+  if lines and lines[-1] == b"":
+    lines.pop()
+  return lines + [line.encode("utf-8") if not isinstance(line, bytes) else line for line in _EXTRA_LINES]
+
+
+class CleanSentenceTest(unittest.TestCase):
+  """clean_sentence gives the output of the chained re.sub version it replaced."""
+
+  def setUp(self):
+    self.lines = _corpus_lines()
+
+  def check_language(self, language):
+    for line in self.lines:
+      self.assertEqual(preprocessing_benchmarks._reference_clean_sentence(line, language),
+                       vocabulary_utils.clean_sentence(line, language), "differs on %r" % line)
+
+  def test_english(self):
+    self.check_language("en")
+
+  def test_french(self):
+    self.check_language("fr")
+
+  def test_clean_sentences(self):
+    for language in ("en", "fr"):
+      expected = [preprocessing_benchmarks._reference_clean_sentence(line, language) for line in self.lines]
+      self.assertEqual(expected, vocabulary_utils.clean_sentences(self.lines, language))
+
+
+if __name__ == "__main__":
+  unittest.main()
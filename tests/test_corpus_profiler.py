@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+import artifact_utils
+import corpus_profiler
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_synthetic_corpus
+
+
+def _fail_count(job):
+  raise AssertionError("the cached profile should have been used")
+
+
+class CorpusProfileTest(ScratchDirectoryTestCase):
+  """Profiles count what a direct pass over the files counts, and their cache is reused until an input changes."""
+
+  def setUp(self):
+    super(CorpusProfileTest, self).setUp()
+    write_synthetic_corpus(self.path("train.en"), 300, long_line_words=200)
+    vocabulary_utils.clean_enfr_wmt_data(self.path("train.en.clean"), self.path("train.en"), language="en")
+    vocabulary_utils.create_vocabulary(self.path("vocabulary_15"), self.path("train.en.clean"), 15)
+    vocabulary_utils.integerize_sentences(self.path("train.en.clean"), self.path("train.en.clean.ids_15"), self.path("vocabulary_15"))
+    self.ids_path = self.path("train.en.clean.ids_15")
+
+  def check_profile(self, profile):
+    lines = self.read_bytes("train.en.clean.ids_15").splitlines()
+    lengths = Counter(len(line.split()) for line in lines)
+    self.assertEqual([lengths[i] for i in range(max(lengths) + 1)], profile.length_histogram.tolist())
+    self.assertEqual([lengths[i] for i in range(11)] + [sum(lengths[i] for i in lengths if i > 10)],
+                     profile.length_distribution(10))
+    ids = Counter(int(token) for line in lines for token in line.split())
+    self.assertEqual([ids[i] for i in range(15)], profile.id_frequencies.tolist())
+    text_bytes = Counter(bytearray(self.read_bytes("train.en.clean")))
+    self.assertEqual([text_bytes[i] for i in range(256)], profile.byte_histogram.tolist())
+    self.assertEqual(len(lines), profile.num_sentences)
+    self.assertEqual(sum(ids.values()), profile.num_tokens)
+
+  def test_histograms_match_direct_count(self):
+    #chunks much smaller than the files, so the counts are split across many of them
+    for workers in (1, 2):
+      artifact_utils.invalidate(corpus_profiler.profile_path(self.ids_path))
+      profile = corpus_profiler.profile_corpus(self.ids_path, 15, workers=workers, chunk_size=97)
+      self.check_profile(profile)
+      self.check_profile(corpus_profiler.CorpusProfile.load(corpus_profiler.profile_path(self.ids_path)))
+    self.assertGreater(profile.unk_rate(), 0)
+
+  def profile_without_counting(self):
+    #profile_corpus with the counting functions swapped for ones that fail, so only a cached profile can be returned
+    count_token_ids, count_bytes = corpus_profiler._count_token_ids, corpus_profiler._count_bytes
+    corpus_profiler._count_token_ids = corpus_profiler._count_bytes = _fail_count
+    try:
+      return corpus_profiler.profile_corpus(self.ids_path, 15)
+    finally:
+      corpus_profiler._count_token_ids, corpus_profiler._count_bytes = count_token_ids, count_bytes
+
+  def test_cache_is_built_once_and_reused(self):
+    self.assertFalse(os.path.exists(corpus_profiler.profile_path(self.ids_path)))
+    first = corpus_profiler.profile_corpus(self.ids_path, 15)
+    self.assertTrue(os.path.exists(corpus_profiler.profile_path(self.ids_path)))
+    cached = self.profile_without_counting()
+    for name in ("length_histogram", "id_frequencies", "byte_histogram"):
+      np.testing.assert_array_equal(getattr(first, name), getattr(cached, name))
+
+  def test_cache_is_rebuilt_when_an_input_changes(self):
+    corpus_profiler.profile_corpus(self.ids_path, 15)
+
+    #the same number of bytes of cleaned text, but other bytes, and an mtime a few seconds later
+    text = self.read_bytes("train.en.clean")
+    with open(self.path("train.en.clean"), "wb") as f:
+      f.write(text.replace(b"e", b"E"))
+    when = time.time() + 5
+    os.utime(self.path("train.en.clean"), (when, when))
+    with self.assertRaises(AssertionError):
+      self.profile_without_counting()
+    self.check_profile(corpus_profiler.profile_corpus(self.ids_path, 15))
+    self.profile_without_counting()
+
+    #more sentences in the integerized file, which rewrites its binary version
+    with open(self.ids_path, "ab") as f:
+      f.write(b"4 5 6\n")
+    with self.assertRaises(AssertionError):
+      self.profile_without_counting()
+    self.check_profile(corpus_profiler.profile_corpus(self.ids_path, 15))
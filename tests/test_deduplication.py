@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+
+import numpy as np
+
+import dataset_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _write_corpus(path, sentences, vocabulary_size=70000):
+  with dataset_utils.IntegerizedCorpusWriter(path, vocabulary_size) as writer:
+    for sentence in sentences:
+      writer.write(sentence)
+  return dataset_utils.IntegerizedCorpus(path)
+
+
+class DeduplicationTest(ScratchDirectoryTestCase):
+  """Vectorized pair hashes tell distinct pairs apart, and deduplication keeps the first of every repeat."""
+
+  def test_distinct_pairs_have_distinct_hashes(self):
+    #every sentence of up to three tokens from a tiny vocabulary, paired with every other, including empty ones
+    sentences = [list(tokens) for length in range(4) for tokens in itertools.product([0, 1, 69999], repeat=length)]
+    pairs = list(itertools.product(sentences, repeat=2))
+    source = _write_corpus(self.path("source.bin"), [pair[0] for pair in pairs])
+    target = _write_corpus(self.path("target.bin"), [pair[1] for pair in pairs])
+    hashes = dataset_utils.pair_hashes(source, target, 0, len(pairs))
+    self.assertEqual(np.uint64, hashes.dtype)
+    self.assertEqual(len(pairs), len(np.unique(hashes)))
+    for chunk_size in [1, 7, 5000]:
+      np.testing.assert_array_equal(hashes, dataset_utils.pair_hashes(source, target, 0, len(pairs), chunk_size))
+    np.testing.assert_array_equal(hashes[30:45], dataset_utils.pair_hashes(source, target, 30, 45, chunk_size=4))
+    self.assertEqual(0, len(dataset_utils.pair_hashes(source, target, 3, 3)))
+
+  def test_deduplicate_matches_set(self):
+    random = np.random.RandomState(2)
+    pool = [[int(x) for x in random.randint(4, 30, size=random.randint(0, 5))] for _ in range(40)]
+    pairs = [(pool[i], pool[j]) for i, j in random.randint(0, len(pool), size=(600, 2))]
+    for name, sentences in (("train.en.ids_30", [p[0] for p in pairs]), ("train.fr.ids_30", [p[1] for p in pairs])):
+      with open(self.path(name), "wb") as f:
+        f.write(b"".join(b" ".join(b"%d" % x for x in sentence) + b"\n" for sentence in sentences))
+      dataset_utils.maybe_convert_integerized_file_to_binary(self.path(name), 30)
+
+    expected = []
+    seen = set()
+    for source, target in pairs:
+      if (tuple(source), tuple(target)) not in seen:
+        seen.add((tuple(source), tuple(target)))
+        expected.append((source, target))
+    for block_size in [37, 1000000]:
+      outputs = (self.path("dedup%d.en" % block_size), self.path("dedup%d.fr" % block_size))
+      read, duplicates = dataset_utils.deduplicate_pairs(self.path("train.en.ids_30"), self.path("train.fr.ids_30"),
+                                                         outputs[0], outputs[1], block_size=block_size)
+      self.assertEqual((600, 600 - len(expected)), (read, duplicates))
+      written = [[[int(x) for x in line.split()] for line in self.read_bytes(path).splitlines()] for path in outputs]
+      self.assertEqual(expected, list(zip(*written)))
+      binary = dataset_utils.IntegerizedCorpus(dataset_utils.binary_corpus_path(outputs[1]))
+      self.assertEqual([target for _, target in expected], [binary[i].tolist() for i in range(len(binary))])
+
+  def test_sorted_hash_set_matches_set(self):
+    random = np.random.RandomState(8)
+    hash_set = dataset_utils.SortedHashSet()
+    seen = set()
+    #small values repeat within and across blocks, and the extremes of uint64 go at both ends of the array
+    for block_size in [0, 1, 50, 7, 300, 1, 1000]:
+      block = random.randint(0, 2000, size=block_size).astype(np.uint64)
+      if block_size > 2:
+        block[:2] = [np.iinfo(np.uint64).max, 0]
+      expected = []
+      for value in block.tolist():
+        expected.append(value not in seen)
+        seen.add(value)
+      self.assertEqual(expected, hash_set.add_block(block).tolist())
+      self.assertEqual(sorted(seen), hash_set.hashes.tolist())
+      self.assertEqual(np.uint64, hash_set.hashes.dtype)
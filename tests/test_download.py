@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import io
+import os
+import unittest
+
+import artifact_utils
+import download_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+_URL = "http://example.com/data/corpus.tgz"
+
+
+class _FakeResponse(io.BytesIO):
+
+  def __init__(self, data, code, headers):
+    io.BytesIO.__init__(self, data)
+    self.code = code
+    self.headers = headers
+
+  def getcode(self):
+    return self.code
+
+  def info(self):
+    return self.headers
+
+
+class _FakeServer(object):
+  #stands in for download_utils._open_url, serving one file and counting the requests
+
+  def __init__(self, data, ranges=True, content_range_size=True):
+    self.data = data
+    self.ranges = ranges
+    self.content_range_size = content_range_size
+    self.requests = 0
+
+  def __call__(self, url, start=None, end=None, timeout=60):
+    self.requests += 1
+    if start is None or not self.ranges:
+      return _FakeResponse(self.data, 200, {"Content-Length": str(len(self.data))})
+    end = len(self.data) if end is None else min(end, len(self.data))
+    size = str(len(self.data)) if self.content_range_size else "*"
+    return _FakeResponse(self.data[start:end], 206, {"Content-Range": "bytes %d-%d/%s" % (start, end - 1, size)})
+
+
+class MaybeDownloadTest(ScratchDirectoryTestCase):
+  """Downloads through a fake server: existing files, checksums, chunked and whole downloads."""
+
+  def setUp(self):
+    super(MaybeDownloadTest, self).setUp()
+    self.data = os.urandom(10000)
+    self.sha256 = hashlib.sha256(self.data).hexdigest()
+    self.original_open_url = download_utils._open_url
+    self.original_chunk_size = download_utils._DOWNLOAD_CHUNK_SIZE
+    download_utils._DOWNLOAD_CHUNK_SIZE = 1000
+
+  def tearDown(self):
+    download_utils._open_url = self.original_open_url
+    download_utils._DOWNLOAD_CHUNK_SIZE = self.original_chunk_size
+    super(MaybeDownloadTest, self).tearDown()
+
+  def serve(self, **options):
+    server = _FakeServer(self.data, **options)
+    download_utils._open_url = server
+    return server
+
+  def write_existing(self, data):
+    with open(self.path("corpus.tgz"), "wb") as f:
+      f.write(data)
+
+  def download(self, sha256=None):
+    return download_utils.maybe_download(self.directory, "corpus.tgz", _URL, sha256=sha256, connections=3)
+
+  def test_chunked_download(self):
+    server = self.serve()
+    self.assertEqual(self.path("corpus.tgz"), self.download(self.sha256))
+    self.assertEqual(self.data, self.read_bytes("corpus.tgz"))
+    self.assertEqual(11, server.requests)
+    self.assertFalse(os.path.exists(self.path("corpus.tgz.part")))
+    #complete now, so it isn't fetched again
+    self.download(self.sha256)
+    self.assertEqual(11, server.requests)
+
+  def test_whole_download_without_range_support(self):
+    server = self.serve(ranges=False)
+    self.download(self.sha256)
+    self.assertEqual(self.data, self.read_bytes("corpus.tgz"))
+    self.assertEqual(2, server.requests)
+
+  def test_range_of_unknown_size(self):
+    self.serve(content_range_size=False)
+    self.assertEqual((None, False), download_utils._probe_url(_URL))
+    self.download(self.sha256)
+    self.assertEqual(self.data, self.read_bytes("corpus.tgz"))
+
+  def test_existing_file_with_the_expected_sha256_is_kept_offline(self):
+    self.write_existing(self.data)
+    server = self.serve()
+    self.download(self.sha256)
+    self.assertEqual(0, server.requests)
+    self.assertTrue(artifact_utils.is_current(self.path("corpus.tgz"), "download", 1, [], {"sha256": self.sha256}))
+
+  def test_existing_file_without_sha256_is_kept_offline(self):
+    self.write_existing(self.data[:100])
+    server = self.serve()
+    self.download()
+    self.assertEqual(0, server.requests)
+    self.assertEqual(self.data[:100], self.read_bytes("corpus.tgz"))
+
+  def test_existing_file_with_the_wrong_sha256_is_downloaded_again(self):
+    self.write_existing(self.data[:100])
+    server = self.serve()
+    self.download(self.sha256)
+    self.assertGreater(server.requests, 0)
+    self.assertEqual(self.data, self.read_bytes("corpus.tgz"))
+
+  def test_wrong_sha256_of_the_download_raises(self):
+    self.serve()
+    with self.assertRaises(ValueError):
+      self.download(hashlib.sha256(b"something else").hexdigest())
+    self.assertFalse(os.path.exists(self.path("corpus.tgz")))
+    self.assertFalse(os.path.exists(self.path("corpus.tgz.part")))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+import embedding_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_vocabulary
+
+_EMBED_SIZE = 6
+
+
+def _format_vector(vector):
+  return b" ".join(("%r" % float(x)).encode("ascii") for x in vector)
+
+
+def _fail_reader(embedding_path, word_ids, matrix):
+  raise AssertionError("the embedding file was read again instead of the cache")
+
+
+class EmbeddingCacheTest(ScratchDirectoryTestCase):
+  """The cached matrix of a text embedding file equals a line by line parse, and is reused."""
+
+  def setUp(self):
+    super(EmbeddingCacheTest, self).setUp()
+    random = np.random.RandomState(8)
+    self.words = [b"w%d" % i for i in range(40)] + [b"caf\xc3\xa9"]
+    write_vocabulary(self.path("vocabulary"), self.words)
+    self.num_symbols = 4 + len(self.words)
+    #more lines than vocabulary words, in another order, with a repeat of a word later on
+    lines = [(b"other%d" % i, random.randn(_EMBED_SIZE)) for i in range(100)]
+    lines += [(word, random.randn(_EMBED_SIZE)) for word in self.words]
+    random.shuffle(lines)
+    lines.append((self.words[0], random.randn(_EMBED_SIZE)))
+    with open(self.path("glove.txt"), "wb") as f:
+      f.write(b"".join(word + b" " + _format_vector(vector) + b"\n" for word, vector in lines))
+    self.original_block_lines = embedding_utils._PARSE_BLOCK_LINES
+    embedding_utils._PARSE_BLOCK_LINES = 7
+
+  def tearDown(self):
+    embedding_utils._PARSE_BLOCK_LINES = self.original_block_lines
+    super(EmbeddingCacheTest, self).tearDown()
+
+  def expected_matrix(self):
+    #the first vector of every vocabulary word, parsed a float at a time
+    vectors = {}
+    with open(self.path("glove.txt"), "rb") as f:
+      for line in f:
+        parts = line.split()
+        vectors.setdefault(parts[0], [float(x) for x in parts[1:]])
+    matrix = np.zeros((self.num_symbols, _EMBED_SIZE), dtype=np.float32)
+    for i, word in enumerate(self.words):
+      matrix[4 + i] = vectors[word]
+    return matrix
+
+  def load(self, reader=embedding_utils.read_text_vectors, **options):
+    return embedding_utils.load_pretrained_matrix(self.path("vocabulary"), self.path("glove.txt"), self.num_symbols,
+                                                  _EMBED_SIZE, reader=reader,
+                                                  special_words=vocabulary_utils._INITIAL_VOCABULARY, **options)
+
+  def test_cache_matches_direct_parse(self):
+    expected = self.expected_matrix()
+    np.testing.assert_array_equal(expected, self.load())
+    cached = self.load(reader=_fail_reader)
+    self.assertIsInstance(cached, np.memmap)
+    np.testing.assert_array_equal(expected, cached)
+
+    embeddings = vocabulary_utils.pretrained_embeddings_matrix(self.num_symbols, _EMBED_SIZE, self.path("glove.txt"),
+                                                               self.path("vocabulary"))
+    np.testing.assert_array_equal(expected[4:], embeddings[4:])
+    np.testing.assert_array_equal(np.zeros(_EMBED_SIZE), embeddings[0])
+
+  def test_changed_vocabulary_gets_its_own_cache(self):
+    first_path = embedding_utils.embedding_cache_path(self.path("vocabulary"), self.path("glove.txt"), "glove",
+                                                      self.num_symbols, _EMBED_SIZE)
+    self.load()
+    write_vocabulary(self.path("vocabulary"), list(reversed(self.words)))
+    second_path = embedding_utils.embedding_cache_path(self.path("vocabulary"), self.path("glove.txt"), "glove",
+                                                       self.num_symbols, _EMBED_SIZE)
+    self.assertNotEqual(first_path, second_path)
+    self.words.reverse()
+    np.testing.assert_array_equal(self.expected_matrix(), self.load())
+
+  def test_missing_words(self):
+    write_vocabulary(self.path("vocabulary"), self.words + [b"unseen"])
+    self.num_symbols += 1
+    with self.assertRaises(KeyError):
+      self.load()
+    matrix = self.load(allow_missing=True)
+    np.testing.assert_array_equal(np.zeros(_EMBED_SIZE), matrix[-1])
+    self.assertEqual([self.num_symbols - 1], embedding_utils.missing_rows(self.path("vocabulary"), self.path("glove.txt"),
+                                                                          "glove", self.num_symbols, _EMBED_SIZE))
+
+  def test_wrong_dimension(self):
+    with self.assertRaises(ValueError):
+      embedding_utils.load_pretrained_matrix(self.path("vocabulary"), self.path("glove.txt"), self.num_symbols,
+                                             _EMBED_SIZE + 1, special_words=vocabulary_utils._INITIAL_VOCABULARY)
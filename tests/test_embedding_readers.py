@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+import numpy as np
+
+import embedding_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+_DIMENSION = 4
+_WORDS = [b"the", b"caf\xc3\xa9", b"cat", b"</s>"]
+
+
+def _write_word2vec_binary(path, words, vectors, newlines=True):
+  with open(path, "wb") as f:
+    f.write(b"%d %d\n" % (len(words), vectors.shape[1]))
+    for word, vector in zip(words, vectors):
+      f.write(word + b" " + vector.astype("<f4").tobytes() + (b"\n" if newlines else b""))
+
+
+def _write_fasttext_model(path, words, input_matrix, bucket, minn, maxn, pruned=None):
+  #the layout of a version 12 fastText .bin model, up to the end of its input matrix
+  with open(path, "wb") as f:
+    f.write(struct.pack("<ii", 793712314, 12))
+    f.write(struct.pack("<12id", input_matrix.shape[1], 5, 5, 1, 5, 1, 1, 1, bucket, minn, maxn, 100, 1e-4))
+    f.write(struct.pack("<iiiqq", len(words), len(words), 0, 1000, -1 if pruned is None else len(pruned)))
+    for word in words:
+      f.write(word + b"\0" + struct.pack("<qb", 10, 0))
+    for ngram_hash, index in sorted((pruned or {}).items()):
+      f.write(struct.pack("<ii", ngram_hash, index))
+    f.write(struct.pack("<?qq", False, input_matrix.shape[0], input_matrix.shape[1]))
+    f.write(input_matrix.astype("<f4").tobytes())
+
+
+class FasttextHashTest(ScratchDirectoryTestCase):
+
+  def test_hash(self):
+    #FNV-1a test vectors, and a byte above 0x7f sign extended as fastText's char is
+    self.assertEqual(0xe40c292c, embedding_utils._fasttext_hash(b"a"))
+    self.assertEqual(0xbf9cf968, embedding_utils._fasttext_hash(b"foobar"))
+    self.assertEqual(((2166136261 ^ 0xffffffc3) * 16777619) & 0xffffffff, embedding_utils._fasttext_hash(b"\xc3"))
+
+  def test_subwords_keep_utf8_characters_whole(self):
+    def rows(ngrams):
+      return [10 + embedding_utils._fasttext_hash(ngram) % 1000 for ngram in ngrams]
+    self.assertEqual(rows([b"<a", b"<ab", b"ab", b"ab>", b"b>"]), embedding_utils.fasttext_subword_rows(b"ab", 10, 1000, 2, 3))
+    self.assertEqual(rows([b"<\xc3\xa9", b"\xc3\xa9", b"\xc3\xa9>"]),
+                     embedding_utils.fasttext_subword_rows(b"\xc3\xa9", 10, 1000, 1, 2))
+
+
+class EmbeddingReadersTest(ScratchDirectoryTestCase):
+  """The word2vec and fastText readers copy the vectors of the vocabulary words from synthetic files."""
+
+  def setUp(self):
+    super(EmbeddingReadersTest, self).setUp()
+    self.vectors = np.random.RandomState(11).randn(len(_WORDS), _DIMENSION).astype(np.float32)
+    #a vocabulary of two words of the file, in another order, and one it lacks
+    self.word_ids = {b"caf\xc3\xa9": 0, b"the": 1, b"dog": 2}
+
+  def read(self, reader, path):
+    matrix = np.zeros((3, _DIMENSION), dtype=np.float32)
+    return matrix, reader(self.path(path), self.word_ids, matrix)
+
+  def test_word2vec_formats(self):
+    _write_word2vec_binary(self.path("vectors.bin"), _WORDS, self.vectors)
+    _write_word2vec_binary(self.path("bare.bin"), _WORDS, self.vectors, newlines=False)
+    with open(self.path("vectors.txt"), "wb") as f:
+      f.write(b"%d %d\n" % (len(_WORDS), _DIMENSION))
+      for word, vector in zip(_WORDS, self.vectors):
+        f.write(word + b" " + b" ".join(b"%r" % float(x) for x in vector) + b"\n")
+    for path in ("vectors.bin", "bare.bin", "vectors.txt"):
+      matrix, found = self.read(embedding_utils.READERS["word2vec"], path)
+      self.assertEqual([True, True, False], found.tolist(), path)
+      np.testing.assert_array_equal(self.vectors[[1, 0]], matrix[:2], path)
+      self.assertEqual(_WORDS[:2], embedding_utils.read_embedding_words(self.path(path), "word2vec", limit=2))
+    _write_word2vec_binary(self.path("short.bin"), _WORDS, self.vectors)
+    with open(self.path("short.bin"), "r+b") as f:
+      f.truncate(30)
+    with self.assertRaises(ValueError):
+      self.read(embedding_utils.read_word2vec_binary, "short.bin")
+
+  def test_fasttext_model(self):
+    bucket, minn, maxn = 50, 2, 3
+    input_matrix = np.random.RandomState(12).randn(len(_WORDS) + bucket, _DIMENSION).astype(np.float32)
+    _write_fasttext_model(self.path("model.bin"), _WORDS, input_matrix, bucket, minn, maxn)
+    matrix, found = self.read(embedding_utils.read_fasttext_model, "model.bin")
+    self.assertEqual([True, True, True], found.tolist())
+    for word, row in self.word_ids.items():
+      rows = embedding_utils.fasttext_subword_rows(word, len(_WORDS), bucket, minn, maxn)
+      if word in _WORDS:
+        rows.append(_WORDS.index(word))
+      np.testing.assert_allclose(input_matrix[rows].mean(axis=0), matrix[row], atol=1e-6)
+    self.assertEqual(_WORDS, embedding_utils.read_embedding_words(self.path("model.bin"), "fasttext"))
+
+    #a pruned model keeps rows for only some ngrams
+    dog_hashes = [row - len(_WORDS) for row in embedding_utils.fasttext_subword_rows(b"dog", len(_WORDS), bucket, minn, maxn)]
+    pruned = {dog_hashes[0]: 0, dog_hashes[1]: 1}
+    _write_fasttext_model(self.path("pruned.bin"), _WORDS, input_matrix[:len(_WORDS) + 2], bucket, minn, maxn, pruned)
+    matrix, found = self.read(embedding_utils.read_fasttext_vectors, "pruned.bin")
+    self.assertTrue(found[2])
+    rows = [len(_WORDS) + pruned[h] for h in dog_hashes if h in pruned]
+    self.assertLess(len(rows), len(dog_hashes))
+    np.testing.assert_allclose(input_matrix[rows].mean(axis=0), matrix[2], atol=1e-6)
+
+  def test_fasttext_dimension_mismatch(self):
+    _write_fasttext_model(self.path("model.bin"), _WORDS, np.zeros((len(_WORDS) + 5, _DIMENSION + 1)), 5, 2, 3)
+    with self.assertRaises(ValueError):
+      self.read(embedding_utils.read_fasttext_model, "model.bin")
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, synthetic_lines
+
+_EN_WORDS = [b"The", b"cat", b"SAT", b"on", b"a", b"mat", b"42", b"3.14", b"it's", b"(hello)", b"end.", b"e-mail",
+             b"naive", b"2010", b"U.S.", b"\xe2\x80\x94"]
+_FR_WORDS = [b"Le", b"chat", b"\xc3\x89T\xc3\x89", b"caf\xc3\xa9", b"d\xc3\xa9j\xc3\xa0", b"l\xe2\x80\x99homme", b"\xc5\x92UVRE",
+             b"gar\xc3\xa7on", b"19", b"\xc3\x80", b"l'\xc3\xaele", b"na\xc3\xafve", b"\xc2\xabbonjour\xc2\xbb", b"C\xc3\x94T\xc3\x89"]
+
+
+class FusedPreprocessingTest(ScratchDirectoryTestCase):
+  """prepare_wmt_data writes the same vocabularies and integerized files with and without fused."""
+
+  def setUp(self):
+    super(FusedPreprocessingTest, self).setUp()
+    #the files the downloads would leave, so prepare_wmt_data finds them and downloads nothing
+    for mode in ("default", "fused"):
+      os.mkdir(self.path(mode))
+      for name, num_lines, seed in (("giga-fren.release2.fixed", 400, 0), ("newstest2013", 60, 10)):
+        for language, words in (("en", _EN_WORDS), ("fr", _FR_WORDS)):
+          lines = synthetic_lines(num_lines, seed=seed + (language == "fr"), words=words)
+          with open(os.path.join(self.path(mode), "%s.%s" % (name, language)), "wb") as f:
+            f.write(b"\n".join(lines) + b"\n")
+
+  def prepare(self, en_vocabulary_size, fr_vocabulary_size):
+    outputs = {}
+    for mode in ("default", "fused"):
+      paths = vocabulary_utils.prepare_wmt_data(self.path(mode), en_vocabulary_size, fr_vocabulary_size,
+                                                fused=mode == "fused", write_clean_files=True)
+      outputs[mode] = [os.path.relpath(path, self.path(mode)) for path in paths]
+    self.assertEqual(outputs["default"], outputs["fused"])
+    return outputs["default"]
+
+  def assert_same_files(self, names):
+    for name in names:
+      default = self.read_bytes(os.path.join("default", name))
+      self.assertTrue(default, name)
+      self.assertEqual(default, self.read_bytes(os.path.join("fused", name)), name)
+
+  def test_fused_matches_default(self):
+    #small vocabularies, so both languages have unknown words, then large ones from the same caches and clean files
+    for en_vocabulary_size, fr_vocabulary_size in ((10, 12), (1000, 1000)):
+      names = self.prepare(en_vocabulary_size, fr_vocabulary_size)
+      self.assertEqual(6, len(names))
+      self.assert_same_files(names)
+      self.assert_same_files([name + ".bin" for name in names[:4]])
+    self.assert_same_files(["giga-fren.release2.fixed.en.clean", "giga-fren.release2.fixed.fr.clean",
+                            "newstest2013.en.clean", "newstest2013.fr.clean"])
+
+    ids = self.read_bytes(os.path.join("fused", "giga-fren.release2.fixed.fr.clean.ids_12")).split()
+    self.assertIn(b"%d" % vocabulary_utils.UNK_ID, ids)
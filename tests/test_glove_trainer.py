@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+from collections import defaultdict
+
+import numpy as np
+from six.moves import cStringIO
+
+import embedding_utils
+import glove_trainer
+from corpus_fixtures import ScratchDirectoryTestCase, write_vocabulary
+
+_VOCABULARY_SIZE = 24
+
+
+def _brute_force_cooccurrences(sentences, window_size):
+  counts = defaultdict(float)
+  for sentence in sentences:
+    for i, left in enumerate(sentence):
+      for j in range(i + 1, min(i + window_size + 1, len(sentence))):
+        counts[(left, sentence[j])] += 1. / (j - i)
+        counts[(sentence[j], left)] += 1. / (j - i)
+  return counts
+
+
+class GloveTrainerTest(ScratchDirectoryTestCase):
+  """Cooccurrence counts match a brute force count, and training fits them."""
+
+  def setUp(self):
+    super(GloveTrainerTest, self).setUp()
+    random = np.random.RandomState(10)
+    #two topics that never share a sentence: ids 4 to 13 and ids 14 to 23
+    self.sentences = []
+    for i in range(600):
+      low = 4 if i % 2 else 14
+      self.sentences.append(random.randint(low, low + 10, size=random.randint(0, 12)).tolist())
+    with open(self.path("train.ids_24"), "wb") as f:
+      f.write(b"".join(b" ".join(b"%d" % x for x in sentence) + b"\n" for sentence in self.sentences))
+
+  def test_counts_match_brute_force(self):
+    expected = _brute_force_cooccurrences(self.sentences, 3)
+    for workers, max_buffered_pairs in ((1, 20000000), (3, 500)):
+      path = self.path("train.cooc3.%d" % workers)
+      glove_trainer.count_cooccurrences(self.path("train.ids_24"), _VOCABULARY_SIZE, path, window_size=3, workers=workers,
+                                        max_buffered_pairs=max_buffered_pairs, block_sentences=37)
+      records, vocabulary_size = glove_trainer.load_cooccurrences(path)
+      self.assertEqual(_VOCABULARY_SIZE, vocabulary_size)
+      keys = records["row"].astype(np.int64) * vocabulary_size + records["col"]
+      self.assertTrue(np.all(np.diff(keys) > 0), "records are sorted and unique")
+      self.assertEqual(sorted(expected), list(zip(records["row"].tolist(), records["col"].tolist())))
+      np.testing.assert_allclose([expected[key] for key in sorted(expected)], records["value"], rtol=1e-5)
+
+  def test_training_lowers_the_cost_and_separates_topics(self):
+    path = glove_trainer.count_cooccurrences(self.path("train.ids_24"), _VOCABULARY_SIZE, self.path("train.cooc5"), window_size=5)
+    output = cStringIO()
+    stdout, sys.stdout = sys.stdout, output
+    try:
+      vectors = glove_trainer.train_glove(path, 8, iterations=30, batch_size=64, shuffle_block_size=100)
+    finally:
+      sys.stdout = stdout
+    costs = [float(line.rsplit(" ", 1)[1]) for line in output.getvalue().splitlines() if line.startswith("GloVe iteration")]
+    self.assertEqual(30, len(costs))
+    self.assertLess(costs[-1], costs[0] / 4)
+    self.assertTrue(all(np.isfinite(costs)))
+
+    normalized = vectors[4:] / np.linalg.norm(vectors[4:], axis=1, keepdims=True)
+    similarities = normalized.dot(normalized.T)
+    same_topic = np.kron(np.eye(2), np.ones((10, 10))).astype(bool)
+    self.assertGreater(similarities[same_topic & ~np.eye(20, dtype=bool)].mean(), similarities[~same_topic].mean() + 0.5)
+
+  def test_written_vectors_are_read_back(self):
+    write_vocabulary(self.path("vocabulary_24"), [b"w%d" % i for i in range(20)])
+    output_path = glove_trainer.train_glove_embeddings(self.path("train.ids_24"), self.path("vocabulary_24"), _VOCABULARY_SIZE,
+                                                       4, window_size=2, iterations=2)
+    self.assertEqual(glove_trainer.trained_vectors_path(self.path("vocabulary_24"), 4), output_path)
+    matrix = np.zeros((_VOCABULARY_SIZE, 4), dtype=np.float32)
+    words = embedding_utils.read_vocabulary_words(self.path("vocabulary_24"))
+    self.assertTrue(embedding_utils.read_text_vectors(output_path, dict((w, i) for i, w in enumerate(words)), matrix).all())
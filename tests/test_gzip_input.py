@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import shutil
+import threading
+
+import download_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_synthetic_corpus
+
+
+class GzipInputTest(ScratchDirectoryTestCase):
+  """A gzipped corpus is read as a stream and cleans to the same bytes as the uncompressed one."""
+
+  def setUp(self):
+    super(GzipInputTest, self).setUp()
+    write_synthetic_corpus(self.path("corpus.en"), 500, long_line_words=2000)
+    with open(self.path("corpus.en"), "rb") as plain, gzip.open(self.path("corpus.en.gz"), "wb") as compressed:
+      shutil.copyfileobj(plain, compressed)
+    with open(self.path("corpus.en"), "rb") as f:
+      self.lines = f.readlines()
+
+  def test_reader_lines_match_file(self):
+    #chunks much shorter than the lines, so lines are put together across chunks
+    with download_utils.GzipLineReader(self.path("corpus.en.gz"), chunk_size=97, max_queued_blocks=2) as reader:
+      self.assertEqual(self.lines, list(reader))
+    self.assertFalse(self.lines[-1].endswith(b"\n"))
+
+  def test_abandoned_reader_does_not_hang(self):
+    reader = download_utils.GzipLineReader(self.path("corpus.en.gz"), chunk_size=64, max_queued_blocks=1)
+    self.assertEqual(self.lines[0], next(iter(reader)))
+    closing = threading.Thread(target=reader.close)
+    closing.start()
+    closing.join(10)
+    self.assertFalse(closing.is_alive())
+
+  def test_byte_ranges_match_plain_file(self):
+    start = sum(len(line) for line in self.lines[:40])
+    end = sum(len(line) for line in self.lines[:300])
+    for range_end, expected in ((end, self.lines[40:300]), (None, self.lines[40:])):
+      for name in ("corpus.en", "corpus.en.gz"):
+        self.assertEqual(expected, list(vocabulary_utils._iterate_input_lines(self.path(name), start, range_end)))
+
+  def test_clean_matches_plain_file(self):
+    vocabulary_utils.clean_enfr_wmt_data(self.path("plain.clean"), self.path("corpus.en"), language="en")
+    expected = self.read_bytes("plain.clean")
+    self.assertTrue(expected)
+    for workers in (1, 3):
+      output = "gzipped.%d.clean" % workers
+      vocabulary_utils.clean_enfr_wmt_data(self.path(output), self.path("corpus.en.gz"), language="en", workers=workers)
+      self.assertEqual(expected, self.read_bytes(output), "cleaning the gzipped corpus with %d workers" % workers)
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import Counter
+
+import numpy as np
+
+import artifact_utils
+import heavy_hitters
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _letters(number):
+  #a distinct word made of letters for every number, since the tokenizer splits digits off words
+  word = b""
+  while True:
+    word += b"abcdefghijklmnopqrstuvwxyz"[number % 26:number % 26 + 1]
+    number //= 26
+    if not number:
+      return b"x" + word
+
+
+def _zipf_tokens(count, num_words, exponent, seed):
+  random = np.random.RandomState(seed)
+  probabilities = 1. / np.arange(1, num_words + 1) ** exponent
+  return [_letters(i) for i in random.choice(num_words, size=count, p=probabilities / probabilities.sum())]
+
+
+class MisraGriesSummaryTest(ScratchDirectoryTestCase):
+  """Summary counts stay within the error bound through updates and merges, and verified approximate vocabularies are exact."""
+
+  def check_summary(self, summary, true_counts):
+    self.assertEqual(sum(true_counts.values()), summary.total)
+    self.assertLessEqual(len(summary), summary.capacity)
+    self.assertLessEqual(summary.error, summary.error_bound())
+    for token, count in true_counts.items():
+      approximate = summary.counts.get(token, 0)
+      self.assertLessEqual(approximate, count, token)
+      self.assertLessEqual(count - approximate, summary.error, token)
+      self.assertLessEqual(count - approximate, summary.total // (summary.capacity + 1), token)
+      if count > summary.error:
+        self.assertIn(token, summary.counts)
+
+  def test_merged_summaries_keep_the_bound(self):
+    for capacity in (1, 5, 40):
+      merged = heavy_hitters.MisraGriesSummary(capacity)
+      true_counts = Counter()
+      #parts with different distributions, each counted in blocks as a worker counts its shard
+      for part, exponent in enumerate((1.1, 0.5, 0.)):
+        tokens = _zipf_tokens(4000, 300, exponent, seed=part)
+        summary = heavy_hitters.MisraGriesSummary(capacity)
+        for start in range(0, len(tokens), 250):
+          summary.update(Counter(tokens[start:start + 250]))
+        self.check_summary(summary, Counter(tokens))
+        merged.merge(summary)
+        true_counts.update(tokens)
+        self.check_summary(merged, true_counts)
+      self.assertGreater(merged.error, 0)
+
+  def write_corpus(self, name, lines):
+    with open(self.path(name), "wb") as f:
+      f.write(b"".join(b" ".join(line) + b"\n" for line in lines))
+    return self.path(name)
+
+  def approximate_and_exact(self, data_path, vocabulary_size, capacity, workers=1, name="approximate"):
+    #writes the vocabulary counted with capacity counters to name, and the one from exact counts to "exact"
+    table, exact = vocabulary_utils.get_approximate_token_count_table(data_path, vocabulary_size, capacity, workers=workers)
+    vocabulary_utils.create_vocabulary(self.path(name), data_path, vocabulary_size, workers=workers,
+                                       counter_capacity=capacity)
+    vocabulary_utils.create_vocabulary(self.path("exact"), data_path, vocabulary_size)
+    return table, exact
+
+  def test_vocabulary_when_nothing_is_dropped(self):
+    tokens = _zipf_tokens(20000, 50, 1., seed=3)
+    data_path = self.write_corpus("corpus", [tokens[i:i + 10] for i in range(0, len(tokens), 10)])
+    summary, _ = vocabulary_utils.summarize_tokens(data_path, 60)
+    self.assertEqual(0, summary.error)
+    _, exact = self.approximate_and_exact(data_path, 24, 60)
+    self.assertTrue(exact)
+    self.assertEqual(self.read_bytes("exact"), self.read_bytes("approximate"))
+
+  def test_vocabulary_verified_by_the_exact_second_pass(self):
+    tokens = _zipf_tokens(30000, 200, 1.2, seed=0)
+    data_path = self.write_corpus("corpus", [tokens[i:i + 10] for i in range(0, len(tokens), 10)])
+    true_counts = Counter(tokens)
+    for workers in (1, 3):
+      summary, _ = vocabulary_utils.summarize_tokens(data_path, 30, workers=workers)
+      #the first pass undercounts the vocabulary tokens, so only the exact counts of the second pass order them right
+      self.assertGreater(summary.error, 0)
+      self.assertTrue(any(summary.counts.get(token, 0) != true_counts[token] for token, _ in true_counts.most_common(10)))
+      table, exact = self.approximate_and_exact(data_path, 14, 30, workers=workers)
+      self.assertTrue(exact)
+      self.assertEqual(self.read_bytes("exact"), self.read_bytes("approximate"), "%d workers" % workers)
+      for token, count in table.as_counter().items():
+        self.assertEqual(true_counts[token], count)
+
+  def test_vocabulary_that_cannot_be_verified(self):
+    #a few frequent words, words that occur five times in a few lines, and a word that occurs three times in every line.
+    #each shard's summary drops the triples, with an error of 3, and keeps the words that occur five times
+    random = np.random.RandomState(5)
+    lines = []
+    for i in range(3000):
+      line = [b"frequent" + _letters(word) for word in random.randint(0, 20, size=5)] + [b"triple" + _letters(i)] * 3
+      if i % 80 == 0:
+        line += [b"five" + _letters(i)] * 5
+      lines.append(line)
+    data_path = self.write_corpus("corpus", lines)
+    true_counts = Counter(token for line in lines for token in line)
+
+    #one shard: the error is below 5, so a vocabulary that ends in the words that occur five times is verified
+    table, exact = self.approximate_and_exact(data_path, 34, 64, workers=1)
+    self.assertTrue(exact)
+    self.assertEqual(self.read_bytes("exact"), self.read_bytes("approximate"))
+
+    #three shards: their errors add up past 5. with 34 the vocabulary ends on candidates counted no more than
+    #the error, with 64 it needs more candidates than there are
+    summary, _ = vocabulary_utils.summarize_tokens(data_path, 64, workers=3)
+    self.assertGreaterEqual(summary.error, 5)
+    verified = len(vocabulary_utils._INITIAL_VOCABULARY) + sum(1 for count in true_counts.values() if count > summary.error)
+    self.assertGreater(verified, len(vocabulary_utils._INITIAL_VOCABULARY))
+    for vocabulary_size in (34, 64):
+      table, exact = self.approximate_and_exact(data_path, vocabulary_size, 64, workers=3, name="approximate_%d" % vocabulary_size)
+      self.assertFalse(exact)
+      self.assertEqual(vocabulary_size - len(vocabulary_utils._INITIAL_VOCABULARY) <= len(table), vocabulary_size == 34)
+
+      #every word above the error is still where the exact vocabulary has it
+      exact_words = self.read_bytes("exact").split(b"\n")
+      approximate_words = self.read_bytes("approximate_%d" % vocabulary_size).split(b"\n")
+      self.assertEqual(exact_words[:verified], approximate_words[:verified])
+      #and the file records the capacity, so it is never taken for the exact vocabulary
+      manifest = artifact_utils.load_manifest(self.path("approximate_%d" % vocabulary_size))
+      self.assertEqual(64, manifest["params"]["counter_capacity"])
+      self.assertFalse(artifact_utils.is_current(self.path("approximate_%d" % vocabulary_size), "vocabulary",
+                                                 vocabulary_utils._PREPROCESSING_VERSION, [data_path],
+                                                 {"max_vocabulary_size": vocabulary_size}, verbose=False))
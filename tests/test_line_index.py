@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+import dataset_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _write_ids_lines(path, sentences):
+  with open(path, "wb") as f:
+    f.write(b"".join(b" ".join(b"%d" % i for i in sentence) + b"\n" for sentence in sentences))
+
+
+class LineIndexTest(ScratchDirectoryTestCase):
+  """Seeking through a line index gives the lines that reading past them would, and stale indexes are rebuilt."""
+
+  def setUp(self):
+    super(LineIndexTest, self).setUp()
+    random = np.random.RandomState(2)
+    self.source = [random.randint(4, 1000, size=random.randint(0, 12)).tolist() for _ in range(200)]
+    self.target = [random.randint(4, 1000, size=random.randint(0, 14)).tolist() for _ in range(200)]
+    _write_ids_lines(self.path("train.en.ids_1000"), self.source)
+    _write_ids_lines(self.path("train.fr.ids_1000"), self.target)
+
+  def read_skipping(self, ignore_lines, max_size, max_source, max_target):
+    #what load_dataset_in_memory gave when it read its way past the first ignore_lines lines
+    pairs = []
+    with open(self.path("train.en.ids_1000"), "rb") as source_file, open(self.path("train.fr.ids_1000"), "rb") as target_file:
+      for line_number, (source, target) in enumerate(zip(source_file, target_file)):
+        if line_number < ignore_lines:
+          continue
+        source_ids = [int(x) for x in source.split()]
+        target_ids = [int(x) for x in target.split()] + [vocabulary_utils.EOS_ID]
+        if len(source_ids) <= max_source and len(target_ids) < max_target:
+          pairs.append((source_ids, target_ids))
+        #max_size counts the lines read, not the pairs kept
+        if max_size and line_number + 1 - ignore_lines >= max_size:
+          break
+    return pairs
+
+  def test_ignore_lines_matches_reading(self):
+    for ignore_lines in (0, 1, 37, 180, 199):
+      for max_size in (None, 20):
+        data_set, _ = vocabulary_utils.load_dataset_in_memory(self.path("train.en.ids_1000"), self.path("train.fr.ids_1000"),
+                                                              8, 10, max_size=max_size, ignore_lines=ignore_lines)
+        self.assertEqual(self.read_skipping(ignore_lines, max_size, 8, 10), list(data_set), (ignore_lines, max_size))
+
+  def test_line_starts(self):
+    index = dataset_utils.LineIndex.for_file(self.path("train.en.ids_1000"))
+    contents = self.read_bytes("train.en.ids_1000")
+    self.assertEqual(200, len(index))
+    for line_number in (0, 1, 100, 199):
+      start = index.line_start(line_number)
+      self.assertEqual(contents.split(b"\n")[line_number], contents[start:].split(b"\n")[0])
+    self.assertEqual(len(contents), index.line_start(200))
+
+  def test_rewrite_with_the_same_size_rebuilds(self):
+    path = self.path("same_size.ids")
+    with open(path, "wb") as f:
+      f.write(b"1 22\n333\n4\n")
+    first = dataset_utils.LineIndex.for_file(path)
+    self.assertEqual([0, 5, 9], first.offsets.tolist())
+    #reused while the file is unchanged
+    self.assertEqual(first.file_mtime, dataset_utils.LineIndex.for_file(path).file_mtime)
+
+    stat = os.stat(path)
+    with open(path, "wb") as f:
+      f.write(b"1\n22 333 4\n")
+    self.assertEqual(stat.st_size, os.path.getsize(path))
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    self.assertEqual([0, 2], dataset_utils.LineIndex.for_file(path).offsets.tolist())
+
+  def test_older_format_rebuilds(self):
+    path = self.path("train.en.ids_1000")
+    with open(dataset_utils.line_index_path(path), "wb") as f:
+      f.write(b"NMTLIDX1" + b"\0" * 40)
+    self.assertEqual(200, len(dataset_utils.LineIndex.for_file(path)))
+    self.assertFalse(os.path.exists(dataset_utils.line_index_path(path) + ".tmp"))
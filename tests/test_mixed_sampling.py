@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+import dataset_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+class MixedSamplingTest(ScratchDirectoryTestCase):
+  """Streamed batches from several corpora follow the weights and the length filters."""
+
+  def setUp(self):
+    super(MixedSamplingTest, self).setUp()
+    random = np.random.RandomState(6)
+    #the source of every pair is one id telling which corpus and line it came from
+    for name, first_id, num_lines in (("main", 100, 400), ("extra", 10000, 300)):
+      with open(self.path(name + ".en.ids_20000"), "wb") as source, open(self.path(name + ".fr.ids_20000"), "wb") as target:
+        for i in range(num_lines):
+          source.write(b"%d\n" % (first_id + i))
+          target.write(b" ".join(b"%d" % x for x in random.randint(4, 50, size=random.randint(0, 16))) + b"\n")
+    #one corpus read through its binary files, the other through its line index
+    for language in ("en", "fr"):
+      dataset_utils.maybe_convert_integerized_file_to_binary(self.path("extra.%s.ids_20000" % language), 20000)
+
+  def open(self, seed, main_weight=3., extra_weight=1.):
+    return vocabulary_utils.open_streaming_dataset(self.path("main.en.ids_20000"), self.path("main.fr.ids_20000"), 5, 10,
+                                                   ignore_lines=50, buffer_size=100, weight=main_weight, seed=seed,
+                                                   extra_corpora=[(self.path("extra.en.ids_20000"),
+                                                                   self.path("extra.fr.ids_20000"), extra_weight)])
+
+  def test_weights_and_filters(self):
+    dataset = self.open(seed=1)
+    self.assertIsInstance(dataset, dataset_utils.MixedSentencePairSource)
+    pairs = [pair for _ in range(125) for pair in dataset.sample(64)]
+    sources = np.array([source[0] for source, _ in pairs])
+    self.assertFalse(np.any(sources < 150), "the first ignore_lines lines of the main corpus are never drawn")
+    self.assertAlmostEqual(0.75, np.mean(sources < 10000), delta=0.02)
+    self.assertEqual([int(np.sum(sources < 10000)), int(np.sum(sources >= 10000))], dataset.consumed.tolist())
+    for _, target in pairs:
+      self.assertEqual(vocabulary_utils.EOS_ID, target[-1])
+      self.assertLess(len(target), 10)
+
+  def test_seed_reproduces_batches(self):
+    first, second = self.open(seed=4), self.open(seed=4)
+    for _ in range(5):
+      self.assertEqual(first.sample(32), second.sample(32))
+
+  def test_zero_weight_corpus_is_never_drawn(self):
+    dataset = self.open(seed=2, extra_weight=0.)
+    self.assertTrue(all(source[0] < 10000 for source, _ in dataset.sample(500)))
+    with self.assertRaises(ValueError):
+      self.open(seed=2, main_weight=-1.)
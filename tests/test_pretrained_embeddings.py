@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gc
+import weakref
+
+import numpy as np
+import tensorflow as tf
+
+import embedding_utils
+import embeddings
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_vocabulary
+
+_EMBED_SIZE = 16
+
+
+class PretrainedEmbeddingsTest(ScratchDirectoryTestCase):
+  """Pretrained vectors reach their variable through a placeholder, so the graph holds no copy of them."""
+
+  def setUp(self):
+    super(PretrainedEmbeddingsTest, self).setUp()
+    random = np.random.RandomState(9)
+    words = [b"w%d" % i for i in range(300)]
+    write_vocabulary(self.path("vocabulary"), words)
+    self.num_symbols = 4 + len(words)
+    with open(self.path("glove.txt"), "wb") as f:
+      for word in words:
+        f.write(word + b" " + b" ".join(b"%.6f" % x for x in random.randn(_EMBED_SIZE)) + b"\n")
+    self.expected = embedding_utils.load_pretrained_matrix(self.path("vocabulary"), self.path("glove.txt"), self.num_symbols,
+                                                           _EMBED_SIZE, special_words=vocabulary_utils._INITIAL_VOCABULARY)
+    #the flags would name these files
+    self.original_determine = embeddings._determine_embedding_and_vocabulary_file
+    embeddings._determine_embedding_and_vocabulary_file = lambda *_: (self.path("glove.txt"), self.path("vocabulary"))
+
+  def tearDown(self):
+    embeddings._determine_embedding_and_vocabulary_file = self.original_determine
+    super(PretrainedEmbeddingsTest, self).tearDown()
+
+  def build(self, graph):
+    with graph.as_default():
+      inputs = tf.placeholder(tf.int32, shape=[None])
+      embedded, variable = embeddings.get_word_embeddings(inputs, self.num_symbols, _EMBED_SIZE, "source",
+                                                          embed_algorithm="glove", return_list=False, dtype=tf.float32)
+      return inputs, embedded, variable
+
+  def test_graph_holds_no_matrix(self):
+    graph = tf.Graph()
+    self.build(graph)
+    self.assertLess(graph.as_graph_def().ByteSize(), self.expected.nbytes)
+    for node in graph.as_graph_def().node:
+      if node.op == "Const":
+        self.assertLess(len(node.attr["value"].tensor.tensor_content), self.expected.nbytes, node.name)
+
+  def test_assigned_values(self):
+    graph = tf.Graph()
+    inputs, embedded, variable = self.build(graph)
+    other_graph = tf.Graph()
+    self.build(other_graph)
+    self.assertEqual(1, len(embeddings._PRETRAINED_EMBEDDINGS[graph]))
+    self.assertEqual(1, len(embeddings._PRETRAINED_EMBEDDINGS[other_graph]))
+    with tf.Session(graph=graph) as session:
+      session.run(tf.variables_initializer([variable]))
+      self.assertFalse(session.run(variable).any())
+      embeddings.initialize_pretrained_embeddings(session)
+      values = session.run(variable)
+      np.testing.assert_allclose(self.expected[4:], values[4:])
+      np.testing.assert_array_equal(np.zeros(_EMBED_SIZE), values[0])
+      self.assertTrue(values[1:4].any())
+      np.testing.assert_allclose(self.expected[[7, 5]], session.run(embedded, feed_dict={inputs: [7, 5]}))
+
+  def test_entries_go_away_with_their_graph(self):
+    graph = tf.Graph()
+    self.build(graph)
+    self.assertEqual(1, len(embeddings._PRETRAINED_EMBEDDINGS[graph]))
+    graph_reference = weakref.ref(graph)
+    del graph
+    gc.collect()
+    self.assertIsNone(graph_reference())
@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+import dataset_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _write_ids_file(path, random, num_lines, max_length):
+  with open(path, "wb") as f:
+    for _ in range(num_lines):
+      f.write(b" ".join(b"%d" % i for i in random.randint(4, 50, size=random.randint(0, max_length + 1))) + b"\n")
+
+
+class ReservoirSamplerTest(unittest.TestCase):
+
+  def test_take_matches_next_slot(self):
+    for size in [0, 1, 5, 40]:
+      one_at_a_time = dataset_utils.ReservoirSampler(size, seed=3)
+      blocks = dataset_utils.ReservoirSampler(size, seed=3)
+      for item in range(1000):
+        slot = one_at_a_time.next_slot()
+        if slot is not None:
+          one_at_a_time.put(slot, item)
+      start = 0
+      for count in [0, 1, 3, 2, 50, 400, 544]:
+        for offset, slot in blocks.take(count):
+          blocks.put(slot, start + offset)
+        start += count
+      self.assertEqual(1000, start)
+      self.assertEqual(one_at_a_time.items, blocks.items)
+      self.assertEqual(one_at_a_time.seen, blocks.seen)
+
+  def test_uniform(self):
+    hits = np.zeros(20)
+    for seed in range(2000):
+      sampler = dataset_utils.ReservoirSampler(5, seed)
+      for offset, slot in sampler.take(20):
+        sampler.put(slot, offset)
+      self.assertEqual(5, len(set(sampler.items)))
+      hits[sampler.items] += 1
+    np.testing.assert_allclose(hits / 2000., 0.25, atol=0.04)
+
+
+class SampleSentencePairsTest(ScratchDirectoryTestCase):
+  """Binary corpora are sampled in blocks from their lengths, and pick the same pairs as the text files."""
+
+  def setUp(self):
+    super(SampleSentencePairsTest, self).setUp()
+    random = np.random.RandomState(5)
+    for name in ("train.en.ids_50", "train.fr.ids_50"):
+      _write_ids_file(self.path(name), random, 3000, 12)
+
+  def sample(self):
+    source_path, target_path, ratio = vocabulary_utils.sample_sentence_pairs(
+        self.path("train.en.ids_50"), self.path("train.fr.ids_50"), 8, 10, 200, seed=7, ignore_lines=100)
+    with open(source_path, "rb") as source, open(target_path, "rb") as target:
+      return source.read(), target.read(), ratio
+
+  def test_binary_sample_matches_text_sample(self):
+    text_sample = self.sample()
+    for name in ("train.en.ids_50", "train.fr.ids_50"):
+      dataset_utils.maybe_convert_integerized_file_to_binary(self.path(name), 50)
+    self.assertEqual(text_sample, self.sample())
+
+    source = dataset_utils.IntegerizedCorpus(self.path("train.en.ids_50.bin"))
+    target = dataset_utils.IntegerizedCorpus(self.path("train.fr.ids_50.bin"))
+    pairs, candidates, used = vocabulary_utils._sample_binary_pairs(source, target, 8, 10, 200, 7, 100)
+    self.assertEqual(2900, candidates)
+    self.assertEqual(used, np.sum((source.lengths[100:] <= 8) & (target.lengths[100:] + 1 < 10)))
+    self.assertAlmostEqual(used / 2900., text_sample[2])
+    self.assertEqual(200, len(pairs))
+    for block_size in [1, 7, 1000]:
+      blocked = vocabulary_utils._sample_binary_pairs(source, target, 8, 10, 200, 7, 100, block_size=block_size)[0]
+      self.assertEqual([p.tolist() for p in pairs.source_values], [p.tolist() for p in blocked.source_values])
+      self.assertEqual(pairs.target_offsets.tolist(), blocked.target_offsets.tolist())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+import dataset_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _write_ids_lines(path, sentences, final_newline=True):
+  data = b"\n".join(b" ".join(b"%d" % i for i in sentence) for sentence in sentences)
+  with open(path, "wb") as f:
+    f.write(data + (b"\n" if final_newline else b""))
+
+
+class SentenceLengthsTest(ScratchDirectoryTestCase):
+  """Lengths counted from spaces and from the binary corpus match a parse, and the histogram matches brute force."""
+
+  def setUp(self):
+    super(SentenceLengthsTest, self).setUp()
+    random = np.random.RandomState(4)
+    self.source = [random.randint(4, 1000, size=random.randint(0, 40)).tolist() for _ in range(700)]
+    self.target = [random.randint(4, 1000, size=random.randint(0, 60)).tolist() for _ in range(700)]
+    _write_ids_lines(self.path("train.en.ids_1000"), self.source)
+    _write_ids_lines(self.path("train.fr.ids_1000"), self.target, final_newline=False)
+
+  def test_count_line_tokens_matches_parse(self):
+    expected = [len(sentence) for sentence in self.target]
+    for chunk_size in (1, 13, 1000, 64 * 1024 * 1024):
+      counted = dataset_utils.count_line_tokens(self.path("train.fr.ids_1000"), chunk_size)
+      self.assertEqual(expected, counted.tolist(), "chunk size %d" % chunk_size)
+
+  def test_sidecar_from_text_and_binary(self):
+    expected = [len(sentence) for sentence in self.source]
+    lengths = dataset_utils.sentence_lengths(self.path("train.en.ids_1000"))
+    self.assertEqual(expected, lengths.tolist())
+    self.assertEqual(np.uint16, lengths.dtype)
+    self.assertTrue(os.path.exists(dataset_utils.sentence_lengths_path(self.path("train.en.ids_1000"))))
+    self.assertEqual(expected, dataset_utils.sentence_lengths(self.path("train.en.ids_1000")).tolist())
+
+    dataset_utils.maybe_convert_integerized_file_to_binary(self.path("train.fr.ids_1000"), 1000)
+    self.assertEqual([len(sentence) for sentence in self.target],
+                     dataset_utils.sentence_lengths(self.path("train.fr.ids_1000")).tolist())
+
+  def test_histogram_matches_brute_force(self):
+    histogram = vocabulary_utils.report_length_caps(self.path("train.en.ids_1000"), self.path("train.fr.ids_1000"), 20, 30)
+    small = dataset_utils.PairLengthHistogram([len(s) for s in self.source], [len(t) for t in self.target], max_length=50)
+    for max_source, max_target in [(0, 0), (0, 2), (5, 7), (20, 30), (39, 61), (45, 45), (100, 100)]:
+      expected = sum(1 for s, t in zip(self.source, self.target) if len(s) <= max_source and len(t) + 1 < max_target)
+      self.assertEqual(expected, histogram.kept(max_source, max_target), (max_source, max_target))
+      if max_source < 50 and max_target <= 50:
+        self.assertEqual(expected, small.kept(max_source, max_target), (max_source, max_target))
+    self.assertAlmostEqual(histogram.kept(20, 30) / 700., histogram.kept_ratio(20, 30))
@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+
+import numpy as np
+
+import dataset_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+
+def _random_pairs(count, vocabulary_size, seed=0):
+  #pairs of id lists, with empty sentences on either side
+  state = np.random.RandomState(seed)
+  def sentence():
+    return state.randint(0, vocabulary_size, size=state.randint(0, 12)).tolist() if state.rand() > 0.15 else []
+  return [(sentence(), sentence()) for _ in range(count)]
+
+
+def _ragged(sentences):
+  tokens = np.array(sum(sentences, []), dtype=np.int64)
+  offsets = np.concatenate([[0], np.cumsum([len(sentence) for sentence in sentences])]).astype(np.int64)
+  return tokens, offsets
+
+
+class SentencePairDatasetTest(ScratchDirectoryTestCase):
+  """SentencePairDataset and _gather_ragged give the same pairs as the list of lists they replace."""
+
+  def setUp(self):
+    super(SentencePairDatasetTest, self).setUp()
+    self.pairs = _random_pairs(300, 1000)
+
+  def check_dataset(self, dataset, pairs):
+    self.assertEqual(len(pairs), len(dataset))
+    for i, pair in enumerate(pairs):
+      self.assertEqual(pair, dataset[i])
+      self.assertEqual(pair[0], dataset.source(i).tolist())
+      self.assertEqual(pair[1], dataset.target(i).tolist())
+    self.assertEqual(pairs, list(dataset))
+    if pairs:
+      self.assertEqual(pairs[-1], dataset[-1])
+    self.assertEqual([len(source) for source, _ in pairs], dataset.source_lengths.tolist())
+    self.assertEqual([len(target) for _, target in pairs], dataset.target_lengths.tolist())
+    self.assertRaises(IndexError, lambda: dataset[len(pairs)])
+    self.assertRaises(IndexError, lambda: dataset[-len(pairs) - 1])
+
+  def test_builder(self):
+    builder = dataset_utils.SentencePairDatasetBuilder()
+    for source, target in self.pairs:
+      builder.append(source, target)
+    self.assertEqual(len(self.pairs), len(builder))
+    dataset = builder.build()
+    self.check_dataset(dataset, self.pairs)
+    self.assertEqual(np.uint16, dataset.source_values.dtype)
+    self.assertIn(random.Random(0).choice(dataset), self.pairs)
+
+  def test_builder_edge_cases(self):
+    self.check_dataset(dataset_utils.SentencePairDatasetBuilder().build(), [])
+
+    builder = dataset_utils.SentencePairDatasetBuilder()
+    pairs = [([], []), ([70000, 3], []), ([], [5])]
+    for source, target in pairs:
+      builder.append(source, target)
+    dataset = builder.build()
+    self.check_dataset(dataset, pairs)
+    self.assertEqual(np.uint32, dataset.source_values.dtype)
+
+  def test_gather_ragged(self):
+    sentences = [source for source, _ in self.pairs]
+    tokens, offsets = _ragged(sentences)
+    state = np.random.RandomState(1)
+    #unsorted, repeated, every row, no rows, and only empty rows
+    empty_rows = [i for i, sentence in enumerate(sentences) if not sentence]
+    self.assertTrue(empty_rows)
+    for indices in (state.randint(0, len(sentences), size=100), np.arange(len(sentences)), [], empty_rows[:3]):
+      for append_id in (None, 2):
+        values, row_offsets = dataset_utils._gather_ragged(tokens, offsets, indices, append_id=append_id)
+        expected = [sentences[i] + ([append_id] if append_id is not None else []) for i in indices]
+        self.assertEqual(len(expected) + 1, len(row_offsets))
+        self.assertEqual(expected, [values[row_offsets[i]:row_offsets[i + 1]].tolist() for i in range(len(expected))])
+
+  def test_from_corpora(self):
+    for side, name in ((0, "source.bin"), (1, "target.bin")):
+      with dataset_utils.IntegerizedCorpusWriter(self.path(name), 1000) as writer:
+        for pair in self.pairs:
+          writer.write(pair[side])
+    source_corpus = dataset_utils.IntegerizedCorpus(self.path("source.bin"))
+    target_corpus = dataset_utils.IntegerizedCorpus(self.path("target.bin"))
+
+    indices = [5, 0, 17, 17, 299, 42]
+    dataset = dataset_utils.SentencePairDataset.from_corpora(source_corpus, target_corpus, indices)
+    self.check_dataset(dataset, [self.pairs[i] for i in indices])
+
+    dataset = dataset_utils.SentencePairDataset.from_corpora(source_corpus, target_corpus, indices, target_append_id=2)
+    self.check_dataset(dataset, [(self.pairs[i][0], self.pairs[i][1] + [2]) for i in indices])
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import unittest
+
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_synthetic_corpus
+
+_WORKER_COUNTS = [1, 2, 3, 7]
+
+
+class ShardedPreprocessingTest(ScratchDirectoryTestCase):
+  """Cleaning and integerizing with any number of workers writes the same bytes as the serial path."""
+
+  def setUp(self):
+    super(ShardedPreprocessingTest, self).setUp()
+    #the long line is over half the file, so with several workers it is longer than a shard
+    write_synthetic_corpus(self.path("corpus.en"), 400, long_line_words=3000)
+    self.assertGreater(os.path.getsize(self.path("corpus.en")), 0)
+
+  def test_clean_and_integerize_are_identical_for_any_worker_count(self):
+    for workers in _WORKER_COUNTS:
+      vocabulary_utils.clean_enfr_wmt_data(self.path("corpus.%d.clean" % workers), self.path("corpus.en"),
+                                           language="en", workers=workers)
+    serial_clean = self.read_bytes("corpus.1.clean")
+    self.assertTrue(serial_clean)
+    for workers in _WORKER_COUNTS[1:]:
+      self.assertEqual(serial_clean, self.read_bytes("corpus.%d.clean" % workers), "cleaning with %d workers" % workers)
+
+    vocabulary_utils.create_vocabulary(self.path("vocabulary_12"), self.path("corpus.1.clean"), 12)
+    for workers in _WORKER_COUNTS:
+      vocabulary_utils.integerize_sentences(self.path("corpus.1.clean"), self.path("corpus.%d.ids_12" % workers),
+                                            self.path("vocabulary_12"), workers=workers)
+    serial_ids = self.read_bytes("corpus.1.ids_12")
+    self.assertEqual(serial_ids.count(b"\n"), serial_clean.count(b"\n") + (not serial_clean.endswith(b"\n")))
+    for workers in _WORKER_COUNTS[1:]:
+      self.assertEqual(serial_ids, self.read_bytes("corpus.%d.ids_12" % workers), "integerizing with %d workers" % workers)
+
+  def test_vocabulary_is_identical_for_any_worker_count(self):
+    #each worker count counts its own copy of the data, so none of them reuses another's count table sidecar
+    for workers in _WORKER_COUNTS:
+      vocabulary_utils.clean_enfr_wmt_data(self.path("corpus.%d.clean" % workers), self.path("corpus.en"),
+                                           language="en", workers=workers)
+      for size in (12, 1000):
+        vocabulary_utils.create_vocabulary(self.path("vocabulary_%d.%d" % (size, workers)),
+                                           self.path("corpus.%d.clean" % workers), size, workers=workers)
+    for size in (12, 1000):
+      serial_vocabulary = self.read_bytes("vocabulary_%d.1" % size)
+      self.assertTrue(serial_vocabulary)
+      for workers in _WORKER_COUNTS[1:]:
+        self.assertEqual(serial_vocabulary, self.read_bytes("vocabulary_%d.%d" % (size, workers)),
+                         "vocabulary of %d built with %d workers" % (size, workers))
+    #the table itself is kept in merge order, so only its counts are compared
+    serial_table = vocabulary_utils.TokenCountTable.load(self.path("corpus.1.clean.counts"))
+    for workers in _WORKER_COUNTS[1:]:
+      table = vocabulary_utils.TokenCountTable.load(self.path("corpus.%d.clean.counts" % workers))
+      self.assertEqual(serial_table.as_counter(), table.as_counter())
+      self.assertEqual((serial_table.total_tokens, serial_table.line_count), (table.total_tokens, table.line_count))
+
+  def test_shards_cover_every_line_once(self):
+    with open(self.path("corpus.en"), "rb") as f:
+      contents = f.read()
+    for workers in _WORKER_COUNTS:
+      shards = vocabulary_utils._find_shard_offsets(self.path("corpus.en"), workers)
+      self.assertEqual(b"".join(contents[start:end] for start, end in shards), contents)
+      for start, _ in shards[1:]:
+        self.assertEqual(contents[start - 1:start], b"\n")
+
+
+if __name__ == "__main__":
+  unittest.main()
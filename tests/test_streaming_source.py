@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import unittest
+
+import numpy as np
+import six
+
+import dataset_utils
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase
+
+try:
+  import seq2seqEDA
+except ImportError:
+  #the model needs the tensorflow 1.x contrib modules it was written against
+  seq2seqEDA = None
+
+_MAX_SOURCE = 6
+_MAX_TARGET = 9
+
+
+class StreamingSourceTest(ScratchDirectoryTestCase):
+  """Streamed pairs come from the requested window of the files, fit the length limits and are counted."""
+
+  def setUp(self):
+    super(StreamingSourceTest, self).setUp()
+    random = np.random.RandomState(9)
+    #the first id of every source sentence is 100 + its line number, so a pair tells where it came from
+    self.pairs = []
+    for i in range(500):
+      source = [100 + i] + random.randint(4, 50, size=random.randint(0, 10)).tolist()
+      target = random.randint(4, 50, size=random.randint(0, 12)).tolist()
+      self.pairs.append((source, target))
+    for side, language in ((0, "en"), (1, "fr")):
+      with open(self.path("train.%s.ids_1000" % language), "wb") as f:
+        for pair in self.pairs:
+          f.write(b" ".join(b"%d" % x for x in pair[side]) + b"\n")
+
+  def open(self, seed, ignore_lines=40, max_size=300, binary=False):
+    if binary:
+      for language in ("en", "fr"):
+        dataset_utils.maybe_convert_integerized_file_to_binary(self.path("train.%s.ids_1000" % language), 1000)
+    return vocabulary_utils.open_streaming_dataset(self.path("train.en.ids_1000"), self.path("train.fr.ids_1000"),
+                                                   _MAX_SOURCE, _MAX_TARGET, max_size=max_size, ignore_lines=ignore_lines,
+                                                   buffer_size=64, seed=seed)
+
+  def expected_window(self, ignore_lines, max_size):
+    #the pairs of the window that pass the length filter, keyed by their first source id
+    return dict((source[0], (source, target + [vocabulary_utils.EOS_ID]))
+                for source, target in self.pairs[ignore_lines:ignore_lines + max_size]
+                if len(source) <= _MAX_SOURCE and len(target) + 1 < _MAX_TARGET)
+
+  def test_batches_respect_window_and_lengths(self):
+    for binary in (False, True):
+      dataset = self.open(seed=3, binary=binary)
+      self.assertIsInstance(dataset, dataset_utils.StreamingSentencePairSource)
+      self.assertEqual(300, len(dataset))
+      expected = self.expected_window(40, 300)
+      self.assertTrue(0 < len(expected) < 300)
+      drawn = set()
+      for _ in range(40):
+        batch = dataset.sample(32)
+        self.assertEqual(32, len(batch))
+        for source, target in batch:
+          self.assertEqual(expected[source[0]], (source, target))
+          drawn.add(source[0])
+      self.assertEqual(40 * 32, dataset.consumed)
+      #1280 draws over fewer than 300 pairs reach every one of them
+      self.assertEqual(set(expected), drawn)
+      self.assertEqual(dataset.used_sentence_pairs - len(dataset._buffer), dataset.consumed)
+
+  def test_window_past_the_end(self):
+    dataset = self.open(seed=0, ignore_lines=450, max_size=1000)
+    self.assertEqual(50, len(dataset))
+    self.assertTrue(all(source[0] >= 550 for source, _ in dataset.sample(100)))
+    with self.assertRaises(ValueError):
+      self.open(seed=0, ignore_lines=500)
+
+  def test_seed_reproduces_batches(self):
+    first, second = self.open(seed=5), self.open(seed=5, binary=True)
+    for _ in range(5):
+      self.assertEqual(first.sample(16), second.sample(16))
+
+  def test_nothing_fits(self):
+    corpus = dataset_utils.open_integerized_corpus(self.path("train.en.ids_1000"))
+    target_corpus = dataset_utils.open_integerized_corpus(self.path("train.fr.ids_1000"))
+    dataset = dataset_utils.StreamingSentencePairSource(corpus, target_corpus, 0, _MAX_TARGET, buffer_size=10,
+                                                        seed=0, max_refill_attempts=3)
+    with self.assertRaises(ValueError):
+      dataset.sample(1)
+    self.assertEqual(30, dataset.unused_sentence_pairs)
+
+  def test_report_consumed(self):
+    dataset = self.open(seed=1)
+    dataset.sample(10)
+    dataset.sample(7)
+    stdout, sys.stdout = sys.stdout, six.StringIO()
+    try:
+      dataset.report_consumed()
+      report = sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+    self.assertIn("consumed 17 training pairs", report)
+
+  @unittest.skipIf(seq2seqEDA is None, "seq2seqEDA needs tensorflow 1.x contrib")
+  def test_get_batch_from_file(self):
+    #get_batch_from_file only reads the sizes off the model, so no graph is built
+    model = seq2seqEDA.seq2seqEDA.__new__(seq2seqEDA.seq2seqEDA)
+    model.batch_size = 16
+    model.max_encoder_length = _MAX_SOURCE
+    model.max_decoder_length = _MAX_TARGET
+    dataset, reference = self.open(seed=7), self.open(seed=7)
+    expected = self.expected_window(40, 300)
+    for _ in range(10):
+      encoder_inputs, decoder_inputs, encoder_lengths, decoder_lengths, weights = model.get_batch_from_file(dataset)
+      pairs = reference.sample(16)
+      self.assertEqual(_MAX_SOURCE, len(encoder_inputs))
+      self.assertEqual(_MAX_TARGET, len(decoder_inputs))
+      self.assertEqual([len(source) for source, _ in pairs], encoder_lengths)
+      self.assertEqual([len(target) + 1 for _, target in pairs], decoder_lengths)
+      encoder_rows = np.transpose(np.stack(encoder_inputs))
+      decoder_rows = np.transpose(np.stack(decoder_inputs))
+      for row, (source, target) in enumerate(pairs):
+        self.assertEqual(expected[source[0]], (source, target))
+        self.assertEqual(source, encoder_rows[row][:len(source)].tolist())
+        self.assertEqual([vocabulary_utils.GO_ID] + target, decoder_rows[row][:len(target) + 1].tolist())
+    self.assertEqual(160, dataset.consumed)
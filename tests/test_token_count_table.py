@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+from collections import Counter
+
+import numpy as np
+
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, synthetic_lines, write_synthetic_corpus
+
+
+def _reference_vocabulary(counts, limit):
+  #the full sort the table avoids
+  return [token for token, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))][:limit]
+
+
+class TokenCountTableTest(ScratchDirectoryTestCase):
+  """Selecting from the unsorted table gives the vocabulary and unknown word rates of a full sort."""
+
+  def setUp(self):
+    super(TokenCountTableTest, self).setUp()
+    random = np.random.RandomState(1)
+    #few distinct counts, so most vocabulary sizes cut through a run of ties
+    self.counts = Counter(dict((b"w%d" % i, int(count)) for i, count in enumerate(random.randint(1, 6, size=500))))
+    self.total = sum(self.counts.values())
+    self.table = vocabulary_utils.TokenCountTable.from_counts(self.counts, self.total, 10, 100)
+
+  def test_tokens_match_full_sort(self):
+    for limit in [0, 1, 7, 100, 499, 500, 600]:
+      self.assertEqual(_reference_vocabulary(self.counts, limit), self.table.tokens(limit), "limit %d" % limit)
+    self.assertEqual(_reference_vocabulary(self.counts, None), self.table.tokens())
+
+  def test_unk_rates_match_full_sort(self):
+    special = len(vocabulary_utils._INITIAL_VOCABULARY)
+    sizes = [0, special, special + 1, special + 37, special + 500, special + 1000]
+    for size, rate in zip(sizes, self.table.unk_rates(sizes)):
+      known = sum(self.counts[token] for token in _reference_vocabulary(self.counts, max(0, size - special)))
+      self.assertAlmostEqual(1. - known / float(self.total), rate)
+      self.assertAlmostEqual(rate, self.table.unk_rate(size))
+
+  def test_save_load_round_trip(self):
+    self.table.save(self.path("table.counts"))
+    loaded = vocabulary_utils.TokenCountTable.load(self.path("table.counts"))
+    self.assertEqual(self.counts, loaded.as_counter())
+    self.assertEqual(self.table.tokens(50), loaded.tokens(50))
+    self.assertEqual((self.total, 10, 100), (loaded.total_tokens, loaded.line_count, loaded.covered_bytes))
+
+  def test_create_vocabulary_matches_full_sort(self):
+    write_synthetic_corpus(self.path("corpus"), 300, final_newline=True)
+    counts = Counter(token for line in synthetic_lines(300)
+                     for token in vocabulary_utils.vanilla_ft_tokenizer(line))
+    vocabulary_utils.create_vocabulary(self.path("vocabulary_15"), self.path("corpus"), 15)
+    with open(self.path("vocabulary_15"), "rb") as f:
+      words = f.read().splitlines()
+    self.assertEqual(list(vocabulary_utils._INITIAL_VOCABULARY) + _reference_vocabulary(counts, 11), words)
+
+
+if __name__ == "__main__":
+  unittest.main()
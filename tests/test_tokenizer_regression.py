@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import json
+import os
+import unittest
+
+import vocabulary_utils
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CORPUS_PATH = os.path.join(_ROOT, "tokenizer_regression_corpus.txt")
+#the tokens the original separator loop tokenizer gave for each corpus line, one json list per line
+_EXPECTED_PATH = os.path.join(_ROOT, "tokenizer_regression_expected.jsonl")
+
+
+def _corpus_lines():
+  with open(_CORPUS_PATH, "rb") as f:
+    lines = f.read().split(b"\n")
+  if lines and lines[-1] == b"":
+    lines.pop()
+  return lines
+
+
+def _expected_tokens():
+  with io.open(_EXPECTED_PATH, encoding="utf-8") as f:
+    return [[token.encode("utf-8") for token in json.loads(line)] for line in f]
+
+
+class TokenizerRegressionTest(unittest.TestCase):
+  """vanilla_ft_tokenizer gives the tokens of the original tokenizer on every line of the regression corpus."""
+
+  def setUp(self):
+    self.lines = _corpus_lines()
+    self.expected = _expected_tokens()
+    self.assertEqual(len(self.lines), len(self.expected), "the expected tokens are out of date with the corpus")
+
+  def test_bytes(self):
+    for line, expected in zip(self.lines, self.expected):
+      self.assertEqual(vocabulary_utils.vanilla_ft_tokenizer(line), expected, "tokenizing %r" % line)
+
+  def test_unicode(self):
+    #the original tokenizer ended with text.split(), which on unicode also splits on unicode whitespace like nbsp
+    for line, expected in zip(self.lines, self.expected):
+      expected = [piece for token in expected for piece in token.decode("utf-8").split()]
+      self.assertEqual(vocabulary_utils.vanilla_ft_tokenizer(line.decode("utf-8")), expected, "tokenizing %r" % line)
+
+  def test_lines(self):
+    self.assertEqual(vocabulary_utils.vanilla_ft_tokenize_lines(self.lines), self.expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
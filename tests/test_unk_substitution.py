@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+import unk_substitution
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_vocabulary
+
+_EMBED_SIZE = 16
+
+
+def _unit(vectors):
+  return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+class RandomProjectionIndexTest(ScratchDirectoryTestCase):
+
+  def test_nearest_matches_brute_force(self):
+    random = np.random.RandomState(13)
+    vectors = _unit(random.randn(500, _EMBED_SIZE))
+    ids = np.arange(1000, 1500)
+    index = unk_substitution.RandomProjectionIndex.build(vectors, ids, seed=1)
+    queries = _unit(vectors[:200] + 0.1 * random.randn(200, _EMBED_SIZE))
+    expected = ids[np.argmax(queries.dot(vectors.T), axis=1)]
+    nearest, similarities = index.nearest(queries)
+    self.assertGreater(np.mean(nearest == expected), 0.95)
+    found = nearest >= 0
+    np.testing.assert_allclose(np.sum(queries[found] * vectors[nearest[found] - 1000], axis=1), similarities[found], atol=1e-5)
+    self.assertTrue(np.all(index.nearest(queries, min_similarity=1.01)[0] == -1))
+
+    index.save(self.path("index.npz"))
+    loaded = unk_substitution.RandomProjectionIndex.load(self.path("index.npz"))
+    np.testing.assert_array_equal(nearest, loaded.nearest(queries)[0])
+
+
+class UnkSubstitutionTest(ScratchDirectoryTestCase):
+  """Substitutes are the nearest vocabulary words above the threshold, and integerizing uses them."""
+
+  def setUp(self):
+    super(UnkSubstitutionTest, self).setUp()
+    random = np.random.RandomState(14)
+    self.vocabulary_words = [b"w%d" % i for i in range(20)]
+    vocabulary_vectors = _unit(random.randn(20, _EMBED_SIZE))
+    #a close word for every other vocabulary word, and words far from all of them
+    self.near = dict((b"near%d" % i, 4 + i) for i in range(0, 20, 2))
+    near_vectors = [vocabulary_vectors[i - 4] + 0.03 * random.randn(_EMBED_SIZE) for i in self.near.values()]
+    self.far = []
+    far_vectors = []
+    while len(far_vectors) < 10:
+      vector = _unit(random.randn(_EMBED_SIZE))
+      if vocabulary_vectors.dot(vector).max() < 0.5:
+        self.far.append(b"far%d" % len(far_vectors))
+        far_vectors.append(vector)
+    entries = (list(zip(self.vocabulary_words, vocabulary_vectors)) + list(zip(self.near, near_vectors)) +
+               list(zip(self.far, far_vectors)))
+    with open(self.path("vectors.txt"), "wb") as f:
+      f.write(b"%d %d\n" % (len(entries), _EMBED_SIZE))
+      for word, vector in entries:
+        f.write(word + b" " + b" ".join(b"%.7f" % x for x in vector) + b"\n")
+    write_vocabulary(self.path("vocabulary_24"), self.vocabulary_words)
+
+  def build(self):
+    return vocabulary_utils.build_unk_substitutes(self.path("vocabulary_24"), 24, self.path("vectors.txt"), "word2vec",
+                                                  _EMBED_SIZE, min_similarity=0.9)
+
+  def test_table(self):
+    substitutes = vocabulary_utils.load_unk_substitutes(self.build())
+    self.assertEqual(self.near, substitutes.table)
+    for word in self.far + [b"never_seen"]:
+      self.assertEqual(vocabulary_utils.UNK_ID, substitutes(word))
+    #up to date now, so it is loaded rather than built again
+    self.assertEqual(self.near, vocabulary_utils.load_unk_substitutes(self.build()).table)
+
+  def test_integerize(self):
+    substitutes_path = self.build()
+    lines = [b"w1 near2 far3 w0", b"", b"never_seen near18 w19", b"near0 near0"] * 50
+    with open(self.path("train.from"), "wb") as f:
+      f.write(b"\n".join(lines) + b"\n")
+    vocabulary, _ = vocabulary_utils.initialize_vocabulary(self.path("vocabulary_24"))
+    unknown_words = vocabulary_utils.load_unk_substitutes(substitutes_path)
+    expected = b"".join(b" ".join(b"%d" % i for i in vocabulary_utils.sentence_to_token_ids(line, vocabulary, unknown_words)) + b"\n"
+                        for line in lines)
+    self.assertIn(b"5 6 3 4\n", expected)
+    for workers in (1, 3):
+      vocabulary_utils.integerize_sentences(self.path("train.from"), self.path("train.ids.%d" % workers),
+                                            self.path("vocabulary_24"), workers=workers, substitutes_path=substitutes_path)
+      self.assertEqual(expected, self.read_bytes("train.ids.%d" % workers), "integerizing with %d workers" % workers)
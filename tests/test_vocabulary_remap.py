@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import shutil
+import unittest
+
+import vocabulary_utils
+from corpus_fixtures import ScratchDirectoryTestCase, write_synthetic_corpus, write_vocabulary
+
+
+class VocabularyRemapTest(ScratchDirectoryTestCase):
+  """An integerized file derived from one with a larger vocabulary is the file integerizing would write."""
+
+  def setUp(self):
+    super(VocabularyRemapTest, self).setUp()
+    write_synthetic_corpus(self.path("corpus.en"), 300)
+    vocabulary_utils.clean_enfr_wmt_data(self.path("corpus.clean"), self.path("corpus.en"), language="en")
+    for size in (12, 1000):
+      vocabulary_utils.create_vocabulary(self.path("vocabulary_%d" % size), self.path("corpus.clean"), size)
+    vocabulary_utils.integerize_sentences(self.path("corpus.clean"), self.path("corpus.ids_1000"), self.path("vocabulary_1000"))
+    vocabulary_utils.integerize_sentences(self.path("corpus.clean"), self.path("direct.ids_12"), self.path("vocabulary_12"))
+    self.ids_template = self.path("corpus.ids_%d")
+    self.vocabulary_template = self.path("vocabulary_%d")
+
+  def test_larger_file_has_ids_past_the_cut_off(self):
+    ids = [int(token) for token in self.read_bytes("corpus.ids_1000").split()]
+    self.assertTrue(any(token == 12 for token in ids))
+    self.assertTrue(any(token > 12 for token in ids))
+    direct = [int(token) for token in self.read_bytes("direct.ids_12").split()]
+    self.assertTrue(any(token == vocabulary_utils.UNK_ID for token in direct))
+
+  def test_remap_matches_direct_integerize(self):
+    larger_ids_path = vocabulary_utils.find_remappable_integerized_file(self.ids_template, self.vocabulary_template, 12,
+                                                                        data_path=self.path("corpus.clean"))
+    self.assertEqual(self.ids_template % 1000, larger_ids_path)
+    #blocks that split the file at several points, and one block for the whole file
+    for block_size in (7, 100000):
+      vocabulary_utils.remap_integerized_file(larger_ids_path, self.path("remapped.ids_12"), 12, block_size=block_size)
+      self.assertEqual(self.read_bytes("direct.ids_12"), self.read_bytes("remapped.ids_12"), "block size %d" % block_size)
+
+  def test_integerize_or_remap_matches_direct_integerize(self):
+    target_path = vocabulary_utils.integerize_or_remap_sentences(self.path("corpus.clean"), self.ids_template,
+                                                                 self.vocabulary_template, 12)
+    self.assertEqual(self.ids_template % 12, target_path)
+    self.assertEqual(self.read_bytes("direct.ids_12"), self.read_bytes("corpus.ids_12"))
+
+  def test_vocabulary_that_is_not_a_prefix_is_not_used(self):
+    with open(self.path("vocabulary_1000"), "rb") as f:
+      words = f.read().split(b"\n")[4:-1]
+    #a vocabulary of 20 whose words are in another order can't be cut down to the vocabulary of 12
+    write_vocabulary(self.path("vocabulary_20"), list(reversed(words))[:16])
+    shutil.copy(self.path("corpus.ids_1000"), self.path("corpus.ids_20"))
+    self.assertEqual(self.ids_template % 1000,
+                     vocabulary_utils.find_remappable_integerized_file(self.ids_template, self.vocabulary_template, 12))
+
+  def test_file_without_a_current_manifest_is_not_used(self):
+    shutil.copy(self.path("corpus.ids_1000"), self.path("corpus.ids_500"))
+    shutil.copy(self.path("vocabulary_1000"), self.path("vocabulary_500"))
+    self.assertEqual(self.ids_template % 500,
+                     vocabulary_utils.find_remappable_integerized_file(self.ids_template, self.vocabulary_template, 12))
+    self.assertEqual(self.ids_template % 1000,
+                     vocabulary_utils.find_remappable_integerized_file(self.ids_template, self.vocabulary_template, 12,
+                                                                       data_path=self.path("corpus.clean")))
+
+
+if __name__ == "__main__":
+  unittest.main()
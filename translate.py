@@ -44,6 +44,9 @@ import tensorflow as tf
 
 import vocabulary_utils
 import download_utils
+import corpus_profiler
+import embeddings
+import glove_trainer
 import seq2seqEDA
 
 
@@ -81,9 +84,38 @@ def create_model(session, forward_only):
   else:
     print("Created model with fresh parameters.")
     session.run(tf.global_variables_initializer())
+    embeddings.initialize_pretrained_embeddings(session)
   return model
 
 
+def _download_options():
+  #keyword arguments for the dataset downloads, from the download flags
+  return {"mirror_base_url": FLAGS.download_mirror or None,
+          "connections": FLAGS.download_connections,
+          "checksums": download_utils.parse_checksums(FLAGS.download_checksums)}
+
+
+def _extra_train_corpora():
+  #parses the extra_train_corpora flag, "source:target:weight,source:target:weight", into (source, target, weight) triples
+  corpora = []
+  for entry in FLAGS.extra_train_corpora.split(","):
+    if entry.strip():
+      source_path, target_path, weight = entry.strip().rsplit(":", 2)
+      corpora.append((source_path, target_path, float(weight)))
+  return corpora
+
+
+def _unk_substitution():
+  #the unk_substitution argument of prepare_wmt_data, from the flags
+  if not FLAGS.substitute_unknown_words:
+    return None
+  return {"embedding_path": getattr(FLAGS, FLAGS.embedding_algorithm + "_encoder_embedding_file"),
+          "algorithm": FLAGS.embedding_algorithm,
+          "embed_size": FLAGS.encoder_embedding_size,
+          "max_words": FLAGS.unk_substitution_max_words,
+          "min_similarity": FLAGS.unk_substitution_min_similarity}
+
+
 def beam_search_decoder():
   #outputs = [int(np.argmax(logit, axis=1)) for logit in output_logits]
   pass
@@ -92,9 +124,27 @@ def beam_search_decoder():
 
 def train():
   #Load data from file, preprocess it and tokenize it, integerize it, all according to different flags.
-  from_train, to_train, from_dev, to_dev, _, _ = vocabulary_utils.prepare_wmt_data(FLAGS.data_dir,
+  from_train, to_train, from_dev, to_dev, from_vocab_path, to_vocab_path = vocabulary_utils.prepare_wmt_data(FLAGS.data_dir,
                                                                                   FLAGS.from_vocab_size,
-                                                                                  FLAGS.to_vocab_size)
+                                                                                  FLAGS.to_vocab_size,
+                                                                                  workers=FLAGS.preprocess_workers,
+                                                                                  fused=FLAGS.fused_preprocessing,
+                                                                                  write_clean_files=FLAGS.write_clean_files,
+                                                                                  read_compressed=FLAGS.read_compressed_corpus,
+                                                                                  download_options=_download_options(),
+                                                                                  counter_capacity=FLAGS.vocabulary_counter_capacity or None,
+                                                                                  deduplicate=FLAGS.deduplicate_train_set,
+                                                                                  unk_substitution=_unk_substitution())
+  vocabulary_utils.report_length_caps(from_train, to_train, FLAGS.max_source_sentence_length, FLAGS.max_target_sentence_length)
+  if FLAGS.profile_corpus:
+    corpus_profiler.report_sentence_pairs(from_train, to_train, FLAGS.from_vocab_size, FLAGS.to_vocab_size,
+                                          FLAGS.max_source_sentence_length, FLAGS.max_target_sentence_length,
+                                          workers=FLAGS.preprocess_workers)
+  if FLAGS.embedding_algorithm == "glove" and FLAGS.train_glove_embeddings:
+    for ids_path, vocab_path, vocab_size, embed_size in [(from_train, from_vocab_path, FLAGS.from_vocab_size, FLAGS.encoder_embedding_size),
+                                                         (to_train, to_vocab_path, FLAGS.to_vocab_size, FLAGS.decoder_embedding_size)]:
+      glove_trainer.train_glove_embeddings(ids_path, vocab_path, vocab_size, embed_size, window_size=FLAGS.glove_window_size,
+                                           iterations=FLAGS.glove_iterations, workers=FLAGS.preprocess_workers)
 
   with tf.Session() as sess:
     # Create model.
@@ -116,9 +166,18 @@ def train():
                                                             FLAGS.max_source_sentence_length,
                                                             FLAGS.max_target_sentence_length,
                                                             ignore_lines=FLAGS.train_offset,
-                                                            max_size=FLAGS.max_train_data_size)
+                                                            max_size=FLAGS.max_train_data_size,
+                                                            sample_seed=FLAGS.train_sample_seed if FLAGS.sample_train_set else None)
     else:
-      raise NotImplementedError("No support yet for loading training data from files.")
+      train_set = vocabulary_utils.open_streaming_dataset(from_train,
+                                                          to_train,
+                                                          FLAGS.max_source_sentence_length,
+                                                          FLAGS.max_target_sentence_length,
+                                                          ignore_lines=FLAGS.train_offset,
+                                                          max_size=FLAGS.max_train_data_size,
+                                                          buffer_size=FLAGS.train_stream_buffer_size,
+                                                          weight=FLAGS.train_corpus_weight,
+                                                          extra_corpora=_extra_train_corpora())
 
     #Load the validation set in memory always, because its relatively small
     dev_set, _ = vocabulary_utils.load_dataset_in_memory(from_dev,
@@ -194,6 +253,9 @@ def train():
           print("new lowest loss. saving model")
           model.saver.save(sess, checkpoint_path, global_step=model.global_step)
 
+        if not FLAGS.load_train_set_in_memory:
+          train_set.report_consumed()
+
         #Prepare for validation set evaluation
         step_time = 0.0
         loss = 0.0
@@ -234,6 +296,12 @@ def decode():
     en_vocab, _ = vocabulary_utils.initialize_vocabulary(en_vocab_path)
     _, rev_fr_vocab = vocabulary_utils.initialize_vocabulary(fr_vocab_path)
 
+    #the same substitutes the training set was integerized with
+    unknown_words = lambda word: vocabulary_utils.UNK_ID
+    if FLAGS.substitute_unknown_words:
+      unknown_words = vocabulary_utils.load_unk_substitutes(vocabulary_utils.build_unk_substitutes(en_vocab_path, FLAGS.from_vocab_size,
+                                                                                                   **_unk_substitution()))
+
 
     # Decode from standard input.
     sys.stdout.write(">> ")
@@ -247,7 +315,7 @@ def decode():
       str_tokens = vocabulary_utils.vanilla_ft_tokenizer(clean_sentence)
       print("\nYour sentence will be tokenized as follows:\n\t%s" % str(str_tokens))
 
-      token_ids = [en_vocab.get(word, vocabulary_utils.UNK_ID) for word in str_tokens]
+      token_ids = [en_vocab[word] if word in en_vocab else unknown_words(word) for word in str_tokens]
       print("\nYour sentence will be integerized as follows:\n\t%s" % str(token_ids))
 
       if len(token_ids) > FLAGS.max_source_sentence_length:
@@ -0,0 +1,198 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+import artifact_utils
+import embedding_utils
+
+#=================================================================
+#
+#	unk_substitution.py
+#
+#	Unknown words replaced by their nearest vocabulary word in a pretrained embedding, so "canine"
+#	becomes "dog" instead of _UNK.
+#
+#	RandomProjectionIndex is a cosine nearest neighbour index over the vectors of the vocabulary words:
+#	each of num_tables tables hashes a vector to the signs of its dot products with num_bits random
+#	hyperplanes (Charikar 2002), so vectors at a small angle usually share a bucket in some table, and
+#	only the words in the query's buckets are compared exactly.
+#
+#	The words to substitute are the embedding file's own words that are not in the vocabulary. They are
+#	looked up in the index once, when the substitution table is built, and the table is saved next to the
+#	vocabulary. Integerizing and decoding then map an unknown word with one dictionary lookup.
+#
+
+_INDEX_VERSION = 1
+_SUBSTITUTES_VERSION = 1
+
+
+class RandomProjectionIndex(object):
+  """Approximate cosine nearest neighbours among a fixed set of vectors, each labelled with an id."""
+
+  def __init__(self, planes, vectors, ids, sorted_codes, orders):
+    self.planes = planes
+    self.vectors = vectors
+    self.ids = ids
+    self.sorted_codes = sorted_codes
+    self.orders = orders
+
+  @classmethod
+  def build(cls, vectors, ids, num_bits=12, num_tables=16, seed=0):
+    assert 1 <= num_bits <= 32, "Codes are stored in 32 bits"
+    vectors = np.asarray(vectors, dtype=np.float32)
+    random = np.random.RandomState(seed)
+    planes = random.randn(num_tables, num_bits, vectors.shape[1]).astype(np.float32)
+    index = cls(planes, _normalize(vectors), np.asarray(ids, dtype=np.int32), None, None)
+    codes = index.codes(index.vectors)
+    index.orders = np.argsort(codes, axis=1, kind="mergesort").astype(np.int32)
+    index.sorted_codes = np.array([table_codes[order] for table_codes, order in zip(codes, index.orders)])
+    return index
+
+  def __len__(self):
+    return len(self.ids)
+
+  def codes(self, vectors):
+    #num_tables x len(vectors) bucket codes
+    bits = np.einsum("tbd,nd->tnb", self.planes, vectors) > 0
+    return bits.dot(np.uint32(1) << np.arange(self.planes.shape[1], dtype=np.uint32)).astype(np.uint32)
+
+  def nearest(self, vectors, min_similarity=0.):
+    """The id of the most similar indexed vector of each row of vectors.
+
+    Returns:
+      (ids, similarities), the id being -1 where no vector in the query's buckets reaches min_similarity
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    codes = self.codes(vectors)
+    starts = np.array([np.searchsorted(table, table_codes, side="left") for table, table_codes in zip(self.sorted_codes, codes)])
+    ends = np.array([np.searchsorted(table, table_codes, side="right") for table, table_codes in zip(self.sorted_codes, codes)])
+    nearest_ids = np.full(len(vectors), -1, dtype=np.int32)
+    similarities = np.zeros(len(vectors), dtype=np.float32)
+    for i in range(len(vectors)):
+      candidates = np.unique(np.concatenate([order[start:end] for order, start, end in zip(self.orders, starts[:, i], ends[:, i])]))
+      if len(candidates):
+        candidate_similarities = self.vectors[candidates].dot(vectors[i])
+        best = np.argmax(candidate_similarities)
+        similarities[i] = candidate_similarities[best]
+        if similarities[i] >= min_similarity:
+          nearest_ids[i] = self.ids[candidates[best]]
+    return nearest_ids, similarities
+
+  def save(self, path):
+    with artifact_utils.atomic_output(path) as temporary_path:
+      #through a file object, since np.savez adds .npz to a name that doesn't end in it
+      with open(temporary_path, "wb") as f:
+        np.savez(f, planes=self.planes, vectors=self.vectors, ids=self.ids, sorted_codes=self.sorted_codes, orders=self.orders)
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as arrays:
+      return cls(arrays["planes"], arrays["vectors"], arrays["ids"], arrays["sorted_codes"], arrays["orders"])
+
+
+def _normalize(vectors):
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  return vectors / np.maximum(norms, 1e-12)
+
+
+class UnkSubstitutes(object):
+  """Maps a word outside the vocabulary to the id of its substitute, or to default_id if it has none."""
+
+  def __init__(self, table, default_id):
+    self.table = table
+    self.default_id = default_id
+
+  def __call__(self, word):
+    return self.table.get(word, self.default_id)
+
+  def __len__(self):
+    return len(self.table)
+
+  @classmethod
+  def load(cls, path, default_id):
+    with np.load(path) as arrays:
+      words = arrays["words"].tobytes().split(b"\n") if len(arrays["ids"]) else []
+      return cls(dict(zip(words, arrays["ids"].tolist())), default_id)
+
+
+def _cache_prefix(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size):
+  #named like the cached embedding matrix these are built from
+  return embedding_utils.embedding_cache_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)[:-len(".npy")]
+
+
+def index_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size):
+  return _cache_prefix(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size) + ".lsh.npz"
+
+
+def substitutes_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size):
+  return _cache_prefix(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size) + ".unk.npz"
+
+
+def vocabulary_index(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size, special_words=(),
+                     num_bits=12, num_tables=16, seed=0):
+  """The RandomProjectionIndex of the pretrained vectors of the vocabulary words, built once and then loaded.
+
+  Special words and words without a vector are left out of the index.
+  """
+  matrix = embedding_utils.load_pretrained_matrix(vocabulary_path, embedding_path, num_symbols, embed_size,
+                                                  reader=embedding_utils.READERS[algorithm], algorithm=algorithm,
+                                                  special_words=special_words, allow_missing=algorithm != "glove")
+  path = index_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)
+  matrix_path = embedding_utils.embedding_cache_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)
+  params = {"num_bits": num_bits, "num_tables": num_tables, "seed": seed, "special_words": len(special_words)}
+  if artifact_utils.is_current(path, "ann_index", _INDEX_VERSION, [matrix_path], params):
+    return RandomProjectionIndex.load(path)
+
+  indexed = np.ones(len(matrix), dtype=bool)
+  indexed[:len(special_words)] = False
+  indexed[embedding_utils.missing_rows(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)] = False
+  print("Indexing the %s vectors of %d vocabulary words of %s" % (algorithm, indexed.sum(), vocabulary_path))
+  index = RandomProjectionIndex.build(matrix[indexed], np.flatnonzero(indexed), num_bits, num_tables, seed)
+  index.save(path)
+  artifact_utils.record(path, "ann_index", _INDEX_VERSION, [matrix_path], params)
+  return index
+
+
+def build_substitutes(vocabulary_path, num_symbols, embedding_path, algorithm, embed_size, special_words=(),
+                      max_words=500000, min_similarity=0.5, block_size=10000):
+  """Find substitutes for the first max_words words of an embedding file that are not in the vocabulary.
+
+  A word's substitute is its nearest vocabulary word in the index, if their cosine similarity is at least
+  min_similarity. The table is saved next to the vocabulary, unless it is up to date already.
+
+  Returns:
+    the path of the table, for UnkSubstitutes.load
+  """
+  path = substitutes_path(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size)
+  params = {"max_words": max_words, "min_similarity": min_similarity, "special_words": len(special_words)}
+  inputs = [vocabulary_path, embedding_path]
+  if artifact_utils.is_current(path, "unk_substitutes", _SUBSTITUTES_VERSION, inputs, params):
+    print("Unknown word substitutes %s already exist. Skipping this step..." % path)
+    return path
+
+  index = vocabulary_index(vocabulary_path, embedding_path, algorithm, num_symbols, embed_size, special_words)
+  vocabulary = set(embedding_utils.read_vocabulary_words(vocabulary_path, limit=num_symbols))
+  candidates = [word for word in embedding_utils.read_embedding_words(embedding_path, algorithm, limit=max_words)
+                if word not in vocabulary]
+  print("Finding vocabulary substitutes for %d words of %s" % (len(candidates), embedding_path))
+  vectors = np.zeros((len(candidates), embed_size), dtype=np.float32)
+  found = embedding_utils.READERS[algorithm](embedding_path, dict((word, i) for i, word in enumerate(candidates)), vectors)
+
+  substitute_ids = np.full(len(candidates), -1, dtype=np.int32)
+  rows = np.flatnonzero(found)
+  for start in range(0, len(rows), block_size):
+    block = rows[start:start + block_size]
+    substitute_ids[block] = index.nearest(vectors[block], min_similarity)[0]
+  substituted = np.flatnonzero(substitute_ids >= 0)
+
+  with artifact_utils.atomic_output(path) as temporary_path:
+    with open(temporary_path, "wb") as f:
+      words = np.frombuffer(b"\n".join(candidates[i] for i in substituted), dtype=np.uint8)
+      np.savez(f, words=words, ids=substitute_ids[substituted])
+  artifact_utils.record(path, "unk_substitutes", _SUBSTITUTES_VERSION, inputs, params,
+                        {"candidates": len(candidates), "substituted": len(substituted)})
+  print("%d of %d words outside the vocabulary have a substitute with similarity >= %.2f" %
+        (len(substituted), len(candidates), min_similarity))
+  return path
@@ -3,14 +3,26 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
 import os
 import re
 import tarfile
 
+import six
 from six.moves import urllib
 from tensorflow.python.platform import gfile
-from collections import OrderedDict
+from collections import Counter
+import artifact_utils
+import dataset_utils
 import download_utils
+import embedding_utils
+import heavy_hitters
+import unk_substitution
 import tensorflow as tf
 import numpy as np
 
@@ -49,117 +61,137 @@ EOS_ID = 2
 UNK_ID = 3
 
 
-#Our vanilla tokenizer doesnt even use regex, because dealing with all the french characters
-# in the regex ended up being slower than just writing out a list of seperators and looping through them.
-# We already have text inputs that contain only lowercase words, so we simply split out on any and all
-# punctuation that appears in the dataset.
+#We already have text inputs that contain only lowercase words, so we simply split out on any and all
+# punctuation that appears in the dataset. Every separator becomes a token of its own and whitespace
+# is thrown away.
+_TOKENIZER_SEPERATORS = (u"(", u")", u"?", u"!", u"@", u"#", u"$", u"%", u"^", u"&", u"*", u"[", u"]", u"'", u'"', u'~',
+                         u".", u",", u":", u";", u"-", u"_", u"=", u"+", u"{", u"}", u"<", u">", u"/", u"\\", u"|", u"°")
+
+
+def _compile_tokenizer_patterns():
+  #The separators are matched by one compiled regex, so a line is tokenized in a single scan instead of
+  #one str.replace per separator. Everything but the degree sign is ascii, which makes it a single
+  #character class. For utf-8 byte strings the degree sign is two bytes, so a run of word bytes may
+  #contain a \xc2 lead byte only when it isn't followed by \xb0.
+  ascii_class = u"".join(re.escape(sep) for sep in _TOKENIZER_SEPERATORS if len(sep.encode("utf-8")) == 1)
+  degree = u"°"
+
+  unicode_pattern = re.compile(u"[%s%s]|[^\\s%s%s]+" % (ascii_class, degree, ascii_class, degree), re.UNICODE)
+
+  byte_class = ascii_class.encode("ascii")
+  byte_degree = degree.encode("utf-8")
+  byte_pattern = re.compile(b"%s|[%s]|(?:[^\\s%s%s]|%s(?!%s))+" % (byte_degree, byte_class, byte_class,
+                                                                   byte_degree[:1], byte_degree[:1], byte_degree[1:]))
+  return unicode_pattern, byte_pattern
+
+_UNICODE_TOKEN_PATTERN, _BYTE_TOKEN_PATTERN = _compile_tokenizer_patterns()
+
+
+#Our vanilla tokenizer used to avoid regex, because dealing with all the french characters in the regex
+# ended up being slower than just writing out a list of seperators and looping through them. A single
+# precompiled pattern over the whole line beats both, and gives exactly the same tokens.
 def vanilla_ft_tokenizer(text):
-    tokens = []
-    seperators = ("(",
-                  ")",
-                  "?",
-                  "!",
-                  "@",
-                  "#",
-                  "$",
-                  "%",
-                  "^",
-                  "&",
-                  "*",
-                  "[",
-                  "]",
-                  "'",
-                  '"',
-                  '~',
-                  ".",
-                  ",",
-                  ":",
-                  ";",
-                  "-",
-                  "_",
-                  "=",
-                  "+",
-                  "{",
-                  "}",
-                  "<",
-                  ">",
-                  "/",
-                  "\\",
-                  "|",
-                  "°")
-    
-    def split(txt, seps):
-
-        for sep in seps:
-            txt = txt.replace(sep, " "+sep+" ")
-        return [i.strip() for i in txt.split(" ")]
-
-    #split by spaces
-    for split_by_space in text.strip().split():
-        tokens.extend(split(split_by_space,seperators))
-        
-    return [i for i in tokens if i]
+  if isinstance(text, bytes):
+    return _BYTE_TOKEN_PATTERN.findall(text)
+  return _UNICODE_TOKEN_PATTERN.findall(text)
 
 
+def vanilla_ft_tokenize_lines(lines):
+  #batch version of vanilla_ft_tokenizer. returns one list of tokens per line.
+  byte_findall = _BYTE_TOKEN_PATTERN.findall
+  unicode_findall = _UNICODE_TOKEN_PATTERN.findall
+  return [byte_findall(line) if isinstance(line, bytes) else unicode_findall(line) for line in lines]
 
 
-def clean_sentence(sentence, language="en"):
 
-  #always lowercase for everything, but that doesn't capture all the characters in french, so we'll need to finish this up later explicitly.
-  sentence = sentence.lower()
 
+#Character rewrites applied by clean_sentence after lowercasing, as (find, replace) pairs.
+#_COMMON_CLEANING_RULES runs for every language. To support a new language, add its table to
+#_LANGUAGE_CLEANING_RULES instead of writing another branch in clean_sentence.
+_COMMON_CLEANING_RULES = [
   #this awkward quotation mark makes an appearance sometimes in the WMT dataset. He can fuck right off.
-  sentence = re.sub("’", "'", sentence)
+  (u"’", u"'"),
+]
 
+_LANGUAGE_CLEANING_RULES = {
   #FastText does this with numbers. So we will do this too to use their embeddings. Besides, it's
   #not a bad way of dealing with numbers really.
-  if language == "en":
-    sentence = re.sub('0', ' zero ', sentence)
-    sentence = re.sub('1', ' one ', sentence)
-    sentence = re.sub('2', ' two ', sentence)
-    sentence = re.sub('3', ' three ', sentence)
-    sentence = re.sub('4', ' four ', sentence)
-    sentence = re.sub('5', ' five ', sentence)
-    sentence = re.sub('6', ' six ', sentence)
-    sentence = re.sub('7', ' seven ', sentence)
-    sentence = re.sub('8', ' eight ', sentence)
-    sentence = re.sub('9', ' nine ', sentence)
-  elif language == "fr":
-    sentence = re.sub('É', 'é', sentence)
-    sentence = re.sub('È', 'è', sentence)
-    sentence = re.sub('Ë', 'ë', sentence)
-    sentence = re.sub("Ê", "ê", sentence)
-    sentence = re.sub('À', 'à', sentence)
-    sentence = re.sub('Á', 'á', sentence)
-    sentence = re.sub('Â', 'â', sentence)
-    sentence = re.sub('Î', 'î', sentence)
-    sentence = re.sub('Ï', 'ï', sentence)
-    sentence = re.sub('Ö', 'ö', sentence)
-    sentence = re.sub('Ô', 'ô', sentence)
-    sentence = re.sub('Ó', 'ó', sentence)
-    sentence = re.sub('Ò', 'ò', sentence)
-    sentence = re.sub('Û', 'û', sentence)
-    sentence = re.sub('Ü', 'ü', sentence)
-    sentence = re.sub('Ù', 'ù', sentence)
-    sentence = re.sub('Ç', 'ç', sentence)
-    sentence = re.sub('Œ', 'œ', sentence)
-    sentence = re.sub('0', ' zéro ', sentence)
-    sentence = re.sub('1', ' un ', sentence)
-    sentence = re.sub('2', ' deux ', sentence)
-    sentence = re.sub('3', ' trois ', sentence)
-    sentence = re.sub('4', ' quatre ', sentence)
-    sentence = re.sub('5', ' cinq ', sentence)
-    sentence = re.sub('6', ' six ', sentence)
-    sentence = re.sub('7', ' sept ', sentence)
-    sentence = re.sub('8', ' huit ', sentence)
-    sentence = re.sub('9', ' neuf ', sentence)
-  else:
-    raise ValueError("clean_sentence() only has rules implemented for English and French. This isn't a horrible error. Basically,\
-      write out commands for what to do with numbers. If using a FastText embedding, this means explicitly finding string representations\
-       for the numbers in the language (ie, for english, '9' means ' nine '. Write out any explicit commands for dealing with lowercase accented characters that Python's lower()\
-       will not take care of.")
+  "en": [(u"0", u" zero "), (u"1", u" one "), (u"2", u" two "), (u"3", u" three "), (u"4", u" four "),
+         (u"5", u" five "), (u"6", u" six "), (u"7", u" seven "), (u"8", u" eight "), (u"9", u" nine ")],
+
+  #lower() on byte strings leaves accented capitals alone, so french spells those out too.
+  "fr": [(u"É", u"é"), (u"È", u"è"), (u"Ë", u"ë"), (u"Ê", u"ê"),
+         (u"À", u"à"), (u"Á", u"á"), (u"Â", u"â"), (u"Î", u"î"),
+         (u"Ï", u"ï"), (u"Ö", u"ö"), (u"Ô", u"ô"), (u"Ó", u"ó"),
+         (u"Ò", u"ò"), (u"Û", u"û"), (u"Ü", u"ü"), (u"Ù", u"ù"),
+         (u"Ç", u"ç"), (u"Œ", u"œ"),
+         (u"0", u" zéro "), (u"1", u" un "), (u"2", u" deux "), (u"3", u" trois "), (u"4", u" quatre "),
+         (u"5", u" cinq "), (u"6", u" six "), (u"7", u" sept "), (u"8", u" huit "), (u"9", u" neuf ")],
+}
+
+
+#bump when a change to the code changes the files a stage writes, so the files written by older code are rebuilt
+_PREPROCESSING_VERSION = 1
+
+
+def cleaning_rules_version(language):
+  #the version of the clean stage for language. it changes whenever the cleaning rules or the tokenizer separators do
+  rules = json.dumps([_COMMON_CLEANING_RULES, _LANGUAGE_CLEANING_RULES.get(language), _TOKENIZER_SEPERATORS])
+  return "%d-%s" % (_PREPROCESSING_VERSION, hashlib.sha1(rules.encode("utf-8")).hexdigest()[:16])
+
+
+class SentenceNormalizer(object):
+  """Applies a table of (find, replace) rules to a sentence in a single pass.
+
+  Every find string in the table is a single character, and no replacement contains a find string,
+  so doing all of them at once gives the same result as running them one after another.
+  Byte strings (utf-8) go through one compiled regex alternation since accented characters span
+  several bytes there, and unicode strings go through a single str.translate.
+  """
+
+  def __init__(self, rules):
+    self.rules = list(rules)
+    self._unicode_table = dict((ord(find), replace) for find, replace in self.rules)
+    self._byte_replacements = dict((find.encode("utf-8"), replace.encode("utf-8")) for find, replace in self.rules)
+    #longest first so a multi-byte character is never shadowed by a shorter find string
+    byte_finds = sorted(self._byte_replacements, key=len, reverse=True)
+    self._byte_pattern = re.compile(b"|".join(re.escape(find) for find in byte_finds))
+
+  def _replace_bytes(self, match):
+    return self._byte_replacements[match.group(0)]
+
+  def normalize(self, sentence):
+    if isinstance(sentence, bytes):
+      return self._byte_pattern.sub(self._replace_bytes, sentence)
+    return sentence.translate(self._unicode_table)
+
+
+_NORMALIZERS = {}
+
+def get_sentence_normalizer(language):
+  #normalizers are compiled the first time a language is seen and reused after that
+  if language not in _NORMALIZERS:
+    if language not in _LANGUAGE_CLEANING_RULES:
+      raise ValueError("clean_sentence() only has rules implemented for %s. This isn't a horrible error. Basically,\
+      add a rule table for the language to _LANGUAGE_CLEANING_RULES. If using a FastText embedding, this means explicitly finding string representations\
+       for the numbers in the language (ie, for english, '9' means ' nine '. Write out any explicit rules for dealing with lowercase accented characters that Python's lower()\
+       will not take care of." % ", ".join(sorted(_LANGUAGE_CLEANING_RULES)))
+    _NORMALIZERS[language] = SentenceNormalizer(_COMMON_CLEANING_RULES + _LANGUAGE_CLEANING_RULES[language])
+  return _NORMALIZERS[language]
+
+
+def clean_sentence(sentence, language="en"):
+
+  #always lowercase for everything, but that doesn't capture all the characters in french, so the
+  #normalizer finishes this up explicitly along with writing out the numbers.
+  normalizer = get_sentence_normalizer(language)
+  return normalizer.normalize(sentence.lower())
 
-  return sentence
+
+def clean_sentences(sentences, language="en"):
+  #batch version of clean_sentence. looks up the compiled normalizer once for the whole list.
+  normalizer = get_sentence_normalizer(language)
+  return [normalizer.normalize(sentence.lower()) for sentence in sentences]
 
 #returns a python set with all characters appearing in a file. good for knowing how to tokenize
 def get_all_chars_in_data_file(file_name, progress=1000000):
@@ -180,61 +212,590 @@ def get_all_chars_in_data_file(file_name, progress=1000000):
 
 
 
+def _find_shard_offsets(file_path, num_shards, start_offset=0):
+  """Split a file into at most num_shards (start, end) byte ranges that begin and end on line boundaries.
+
+  Each range starts right after a newline, so every line of the file lands in exactly one shard and
+  concatenating the shards in order gives back the original file. start_offset must itself be the
+  start of a line, and everything before it is left out of the shards.
+  """
+  file_size = gfile.Stat(file_path).length
+  boundaries = [start_offset]
+  with gfile.GFile(file_path, mode='rb') as f:
+    for shard in range(1, num_shards):
+      approximate_offset = start_offset + (file_size - start_offset) * shard // num_shards
+      if approximate_offset <= boundaries[-1]:
+        continue
+      #back up one byte so that an offset landing exactly on a line start stays there
+      f.seek(approximate_offset - 1)
+      f.readline()
+      offset = f.tell()
+      if offset >= file_size:
+        break
+      if offset > boundaries[-1]:
+        boundaries.append(offset)
+  boundaries.append(file_size)
+  return [(boundaries[i], boundaries[i+1]) for i in range(len(boundaries)-1) if boundaries[i] < boundaries[i+1]]
+
+
+def _iterate_shard_lines(file_path, start, end):
+  #yields every line that begins inside the byte range [start, end)
+  with gfile.GFile(file_path, mode='rb') as f:
+    f.seek(start)
+    position = start
+    while position < end:
+      line = f.readline()
+      if not line:
+        break
+      position += len(line)
+      yield line
+
+
+def _iterate_input_lines(file_path, start=0, end=None):
+  """Yield every line that begins inside the byte range [start, end) of file_path, or after start if end is None.
+
+  start has to be the start of a line, as it is for _iterate_shard_lines.
+
+  A gzipped file is read as a stream decompressed on a background thread (see download_utils.GzipLineReader),
+  and start and end are offsets into the decompressed text. Starting part way through a gzipped file still
+  has to inflate everything before start, but nothing is done with those lines.
+  """
+  if not download_utils.is_gzip_file(file_path):
+    for line in _iterate_shard_lines(file_path, start, gfile.Stat(file_path).length if end is None else end):
+      yield line
+    return
+
+  with download_utils.GzipLineReader(file_path) as reader:
+    position = 0
+    for line in reader:
+      if end is not None and position >= end:
+        break
+      if position >= start:
+        yield line
+      position += len(line)
+
+
+def _apply_to_block(job):
+  line_function, block = job
+  return [(len(line), line_function(line)) for line in block]
+
+
+def _map_lines(line_function, lines, pool=None, block_size=10000, blocks_in_flight=32):
+  """Yield (len(line), line_function(line)) for every line, in order.
+
+  With a process pool the lines are handed out in blocks, and at most blocks_in_flight blocks are read ahead
+  so the memory used doesn't depend on how long lines is. line_function has to be picklable.
+  """
+  if pool is None:
+    for line in lines:
+      yield len(line), line_function(line)
+    return
+
+  lines = iter(lines)
+  while True:
+    window = []
+    for _ in range(blocks_in_flight):
+      block = list(itertools.islice(lines, block_size))
+      if not block:
+        break
+      window.append((line_function, block))
+    if not window:
+      return
+    for results in pool.imap(_apply_to_block, window):
+      for result in results:
+        yield result
+
+
+def _concatenate_shards(shard_paths, output_file):
+  #appends the shard files to output_file in order, deleting each shard once it is copied
+  with gfile.GFile(output_file, mode='wb') as out:
+    for shard_path in shard_paths:
+      with gfile.GFile(shard_path, mode='rb') as shard:
+        while True:
+          chunk = shard.read(16 * 1024 * 1024)
+          if not chunk:
+            break
+          out.write(chunk)
+      gfile.Remove(shard_path)
+
+
+def _map_with_pool(worker_function, jobs, workers):
+  #runs worker_function on every job in a process pool, returning the results in job order
+  pool = multiprocessing.Pool(processes=workers)
+  try:
+    return pool.map(worker_function, jobs)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _run_sharded(worker_function, input_file, output_file, workers, shard_arguments):
+  """Run worker_function over line-aligned shards of input_file in a process pool.
+
+  Every worker writes its shard to a temporary file next to output_file, and the shards are then stitched
+  together in source order, so the output is line-aligned with the input exactly as the serial path writes it.
+
+  Args:
+    worker_function: module level function taking a tuple (input_file, shard_path, start, end) + shard_arguments
+                     and returning the number of lines it processed
+    input_file: the file to split into shards
+    output_file: the final output file
+    workers: number of processes to use
+    shard_arguments: tuple of extra arguments passed to every worker
+
+  Returns:
+    the total number of lines processed
+  """
+  shards = _find_shard_offsets(input_file, workers)
+  shard_paths = ["%s.shard%d" % (output_file, i) for i in range(len(shards))]
+  jobs = [(input_file, shard_path, start, end) + tuple(shard_arguments) for shard_path, (start, end) in zip(shard_paths, shards)]
+
+  print("Splitting %s into %d shards across %d worker processes" % (input_file, len(shards), workers))
+  line_counts = _map_with_pool(worker_function, jobs, workers)
+
+  with artifact_utils.atomic_output(output_file) as temporary_output:
+    _concatenate_shards(shard_paths, temporary_output)
+  for shard_path in shard_paths:
+    artifact_utils.remove_checkpoint(shard_path)
+  return sum(line_counts)
+
+
+def _run_line_stage(line_function, input_file, output_file, start, end, key, report_frequency=500000,
+                    checkpoint_frequency=1000000, pool=None):
+  """Write line_function(line) for every line beginning in the byte range [start, end) of input_file to output_file.
+
+  input_file may be gzipped, in which case the range is of the decompressed text and end may be None to read
+  to the end of it (see _iterate_input_lines). If a process pool is given, the lines are processed in it.
+
+  The output goes to a temporary file that is renamed to output_file once every line is written. Every
+  checkpoint_frequency lines the partial output is flushed and the position in both files is saved as a
+  checkpoint, so running the same work again (same key and byte range) carries on from the last checkpoint
+  instead of starting over. The checkpoint is marked done at the end, and left for the caller to remove once
+  output_file is used, so a shard that finished is not redone if the run dies before the shards are joined.
+
+  Returns:
+    the number of lines processed
+  """
+  key = dict(key, start=start, end=end)
+  state = artifact_utils.load_checkpoint(output_file, key)
+  if state is not None and state.get("done") and gfile.Exists(output_file):
+    print("%s was already finished. Skipping it" % output_file)
+    return state["lines"]
+
+  partial_path = artifact_utils.temporary_path(output_file)
+  position, written, line_count = start, 0, 0
+  if (state is not None and not state.get("done") and gfile.Exists(partial_path) and
+      gfile.Stat(partial_path).length >= state["output_offset"]):
+    position, written, line_count = state["input_offset"], state["output_offset"], state["lines"]
+    print("Resuming %s after line %d" % (output_file, line_count))
+
+  #written through the local filesystem, since resuming truncates the partial output to the checkpoint
+  with open(partial_path, "r+b" if written else "wb") as out:
+    out.truncate(written)
+    out.seek(written)
+    lines = _iterate_input_lines(input_file, position, end)
+    for line_size, output in _map_lines(line_function, lines, pool):
+      out.write(tf.compat.as_bytes(output))
+      position += line_size
+      line_count += 1
+      if line_count % report_frequency == 0:
+        print("processed %d lines for %s" % (line_count, output_file))
+      if line_count % checkpoint_frequency == 0:
+        out.flush()
+        os.fsync(out.fileno())
+        artifact_utils.save_checkpoint(output_file, key, {"input_offset": position, "output_offset": out.tell(),
+                                                          "lines": line_count})
+  os.rename(partial_path, output_file)
+  artifact_utils.save_checkpoint(output_file, key, {"done": True, "lines": line_count})
+  return line_count
+
+
+def _clean_and_tokenize_line(line, language):
+  line = tf.compat.as_bytes(line)
+  #print line
+
+  #we need to take care of casing, particularly with foreign characters, among other things.
+  line = clean_sentence(line, language=language)
+
+  #Our word vector tokenizer in fasttext is admittedly shitty...looks for whitespace, and thats it.
+  #So we will abstract this away by a tokenizer of our own and create an entirely new file
+  #of tokens by a single white space.
+  return vanilla_ft_tokenizer(line)
+
+
+def _format_clean_line(tokens):
+  to_write = ''
+  for token in tokens:
+    to_write += token + ' ' #append a space after each word
+
+  #We do NOT need to add an _EOS tag. We can just reference it in the trainer.
+  to_write += '\n'
+  return to_write
+
+
+def _clean_line(line, language):
+  return _format_clean_line(_clean_and_tokenize_line(line, language))
+
+
+def _clean_shard(job):
+  input_file, shard_path, start, end, language, key = job
+  line_count = _run_line_stage(functools.partial(_clean_line, language=language), input_file, shard_path, start, end, key)
+  print("cleaned shard %s (%d lines)" % (shard_path, line_count))
+  return line_count
+
+
 def clean_enfr_wmt_data(output_file,
                     input_file,
                     language="en",
-                    report_frequency=500000):
+                    report_frequency=500000,
+                    workers=1):
 
   """
   This will go through and lowercase everything, make every number written out (ie, 45 becomes four five, not forty-five) 
   We also explicitly have to lowercase those silly french letters with silly little baguettes over them.
+
+  If workers is more than 1, the input file is split into line-aligned byte shards which are cleaned
+  by a process pool and stitched back together in order, so the output is identical to the serial path.
+
+  input_file may be gzipped. It is then decompressed on a background thread while it is cleaned, rather
+  than being written to disk uncompressed first.
+
+  The file is skipped only if its manifest shows it was finished from the same input with the same
+  cleaning rules. An interrupted run resumes from its last checkpoint (see _run_line_stage).
   """
-  if gfile.Exists(output_file):
+  version = cleaning_rules_version(language)
+  if artifact_utils.is_current(output_file, "clean", version, [input_file]):
     print("Cleaned dataset file %s detected. Skipping cleaning" % output_file)
     return output_file
 
   assert gfile.Exists(input_file), "Could not find dataset file %s to create cleaned dataset file" % input_file
+  artifact_utils.invalidate(output_file, [output_file + ".counts", dataset_utils.line_index_path(output_file)])
+
+  print("Cleaning dataset file %s to conform to translator conventions (ie, lowercase, proper tokenization, etc) using %s as the detected language.\nFor a large dataset like WMT, this might take an hour-plus. Go eat a sandwich." % (input_file, language))
 
-  read_counter = 0
-
-  with gfile.GFile(input_file,mode='rb') as f:
-    with gfile.GFile(output_file,mode='w') as out:
-      print("Cleaning dataset file %s to conform to translator conventions (ie, lowercase, proper tokenization, etc) using %s as the detected language.\nFor a large dataset like WMT, this might take an hour-plus. Go eat a sandwich." % (input_file, language))
-      for line in f:
-        read_counter += 1
-        line = tf.compat.as_bytes(line)
-        #print line
-
-        #we need to take care of casing, particularly with foreign characters, among other things.
-        line = clean_sentence(line, language=language)
-
-        #Our word vector tokenizer in fasttext is admittedly shitty...looks for whitespace, and thats it.
-        #So we will abstract this away by a tokenizer of our own and create an entirely new file
-        #of tokens by a single white space.
-        tokens = vanilla_ft_tokenizer(line)
-        
-        to_write = ''
-        for token in tokens:
-          to_write += token + ' ' #append a space after each word
-
-        #We do NOT need to add an _EOS tag. We can just reference it in the trainer.
-        to_write += '\n'
-        
-        #We should explicitly specify utf8 because of all the bytecode character above.
-        #to_write = to_write.decode('utf-8')
-        out.write(to_write)
-
-        if read_counter % 500000 == 0:
-          print("read %d lines" % read_counter)
+  key = artifact_utils.checkpoint_key("clean", version, input_file)
+  line_function = functools.partial(_clean_line, language=language)
+  if workers > 1 and not download_utils.is_gzip_file(input_file):
+    read_counter = _run_sharded(_clean_shard, input_file, output_file, workers, (language, key))
+  else:
+    #a gzipped file can't be split into byte shards, so its lines are streamed through the pool instead
+    pool = multiprocessing.Pool(processes=workers) if workers > 1 else None
+    try:
+      read_counter = _run_line_stage(line_function, input_file, output_file, 0, None, key, report_frequency, pool=pool)
+    finally:
+      if pool is not None:
+        pool.close()
+        pool.join()
+    artifact_utils.remove_checkpoint(output_file)
+  print("read %d lines" % read_counter)
+  artifact_utils.record(output_file, "clean", version, [input_file])
   print("Done.\nClean output dataset file created at %s" % output_file)
   return output_file
 
 
+def _count_shard(job):
+  #map step of count_tokens. counts the tokens of every line starting inside the byte range [start, end)
+  input_data_path, start, end, report_frequency = job
+  counts = Counter()
+  total_tokens = 0
+  line_count = 0
+  for line in _iterate_shard_lines(input_data_path, start, end):
+    tokens = vanilla_ft_tokenizer(tf.compat.as_bytes(line))
+    total_tokens += len(tokens)
+    counts.update(tokens)
+    line_count += 1
+    if line_count % report_frequency == 0:
+      print("Processing line %d of the shard starting at byte %d..." % (line_count, start))
+  return counts, total_tokens, line_count
+
+
+def count_tokens(input_data_path, workers=1, report_frequency=1000000, start_offset=0):
+  """Count every token in a data file, splitting the file across worker processes.
+
+  Each worker counts the tokens of one line-aligned shard of the file and the partial counts
+  are summed afterwards, so the result is the same for any number of workers. Lines before the
+  byte start_offset are skipped, which lets us count only text appended to a file.
+
+  Returns:
+    a triple (counts, total_tokens, line_count) where counts is a Counter mapping token to frequency
+  """
+  shards = _find_shard_offsets(input_data_path, max(workers, 1), start_offset=start_offset)
+  jobs = [(input_data_path, start, end, report_frequency) for start, end in shards]
+  if workers > 1 and len(jobs) > 1:
+    print("Counting tokens in %d shards across %d worker processes" % (len(jobs), workers))
+    partial_counts = _map_with_pool(_count_shard, jobs, workers)
+  else:
+    partial_counts = [_count_shard(job) for job in jobs]
+
+  counts = Counter()
+  total_tokens = 0
+  line_count = 0
+  for shard_counts, shard_total_tokens, shard_line_count in partial_counts:
+    counts.update(shard_counts)
+    total_tokens += shard_total_tokens
+    line_count += shard_line_count
+  return counts, total_tokens, line_count
+
+
+def _summarize_shard(job):
+  #map step of summarize_tokens. like _count_shard, but only a block of lines is counted exactly at a time
+  input_data_path, start, end, capacity, block_lines, report_frequency = job
+  summary = heavy_hitters.MisraGriesSummary(capacity)
+  block = Counter()
+  line_count = 0
+  for line in _iterate_shard_lines(input_data_path, start, end):
+    block.update(vanilla_ft_tokenizer(tf.compat.as_bytes(line)))
+    line_count += 1
+    if line_count % block_lines == 0:
+      summary.update(block)
+      block = Counter()
+    if line_count % report_frequency == 0:
+      print("Processing line %d of the shard starting at byte %d..." % (line_count, start))
+  summary.update(block)
+  return summary.counts, summary.error, summary.total, line_count
+
+
+def summarize_tokens(input_data_path, capacity, workers=1, block_lines=100000, report_frequency=1000000):
+  """Approximate token counts of a data file in at most capacity counters per worker (see heavy_hitters).
+
+  Returns:
+    a pair (summary, line_count) where summary is a heavy_hitters.MisraGriesSummary of the whole file
+  """
+  shards = _find_shard_offsets(input_data_path, max(workers, 1))
+  jobs = [(input_data_path, start, end, capacity, block_lines, report_frequency) for start, end in shards]
+  if workers > 1 and len(jobs) > 1:
+    print("Summarizing tokens in %d shards across %d worker processes" % (len(jobs), workers))
+    partial_summaries = _map_with_pool(_summarize_shard, jobs, workers)
+  else:
+    partial_summaries = [_summarize_shard(job) for job in jobs]
+
+  summary = heavy_hitters.MisraGriesSummary(capacity)
+  line_count = 0
+  for counts, error, total, shard_line_count in partial_summaries:
+    summary.merge(heavy_hitters.MisraGriesSummary(capacity, counts, error, total))
+    line_count += shard_line_count
+  return summary, line_count
+
+
+def _count_candidates_shard(job):
+  #exact counts of the candidate tokens in the byte range [start, end)
+  input_data_path, start, end, candidates = job
+  counts = Counter()
+  for line in _iterate_shard_lines(input_data_path, start, end):
+    counts.update(token for token in vanilla_ft_tokenizer(tf.compat.as_bytes(line)) if token in candidates)
+  return counts
+
+
+def get_approximate_token_count_table(input_data_path, max_vocabulary_size, capacity, workers=1, report_frequency=1000000):
+  """A token count table of the most frequent tokens of a data file, counted in bounded memory.
+
+  A first pass finds candidates with a Misra-Gries summary of capacity counters, and a second pass counts
+  the candidates exactly. If the least frequent token of the vocabulary occurs more often than the error of
+  the summary, no token outside the summary can belong in the vocabulary, so it is exactly the vocabulary
+  create_vocabulary would have built from exact counts.
+
+  Returns:
+    a pair (table, exact). table holds exact counts of the candidates only, and exact says whether the top
+    max_vocabulary_size tokens of it are verified to be the true ones.
+  """
+  assert capacity >= max_vocabulary_size, "The counter capacity must be at least the vocabulary size"
+  print("Finding frequent tokens in %s with at most %d counters per worker" % (input_data_path, capacity))
+  summary, line_count = summarize_tokens(input_data_path, capacity, workers=workers, report_frequency=report_frequency)
+  print("Counts are underestimated by at most %d (guaranteed at most %d) over %d tokens" % (summary.error, summary.error_bound(), summary.total))
+
+  candidates = frozenset(summary.counts)
+  print("Counting the %d candidate tokens exactly" % len(candidates))
+  jobs = [(input_data_path, start, end, candidates) for start, end in _find_shard_offsets(input_data_path, max(workers, 1))]
+  if workers > 1 and len(jobs) > 1:
+    partial_counts = _map_with_pool(_count_candidates_shard, jobs, workers)
+  else:
+    partial_counts = [_count_candidates_shard(job) for job in jobs]
+  counts = Counter()
+  for shard_counts in partial_counts:
+    counts.update(shard_counts)
+
+  table = TokenCountTable.from_counts(counts, summary.total, line_count, gfile.Stat(input_data_path).length)
+  num_words = max_vocabulary_size - len(_INITIAL_VOCABULARY)
+  if num_words <= 0:
+    exact = True
+  elif len(table) < num_words:
+    #every token that occurs more than error times is a candidate, so the vocabulary only misses tokens if error > 0
+    exact = summary.error == 0
+  else:
+    exact = table.count_at_rank(num_words) > summary.error
+  if exact:
+    print("The %d most frequent tokens are exact" % min(num_words, len(table)))
+  else:
+    print("WARNING: tokens that occur at most %d times may be missing from the end of the vocabulary. Use a larger counter capacity for an exact vocabulary." % summary.error)
+  return table, exact
+
+
+class TokenCountTable(object):
+  """Frequency of every token in a cleaned data file, kept in a binary sidecar next to the file.
+
+  Counting the corpus is the slow part of building a vocabulary, while the vocabulary size only
+  decides where the list is cut. The table stores every token with its count in no particular order,
+  and the most frequent ones are selected when a vocabulary is written (see most_frequent), so a long
+  tail of tens of millions of distinct tokens is never sorted.
+
+  The sidecar file is laid out as
+    8 byte magic
+    int64 num_tokens, total_tokens, line_count, covered_bytes
+    int64 counts[num_tokens]
+    int64 offsets[num_tokens + 1] into the token blob
+    token blob, the utf-8 tokens back to back
+  covered_bytes is how much of the data file has been counted. If the data file grows, only the new
+  lines are counted and merged in (see get_token_count_table).
+  """
+
+  MAGIC = b"NMTCNT01"
+
+  def __init__(self, counts, offsets, token_blob, total_tokens, line_count, covered_bytes):
+    self.counts = counts
+    self.offsets = offsets
+    self.token_blob = token_blob
+    self.total_tokens = total_tokens
+    self.line_count = line_count
+    self.covered_bytes = covered_bytes
+
+  @classmethod
+  def from_counts(cls, counts, total_tokens, line_count, covered_bytes):
+    tokens = list(counts)
+    token_counts = np.fromiter((counts[token] for token in tokens), dtype=np.int64, count=len(tokens))
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(token) for token in tokens])
+    return cls(token_counts, offsets, b"".join(tokens), total_tokens, line_count, covered_bytes)
+
+  @classmethod
+  def load(cls, path):
+    with gfile.GFile(path, mode='rb') as f:
+      data = f.read()
+    if data[:len(cls.MAGIC)] != cls.MAGIC:
+      raise ValueError("%s is not a token count table" % path)
+    position = len(cls.MAGIC)
+    num_tokens, total_tokens, line_count, covered_bytes = [int(x) for x in np.frombuffer(data, dtype=np.int64, count=4, offset=position)]
+    position += 4 * 8
+    counts = np.frombuffer(data, dtype=np.int64, count=num_tokens, offset=position)
+    position += num_tokens * 8
+    offsets = np.frombuffer(data, dtype=np.int64, count=num_tokens + 1, offset=position)
+    position += (num_tokens + 1) * 8
+    return cls(counts, offsets, data[position:], total_tokens, line_count, covered_bytes)
+
+  def save(self, path):
+    header = np.array([len(self), self.total_tokens, self.line_count, self.covered_bytes], dtype=np.int64)
+    with artifact_utils.atomic_output(path) as temporary_path:
+      with gfile.GFile(temporary_path, mode='wb') as f:
+        f.write(self.MAGIC)
+        f.write(header.tobytes())
+        f.write(np.asarray(self.counts, dtype=np.int64).tobytes())
+        f.write(np.asarray(self.offsets, dtype=np.int64).tobytes())
+        f.write(self.token_blob)
+
+  def __len__(self):
+    return len(self.counts)
+
+  def _token(self, i):
+    return self.token_blob[self.offsets[i]:self.offsets[i+1]]
+
+  def most_frequent(self, limit):
+    """Indices of the limit most frequent tokens in vocabulary order, descending count with ties broken by the token.
+
+    The counts are partitioned around the limit-th largest one, tokens are compared only among the ties at
+    that count, and only the selected limit tokens are sorted.
+    """
+    limit = max(0, min(limit, len(self)))
+    counts = np.asarray(self.counts)
+    if limit == 0:
+      return []
+    if limit < len(self):
+      threshold = np.partition(counts, len(counts) - limit)[len(counts) - limit]
+      above = np.flatnonzero(counts > threshold)
+      tied = heapq.nsmallest(limit - len(above), np.flatnonzero(counts == threshold).tolist(), key=self._token)
+      selected = above.tolist() + tied
+    else:
+      selected = range(len(self))
+    return sorted(selected, key=lambda i: (-counts[i], self._token(i)))
+
+  def tokens(self, limit=None):
+    #the most frequent tokens, in vocabulary order. only the requested ones are pulled out of the blob
+    return [self._token(i) for i in self.most_frequent(len(self) if limit is None else limit)]
+
+  def as_counter(self):
+    return Counter(dict((self._token(i), int(count)) for i, count in enumerate(self.counts)))
+
+  def count_at_rank(self, rank):
+    #the count of the rank-th most frequent token, counting from 1
+    return int(np.partition(np.asarray(self.counts), len(self) - rank)[len(self) - rank])
+
+  def unk_rates(self, vocabulary_sizes):
+    """Unknown word rate for each of vocabulary_sizes, which count the special symbols just like the vocabulary files do.
+
+    The known tokens of a size are the largest counts, found with one partition for all the sizes.
+    """
+    counts = np.asarray(self.counts)
+    num_words = [max(0, min(size - len(_INITIAL_VOCABULARY), len(self))) for size in vocabulary_sizes]
+    kth = sorted(set(len(self) - k for k in num_words if 0 < k < len(self)))
+    partitioned = np.partition(counts, kth) if kth else counts
+    total = float(max(self.total_tokens, 1))
+    return [1. - partitioned[len(self) - k:].sum() / total if k else 1. for k in num_words]
+
+  def unk_rate(self, vocabulary_size):
+    return self.unk_rates([vocabulary_size])[0]
+
+  def report_unk_rates(self, vocabulary_sizes=(10000, 20000, 30000, 40000, 50000, 60000, 80000, 100000)):
+    rates = self.unk_rates(vocabulary_sizes)
+    print("%d distinct tokens, %d tokens over %d lines. Unknown word rate by vocabulary size:" % (len(self), self.total_tokens, self.line_count))
+    for size, rate in zip(vocabulary_sizes, rates):
+      print("\t%d\t%.4f" % (size, rate))
+
+
+def get_token_count_table(input_data_path, workers=1, report_frequency=1000000):
+  """Load the token count table for a data file, building or updating its sidecar when needed.
+
+  The table is kept at input_data_path + ".counts". If the data file has grown since the table was
+  written, only the lines after the counted bytes are tokenized and their counts are merged in. If the
+  data file shrank, or the counted part no longer ends on a line break, the table is rebuilt.
+  """
+  counts_path = input_data_path + ".counts"
+  file_size = gfile.Stat(input_data_path).length
+
+  table = None
+  if gfile.Exists(counts_path):
+    table = TokenCountTable.load(counts_path)
+    if table.covered_bytes == file_size:
+      print("Loaded token counts for %s from %s" % (input_data_path, counts_path))
+      return table
+    if table.covered_bytes > file_size or not _ends_on_line_break(input_data_path, table.covered_bytes):
+      print("Data file %s changed since %s was written. Recounting all tokens." % (input_data_path, counts_path))
+      table = None
+
+  if table is None:
+    counts, total_tokens, line_count = count_tokens(input_data_path, workers=workers, report_frequency=report_frequency)
+  else:
+    print("Counting tokens appended to %s after byte %d" % (input_data_path, table.covered_bytes))
+    counts, total_tokens, line_count = count_tokens(input_data_path, workers=workers, report_frequency=report_frequency,
+                                                    start_offset=table.covered_bytes)
+    counts.update(table.as_counter())
+    total_tokens += table.total_tokens
+    line_count += table.line_count
+
+  table = TokenCountTable.from_counts(counts, total_tokens, line_count, file_size)
+  table.save(counts_path)
+  print("Saved token counts to %s" % counts_path)
+  return table
+
 
+def _ends_on_line_break(file_path, offset):
+  #true if offset is the start of a line, ie the byte before it is a line break
+  if offset == 0:
+    return True
+  with gfile.GFile(file_path, mode='rb') as f:
+    f.seek(offset - 1)
+    return f.read(1) == b"\n"
 
 
 def create_vocabulary(output_vocabulary_path, input_data_path, max_vocabulary_size,
-                      tokenizer=None, report_frequency=1000000):
+                      tokenizer=None, report_frequency=1000000, workers=1, counter_capacity=None):
   """Create vocabulary file (if it does not exist yet) from data file.
 
   Data file is assumed to contain one sentence per line. Each sentence is
@@ -242,6 +803,9 @@ def create_vocabulary(output_vocabulary_path, input_data_path, max_vocabulary_si
   Vocabulary contains the most-frequent tokens up to max_vocabulary_size.
   We write it to vocabulary_path in a one-token-per-line format, so that later
   token in the first line gets id=0, second line gets id=1, and so on.
+  Tokens with the same frequency are ordered by the token itself. The token counts are
+  kept in a sidecar next to the data file (see TokenCountTable), so trying another
+  vocabulary size does not need another pass over the corpus.
 
   Args:
     vocabulary_path: path where the vocabulary will be created.
@@ -249,50 +813,50 @@ def create_vocabulary(output_vocabulary_path, input_data_path, max_vocabulary_si
     max_vocabulary_size: limit on the size of the created vocabulary.
     tokenizer: a function to use to tokenize each data sentence;
       if None, basic_tokenizer will be used.
+    workers: number of processes to count tokens with. the vocabulary is the same for any value.
+    counter_capacity: if set, tokens are counted in at most this many counters per worker instead of
+      keeping a count for every distinct token (see get_approximate_token_count_table), for corpora
+      whose distinct tokens don't fit in memory. No count table sidecar is kept in this mode.
   """
-
-  if gfile.Exists(output_vocabulary_path):
+  params = {"max_vocabulary_size": max_vocabulary_size}
+  #a vocabulary that couldn't be verified records the capacity it was counted with, so it is only reused with that capacity
+  approximate_params = dict(params, counter_capacity=counter_capacity)
+  if (artifact_utils.is_current(output_vocabulary_path, "vocabulary", _PREPROCESSING_VERSION, [input_data_path], params,
+                               verbose=not counter_capacity) or
+      (counter_capacity and artifact_utils.is_current(output_vocabulary_path, "vocabulary", _PREPROCESSING_VERSION, [input_data_path],
+                                                      approximate_params, verbose=False))):
     print("Vocabulary file %s already exists. Skipping this step..." % output_vocabulary_path)
   else:
     assert gfile.Exists(input_data_path), "Cannot find input data file at %s\nNo vocabulary file will be created" % input_data_path
 
-    vocabulary = {}
-    total_tokens = 0
-    vocab_tokens = 0
-
-    with gfile.GFile(input_data_path, mode='rb') as f:
-      print("Creating vocabulary file %s for the top %d words in corpus\nThis may take a few minutes. Go eat a sandwich." % (output_vocabulary_path, max_vocabulary_size))
-      line_count = 0
-      for line in f:
-
-        #read the sentence and tokenize it using whatever tokenizer we defined
-        line = tf.compat.as_bytes(line)
-        line_count += 1
-        tokens = vanilla_ft_tokenizer(line)
-        total_tokens += len(tokens)
-        
-        #go token through token and increment each word counter every time we see it
-        for t in tokens:
-          if t in vocabulary:
-            vocabulary[t] += 1
-          else:
-            vocabulary[t] = 1
-        
-        if line_count % report_frequency == 0:
-          print("Processing line %d..." % line_count)
-
-      #append the special symbols to our vocabulary
-      full_vocabulary = _INITIAL_VOCABULARY + sorted(vocabulary, key=vocabulary.get, reverse=True)
-      top_vocabulary = full_vocabulary[:max_vocabulary_size]
-
-      with gfile.GFile(output_vocabulary_path, mode='wb') as out:
-        for word in top_vocabulary:
-          if word not in _INITIAL_VOCABULARY:
-            vocab_tokens += vocabulary[word]
-          out.write(word)
-          out.write(b"\n")
-
-    print("Created vocabulary file with %d words.\nThe rate of unknown words for this vocabulary was %.4f" % (min(len(top_vocabulary),max_vocabulary_size), 1 - vocab_tokens / float(total_tokens)))
+    print("Creating vocabulary file %s for the top %d words in corpus\nThis may take a few minutes. Go eat a sandwich." % (output_vocabulary_path, max_vocabulary_size))
+    if counter_capacity:
+      table, exact = get_approximate_token_count_table(input_data_path, max_vocabulary_size, counter_capacity,
+                                                       workers=workers, report_frequency=report_frequency)
+      if not exact:
+        params = approximate_params
+    else:
+      table = get_token_count_table(input_data_path, workers=workers, report_frequency=report_frequency)
+    table.report_unk_rates()
+
+    _write_vocabulary(output_vocabulary_path, table, max_vocabulary_size, [input_data_path], params)
+
+
+def _write_vocabulary(output_vocabulary_path, table, max_vocabulary_size, inputs, params=None):
+  #inputs are the files table was counted from, recorded in the manifest of the vocabulary along with params
+  #append the special symbols to our vocabulary
+  top_vocabulary = _INITIAL_VOCABULARY + table.tokens(max_vocabulary_size - len(_INITIAL_VOCABULARY))
+  top_vocabulary = top_vocabulary[:max_vocabulary_size]
+
+  with artifact_utils.atomic_output(output_vocabulary_path) as temporary_path:
+    with gfile.GFile(temporary_path, mode='wb') as out:
+      for word in top_vocabulary:
+        out.write(word)
+        out.write(b"\n")
+  artifact_utils.record(output_vocabulary_path, "vocabulary", _PREPROCESSING_VERSION, inputs,
+                        params or {"max_vocabulary_size": max_vocabulary_size})
+
+  print("Created vocabulary file with %d words.\nThe rate of unknown words for this vocabulary was %.4f" % (min(len(top_vocabulary),max_vocabulary_size), table.unk_rate(max_vocabulary_size)))
 
 
 def get_sentence_length_distribution(input_file, max_length, report_frequency=500000):
@@ -378,14 +942,18 @@ def sentence_to_token_ids(sentence,
     sentence: the sentence in bytes format to convert to token-ids.
     vocabulary: a dictionary mapping tokens to integers.
     unknown_words: a function to use to decide what to do with unknown words,
-      perhaps it is truly best to represent them 
+      perhaps it is truly best to represent them. It is given a word that is not in
+      vocabulary and returns its id, ie an unk_substitution.UnkSubstitutes from
+      load_unk_substitutes. If None, unknown words are UNK_ID.
 
   Returns:
     a list of integers, the token-ids for the sentence.
   """
 
   words = sentence.split()
-  return [vocabulary.get(w, UNK_ID) for w in words]
+  if unknown_words is None:
+    return [vocabulary.get(w, UNK_ID) for w in words]
+  return [vocabulary[w] if w in vocabulary else unknown_words(w) for w in words]
 
 
 
@@ -394,8 +962,23 @@ def sentence_to_token_ids(sentence,
 
 
 
+def _integerize_line(line, vocab, unknown_words=None):
+  token_ids = sentence_to_token_ids(tf.compat.as_bytes(line), vocab, unknown_words)
+  return " ".join([str(tok) for tok in token_ids]) + "\n"
+
+
+def _integerize_shard(job):
+  data_path, shard_path, start, end, vocabulary_path, substitutes_path, key = job
+  vocab, _ = initialize_vocabulary(vocabulary_path)
+  unknown_words = load_unk_substitutes(substitutes_path) if substitutes_path else None
+  line_count = _run_line_stage(functools.partial(_integerize_line, vocab=vocab, unknown_words=unknown_words),
+                               data_path, shard_path, start, end, key)
+  print("integerized shard %s (%d lines)" % (shard_path, line_count))
+  return line_count
+
+
 def integerize_sentences(data_path, target_path, vocabulary_path,
-                        report_frequency=500000):
+                        report_frequency=500000, workers=1, substitutes_path=None):
   """Tokenize data file and turn into token-ids using given vocabulary file.
 
   This function loads data line-by-line from data_path, calls the above
@@ -408,21 +991,372 @@ def integerize_sentences(data_path, target_path, vocabulary_path,
     vocabulary_path: path to the vocabulary file.
     tokenizer: a function to use to tokenize each sentence;
       if None, basic_tokenizer will be used.
+    workers: number of processes to split the data file across. the output is the same for any value.
+    substitutes_path: if given, unknown words with a substitute in this table (see build_unk_substitutes) get
+      the substitute's id instead of UNK_ID.
   """
-  if not gfile.Exists(target_path):
-    print("Integerizing data in %s" % data_path)
+  inputs = [data_path, vocabulary_path] + ([substitutes_path] if substitutes_path else [])
+  if artifact_utils.is_current(target_path, "integerize", _PREPROCESSING_VERSION, inputs):
+    return
+  artifact_utils.invalidate(target_path, [dataset_utils.line_index_path(target_path)])
+  print("Integerizing data in %s" % data_path)
+  key_params = {"vocabulary": artifact_utils.file_hash(vocabulary_path)}
+  if substitutes_path:
+    key_params["substitutes"] = artifact_utils.file_hash(substitutes_path)
+  key = artifact_utils.checkpoint_key("integerize", _PREPROCESSING_VERSION, data_path, key_params)
+  if workers > 1:
+    counter = _run_sharded(_integerize_shard, data_path, target_path, workers, (vocabulary_path, substitutes_path, key))
+  else:
     vocab, _ = initialize_vocabulary(vocabulary_path)
-    with gfile.GFile(data_path, mode="rb") as data_file:
-      with gfile.GFile(target_path, mode="w") as tokens_file:
+    unknown_words = load_unk_substitutes(substitutes_path) if substitutes_path else None
+    counter = _run_line_stage(functools.partial(_integerize_line, vocab=vocab, unknown_words=unknown_words), data_path,
+                              target_path, 0, gfile.Stat(data_path).length, key, report_frequency)
+    artifact_utils.remove_checkpoint(target_path)
+  print("Processed line %d" % counter)
+  artifact_utils.record(target_path, "integerize", _PREPROCESSING_VERSION, inputs)
+
+
+def build_unk_substitutes(vocabulary_path, vocabulary_size, embedding_path, algorithm, embed_size, **kwargs):
+  #the substitution table of a vocabulary, see unk_substitution.build_substitutes. kwargs are passed on to it
+  return unk_substitution.build_substitutes(vocabulary_path, vocabulary_size, embedding_path, algorithm, embed_size,
+                                            special_words=_INITIAL_VOCABULARY, **kwargs)
+
+
+def load_unk_substitutes(substitutes_path):
+  #an unknown_words function for sentence_to_token_ids, mapping words without a substitute to UNK_ID
+  return unk_substitution.UnkSubstitutes.load(substitutes_path, UNK_ID)
+
+
+def _read_vocabulary_lines(vocabulary_path, limit=None):
+  lines = []
+  with gfile.GFile(vocabulary_path, mode="rb") as f:
+    for line in f:
+      if limit is not None and len(lines) >= limit:
+        break
+      lines.append(tf.compat.as_bytes(line.strip()))
+  return lines
+
+
+def _glob_escape(path):
+  #escapes the glob wildcards in a literal path
+  return re.sub(r"([*?\[])", r"[\1]", path)
+
+
+def find_remappable_integerized_file(ids_path_template, vocabulary_path_template, vocabulary_size, data_path=None):
+  """Look for an integerized file with a larger vocabulary that a vocabulary_size file can be derived from.
+
+  Vocabularies list the special symbols followed by tokens in descending frequency, so when two
+  vocabularies are built from the same counts the smaller one is a prefix of the larger one, and an
+  id below vocabulary_size means the same word in both. We check the vocabulary files really do agree
+  on that prefix, since files built by an older tokenizer or another corpus may not.
+
+  Args:
+    ids_path_template: path of the integerized files with a %d for the vocabulary size, ie train.fr.clean.ids_%d
+    vocabulary_path_template: path of the vocabulary files with a %d for the vocabulary size
+    vocabulary_size: the vocabulary size we want an integerized file for
+    data_path: if given, only integerized files whose manifest shows they are complete and up to date
+      integerizations of data_path are used
+
+  Returns:
+    the path of the smallest suitable larger integerized file, or None if there is none
+  """
+  prefix = ids_path_template.replace("%d", "")
+  candidates = []
+  for path in gfile.Glob(_glob_escape(prefix) + "*"):
+    try:
+      size = int(os.path.basename(path)[len(os.path.basename(prefix)):])
+    except ValueError:
+      continue #not one of ours, ie a leftover .shard file
+    if size > vocabulary_size and gfile.Exists(vocabulary_path_template % size):
+      if data_path is None or artifact_utils.is_current(path, "integerize", _PREPROCESSING_VERSION,
+                                                        [data_path, vocabulary_path_template % size]):
+        candidates.append(size)
+
+  smaller_vocabulary = _read_vocabulary_lines(vocabulary_path_template % vocabulary_size)
+  for size in sorted(candidates):
+    if _read_vocabulary_lines(vocabulary_path_template % size, limit=len(smaller_vocabulary)) == smaller_vocabulary:
+      return ids_path_template % size
+  return None
+
+
+def remap_integerized_file(larger_ids_path, target_path, vocabulary_size, block_size=200000, report_frequency=2000000):
+  """Derive the integerized file for a smaller vocabulary from one made with a larger vocabulary.
+
+  Every id at or above vocabulary_size becomes UNK_ID and everything else is unchanged. The file is
+  read in blocks of lines, each block is parsed into one numpy array, and only the lines that actually
+  contain an out of vocabulary id are rewritten; all others are copied as they are.
+  """
+  print("Deriving %s from %s by mapping ids >= %d to UNK" % (target_path, larger_ids_path, vocabulary_size))
+
+  def remap_block(lines, out):
+    ids, lengths = dataset_utils.parse_integerized_lines(lines)
+
+    line_of_id = np.repeat(np.arange(len(lines)), lengths)
+    changed_lines = set(np.unique(line_of_id[ids >= vocabulary_size]).tolist())
+    starts = np.concatenate([[0], np.cumsum(lengths)])
+    ids = np.where(ids >= vocabulary_size, UNK_ID, ids)
+
+    for i, line in enumerate(lines):
+      if i in changed_lines:
+        line = tf.compat.as_bytes(" ".join([str(tok) for tok in ids[starts[i]:starts[i+1]]]) + "\n")
+      out.write(line)
+
+  with artifact_utils.atomic_output(target_path) as temporary_path:
+    with gfile.GFile(larger_ids_path, mode="rb") as source:
+      with gfile.GFile(temporary_path, mode="wb") as out:
+        block = []
         counter = 0
-        for line in data_file:
+        for line in source:
+          block.append(line)
           counter += 1
+          if len(block) == block_size:
+            remap_block(block, out)
+            block = []
           if counter % report_frequency == 0:
-            print("Processed line %d" % counter)
-          token_ids = sentence_to_token_ids(tf.compat.as_bytes(line), vocab)
-          tokens_file.write(" ".join([str(tok) for tok in token_ids]) + "\n")
+            print("Remapped line %d" % counter)
+        if block:
+          remap_block(block, out)
+
+
+def integerize_or_remap_sentences(data_path, ids_path_template, vocabulary_path_template, vocabulary_size, workers=1,
+                                  substitutes_path=None):
+  """Create the integerized file for vocabulary_size, remapping a larger one when we can.
+
+  This is what prepare_data uses. When we sweep vocabulary sizes a larger integerized file usually
+  exists already, and remapping it is a cheap streaming pass compared to tokenizing the corpus again.
+  A remapped file is identical to integerizing data_path, so its manifest records the same inputs.
+  With substitutes_path it isn't, since a word outside the smaller vocabulary should get its substitute
+  rather than UNK_ID, so the file is always integerized.
+
+  Returns:
+    the path to the integerized file
+  """
+  target_path = ids_path_template % vocabulary_size
+  vocabulary_path = vocabulary_path_template % vocabulary_size
+  if substitutes_path:
+    integerize_sentences(data_path, target_path, vocabulary_path, workers=workers, substitutes_path=substitutes_path)
+  elif not artifact_utils.is_current(target_path, "integerize", _PREPROCESSING_VERSION, [data_path, vocabulary_path],
+                                     verbose=False):
+    larger_ids_path = find_remappable_integerized_file(ids_path_template, vocabulary_path_template, vocabulary_size,
+                                                       data_path=data_path)
+    if larger_ids_path is not None:
+      artifact_utils.invalidate(target_path, [dataset_utils.line_index_path(target_path)])
+      remap_integerized_file(larger_ids_path, target_path, vocabulary_size)
+      artifact_utils.record(target_path, "integerize", _PREPROCESSING_VERSION, [data_path, vocabulary_path])
+    else:
+      integerize_sentences(data_path, target_path, vocabulary_path, workers=workers)
+  return target_path
+
+
+#==============================Fused preprocessing=====================================
+# The default path through prepare_data makes a pass per stage: cleaning writes a .clean file, counting
+# tokenizes it again and integerizing splits it again. The fused pipeline tokenizes every raw line exactly
+# once. That pass counts the tokens and writes a token cache, which is the whole file as ids into the list
+# of distinct tokens in the order they were first seen, stored in the binary integerized corpus format.
+# Integerizing for a vocabulary is then a lookup table gather over the cache, with no text processing.
+
+def token_cache_path(clean_path):
+  return clean_path + ".tokcache"
+
+
+def _token_cache_tokens_path(cache_path):
+  #the distinct tokens of the cache, one per line, in id order
+  return cache_path + ".tokens"
+
+
+def _token_cache_counts_path(cache_path):
+  return cache_path + ".counts"
+
+
+def iterate_tokenized_lines(input_file, language="en", clean_output_file=None, report_frequency=500000):
+  """Yield the cleaned tokens of every line of a raw data file.
+
+  If clean_output_file is given, every cleaned line is also written there in the format
+  clean_enfr_wmt_data uses, so the file is identical to the one it would have created.
+  """
+  out = gfile.GFile(clean_output_file, mode='w') if clean_output_file is not None else None
+  try:
+    read_counter = 0
+    for line in _iterate_input_lines(input_file):
+      read_counter += 1
+      tokens = _clean_and_tokenize_line(line, language)
+      if out is not None:
+        out.write(_format_clean_line(tokens))
+      if read_counter % report_frequency == 0:
+        print("read %d lines" % read_counter)
+      yield tokens
+  finally:
+    if out is not None:
+      out.close()
+
+
+def _write_token_cache_block(writer, block_ids, block_lengths, counts):
+  #write a block of sentences to the cache and return the token counts with the block added in
+  ids = np.array(block_ids, dtype=np.int64)
+  writer.write_block(ids, np.array(block_lengths, dtype=np.int64))
+  block_counts = np.bincount(ids, minlength=len(counts))
+  block_counts[:len(counts)] += counts
+  return block_counts
+
+
+def build_token_cache(input_file, cache_path, language="en", clean_output_file=None, block_size=200000, report_frequency=500000):
+  """Clean and tokenize a raw data file in one pass, writing its token cache and token counts.
+
+  Args:
+    input_file: the raw data file.
+    cache_path: where to write the token cache. The distinct tokens and the TokenCountTable are written next to it.
+    language: the language of the cleaning rules.
+    clean_output_file: if given, the .clean file is written as well, along with its token count sidecar so that
+      create_vocabulary can use it later without counting the file again.
+
+  Returns:
+    the TokenCountTable of the file
+  """
+  version = cleaning_rules_version(language)
+  tokens_path = _token_cache_tokens_path(cache_path)
+  counts_path = _token_cache_counts_path(cache_path)
+  if artifact_utils.is_current(cache_path, "token_cache", version, [input_file]):
+    print("Token cache %s detected. Skipping tokenization" % cache_path)
+    return TokenCountTable.load(counts_path)
+
+  assert gfile.Exists(input_file), "Could not find dataset file %s to create a token cache" % input_file
+  artifact_utils.invalidate(cache_path, [tokens_path, counts_path])
+  clean_temporary_path = None
+  if clean_output_file is not None:
+    if artifact_utils.is_current(clean_output_file, "clean", version, [input_file]):
+      print("Cleaned dataset file %s detected. It will not be written again" % clean_output_file)
+      clean_output_file = None
+    else:
+      artifact_utils.invalidate(clean_output_file, [clean_output_file + ".counts",
+                                                    dataset_utils.line_index_path(clean_output_file)])
+      clean_temporary_path = artifact_utils.temporary_path(clean_output_file)
+
+  print("Cleaning and tokenizing %s into token cache %s using %s as the detected language" % (input_file, cache_path, language))
+  token_ids = {}
+  tokens = []
+  counts = np.zeros(0, dtype=np.int64)
+  line_count = 0
+  #the number of distinct tokens isn't known until the end, so the cache always holds 32 bit ids
+  with artifact_utils.atomic_output(cache_path) as temporary_cache_path:
+    with dataset_utils.IntegerizedCorpusWriter(temporary_cache_path, np.iinfo(np.uint32).max) as writer:
+      block_ids = []
+      block_lengths = []
+      for sentence in iterate_tokenized_lines(input_file, language, clean_temporary_path, report_frequency):
+        for token in sentence:
+          token_id = token_ids.get(token)
+          if token_id is None:
+            token_id = token_ids[token] = len(tokens)
+            tokens.append(token)
+          block_ids.append(token_id)
+        block_lengths.append(len(sentence))
+        if len(block_lengths) == block_size:
+          counts = _write_token_cache_block(writer, block_ids, block_lengths, counts)
+          line_count += len(block_lengths)
+          block_ids = []
+          block_lengths = []
+      counts = _write_token_cache_block(writer, block_ids, block_lengths, counts)
+      line_count += len(block_lengths)
+      writer.vocabulary_size = max(len(tokens), 1)
+
+  with artifact_utils.atomic_output(tokens_path) as temporary_path:
+    with gfile.GFile(temporary_path, mode='wb') as out:
+      for token in tokens:
+        out.write(token)
+        out.write(b"\n")
+
+  token_counts = dict(zip(tokens, counts.tolist()))
+  total_tokens = int(counts.sum())
+  if clean_output_file is not None:
+    gfile.Rename(clean_temporary_path, clean_output_file, overwrite=True)
+    artifact_utils.record(clean_output_file, "clean", version, [input_file])
+    TokenCountTable.from_counts(token_counts, total_tokens, line_count,
+                                gfile.Stat(clean_output_file).length).save(clean_output_file + ".counts")
+  table = TokenCountTable.from_counts(token_counts, total_tokens, line_count, gfile.Stat(input_file).length)
+  table.save(counts_path)
+  #the cache is recorded last, so it only counts as finished once its sidecars are written
+  artifact_utils.record(cache_path, "token_cache", version, [input_file])
+  print("Token cache holds %d lines, %d tokens and %d distinct tokens" % (line_count, total_tokens, len(tokens)))
+  return table
+
+
+def integerize_token_cache(cache_path, vocabulary_path, vocabulary_size, target_path, block_size=200000, report_frequency=2000000,
+                           substitutes_path=None):
+  """Write the integerized text file and its binary version from a token cache.
+
+  The output is the same as running integerize_sentences and convert_integerized_file_to_binary on the .clean file.
+  Substitutes are looked up once per distinct token.
+
+  Returns:
+    the path to the integerized text file
+  """
+  inputs = [cache_path, vocabulary_path] + ([substitutes_path] if substitutes_path else [])
+  if artifact_utils.is_current(target_path, "integerize", _PREPROCESSING_VERSION, inputs):
+    print("Integerized file %s detected. Skipping this step..." % target_path)
+    return target_path
+  binary_path = dataset_utils.binary_corpus_path(target_path)
+  artifact_utils.invalidate(target_path, [dataset_utils.line_index_path(target_path)])
+  artifact_utils.invalidate(binary_path)
+
+  print("Integerizing token cache %s with vocabulary %s" % (cache_path, vocabulary_path))
+  vocab, _ = initialize_vocabulary(vocabulary_path)
+  unknown_words = load_unk_substitutes(substitutes_path) if substitutes_path else (lambda token: UNK_ID)
+  with gfile.GFile(_token_cache_tokens_path(cache_path), mode='rb') as f:
+    lookup = np.array([vocab[token] if token in vocab else unknown_words(token) for token in (line.rstrip(b"\n") for line in f)],
+                      dtype=np.int64)
+
+  cache = dataset_utils.IntegerizedCorpus(cache_path)
+  offsets = np.asarray(cache.offsets)
+  with artifact_utils.atomic_output(target_path) as temporary_target_path:
+    with artifact_utils.atomic_output(binary_path) as temporary_binary_path:
+      with gfile.GFile(temporary_target_path, mode="w") as ids_file:
+        with dataset_utils.IntegerizedCorpusWriter(temporary_binary_path, vocabulary_size) as writer:
+          for start in range(0, len(cache), block_size):
+            end = min(start + block_size, len(cache))
+            ids = lookup[cache.tokens[offsets[start]:offsets[end]]]
+            writer.write_block(ids, np.diff(offsets[start:end + 1]))
+
+            words = [str(token_id) for token_id in ids.tolist()]
+            bounds = (offsets[start:end + 1] - offsets[start]).tolist()
+            ids_file.write("".join([" ".join(words[a:b]) + "\n" for a, b in zip(bounds[:-1], bounds[1:])]))
+            if end // report_frequency > start // report_frequency:
+              print("Processed line %d" % end)
+  artifact_utils.record(target_path, "integerize", _PREPROCESSING_VERSION, inputs)
+  dataset_utils.record_binary_corpus(target_path, vocabulary_size)
+  return target_path
+
+
+def prepare_fused_language_data(train_path, dev_path, language, vocabulary_path, vocabulary_size, write_clean_files=False,
+                                unk_substitution=None):
+  """The clean, create_vocabulary and integerize stages of prepare_data for one language, in the fused pipeline.
+
+  unk_substitution is as for prepare_data.
+
+  Files are named as prepare_data names them, so the two modes can share a data directory.
 
+  Returns:
+    a pair, the paths to the integerized training and development files
+  """
+  train_clean_path = derived_file_prefix(train_path) + ".clean"
+  dev_clean_path = derived_file_prefix(dev_path) + ".clean"
+  table = build_token_cache(train_path, token_cache_path(train_clean_path), language,
+                            train_clean_path if write_clean_files else None)
+  build_token_cache(dev_path, token_cache_path(dev_clean_path), language,
+                    dev_clean_path if write_clean_files else None)
+
+  if artifact_utils.is_current(vocabulary_path, "vocabulary", _PREPROCESSING_VERSION, [token_cache_path(train_clean_path)],
+                               {"max_vocabulary_size": vocabulary_size}):
+    print("Vocabulary file %s already exists. Skipping this step..." % vocabulary_path)
+  else:
+    table.report_unk_rates()
+    _write_vocabulary(vocabulary_path, table, vocabulary_size, [token_cache_path(train_clean_path)])
 
+  substitutes_path = build_unk_substitutes(vocabulary_path, vocabulary_size, **unk_substitution) if unk_substitution else None
+  train_ids_path = integerize_token_cache(token_cache_path(train_clean_path), vocabulary_path, vocabulary_size,
+                                          train_clean_path + ".ids_%d" % vocabulary_size, substitutes_path=substitutes_path)
+  dev_ids_path = integerize_token_cache(token_cache_path(dev_clean_path), vocabulary_path, vocabulary_size,
+                                        derived_file_prefix(dev_path) + ".ids_%d" % vocabulary_size,
+                                        substitutes_path=substitutes_path)
+  return train_ids_path, dev_ids_path
 
 
 def get_word_frequency_ratio(vocabulary, integerized_dataset_file_path, target_word, report_progress=2000000):
@@ -453,7 +1387,9 @@ def get_word_frequency_ratio(vocabulary, integerized_dataset_file_path, target_w
 
 
 
-def prepare_wmt_data(data_dir, en_vocabulary_size, fr_vocabulary_size, tokenizer=None):
+def prepare_wmt_data(data_dir, en_vocabulary_size, fr_vocabulary_size, tokenizer=None, workers=1, fused=False,
+                     write_clean_files=False, read_compressed=False, download_options=None, counter_capacity=None,
+                     deduplicate=False, unk_substitution=None):
   """Get WMT data into data_dir, create vocabularies and tokenize data.
 
   Args:
@@ -462,6 +1398,15 @@ def prepare_wmt_data(data_dir, en_vocabulary_size, fr_vocabulary_size, tokenizer
     fr_vocabulary_size: size of the French vocabulary to create and use.
     tokenizer: a function to use to tokenize each data sentence;
       if None, basic_tokenizer will be used.
+    workers: number of processes used by the cleaning and integerizing stages.
+    fused: use the fused single tokenization pipeline, see prepare_data.
+    write_clean_files: with fused, also write the .clean files.
+    read_compressed: leave the training corpus gzipped and decompress it while it is cleaned, instead of
+      writing the uncompressed corpus to disk first.
+    download_options: dictionary of keyword arguments for the downloads, see download_utils.get_wmt_enfr_train_set.
+    counter_capacity: count the vocabularies in bounded memory, see prepare_data.
+    deduplicate: drop exact duplicate training pairs, see prepare_data.
+    unk_substitution: substitute unknown English words by their nearest vocabulary words, see prepare_data.
 
   Returns:
     A tuple of 6 elements:
@@ -473,33 +1418,56 @@ def prepare_wmt_data(data_dir, en_vocabulary_size, fr_vocabulary_size, tokenizer
       (6) path to the French vocabulary file.
   """
   # Get wmt data to the specified directory.
-  train_path = download_utils.get_wmt_enfr_train_set(data_dir)
-  dev_path = download_utils.get_wmt_enfr_dev_set(data_dir)
+  download_options = download_options or {}
+  from_train_path, to_train_path = download_utils.get_wmt_enfr_train_files(data_dir, decompress=not read_compressed,
+                                                                          **download_options)
+  dev_path = download_utils.get_wmt_enfr_dev_set(data_dir, **download_options)
 
-  from_train_path = train_path + ".en"
-  to_train_path = train_path + ".fr"
   from_dev_path = dev_path + ".en"
   to_dev_path = dev_path + ".fr"
   return prepare_data(data_dir, from_train_path, to_train_path, from_dev_path, to_dev_path, en_vocabulary_size,
-                      fr_vocabulary_size, tokenizer)
+                      fr_vocabulary_size, tokenizer, workers=workers, fused=fused,
+                      write_clean_files=write_clean_files, counter_capacity=counter_capacity,
+                      deduplicate=deduplicate, unk_substitution=unk_substitution)
 
 
 
 
+def derived_file_prefix(data_path):
+  #files made from a data file are named after it, without the .gz of a compressed one, so reading the
+  #corpus compressed or not gives the same file names
+  return data_path[:-len(".gz")] if download_utils.is_gzip_file(data_path) else data_path
+
+
 def prepare_data(data_dir, from_train_path, to_train_path, from_dev_path, to_dev_path, from_vocabulary_size,
-                 to_vocabulary_size, tokenizer=None, glove=False, word2vec=False, fasttext=False):
+                 to_vocabulary_size, tokenizer=None, glove=False, word2vec=False, fasttext=False, workers=1,
+                 fused=False, write_clean_files=False, counter_capacity=None, deduplicate=False, unk_substitution=None):
   """Preapre all necessary files that are required for the training.
 
     Args:
       data_dir: directory in which the data sets will be stored.
       from_train_path: path to the file that includes "from" training samples.
-      to_train_path: path to the file that includes "to" training samples.
+      to_train_path: path to the file that includes "to" training samples. the four data files may be gzipped,
+        and are then read as streams (see clean_enfr_wmt_data).
       from_dev_path: path to the file that includes "from" dev samples.
       to_dev_path: path to the file that includes "to" dev samples.
       from_vocabulary_size: size of the "from language" vocabulary to create and use.
       to_vocabulary_size: size of the "to language" vocabulary to create and use.
       tokenizer: a function to use to tokenize each data sentence;
         if None, basic_tokenizer will be used.
+      workers: number of processes used to clean, count and integerize the files. the files written are
+        identical to the single process ones, so this only changes how long it takes.
+      fused: if True, every raw file is cleaned and tokenized exactly once into a token cache, and the vocabularies
+        and integerized files are built from the caches (see prepare_fused_language_data). The integerized files
+        are the same as in the default mode. This runs in a single process and ignores workers.
+      write_clean_files: with fused, also write the .clean files, which the fused pipeline itself does not need.
+      counter_capacity: if set, the vocabularies are counted with at most this many token counters per worker
+        (see create_vocabulary). Ignored by the fused pipeline, whose token cache needs every distinct token.
+      deduplicate: if True, exact duplicate (source, target) training pairs are dropped, keeping the first of each,
+        and the returned training paths are the deduplicated files (see dataset_utils.maybe_deduplicate_pairs).
+      unk_substitution: if given, a dictionary of keyword arguments for build_unk_substitutes, at least embedding_path,
+        algorithm and embed_size. Unknown "from language" words are then integerized as the id of their nearest
+        vocabulary word in that embedding, where one is close enough, instead of UNK_ID.
 
 
     Returns:
@@ -513,42 +1481,66 @@ def prepare_data(data_dir, from_train_path, to_train_path, from_dev_path, to_dev
         (7) path to the GloVe word embeddings created from the tokenized data, with size from_vocabulary_size and to_vocabulary_size
     """
 
-  # Clean the sentences by using lowercase letters and changing numbers into written words.
-
-
-
-  # Clean the data files by dealing with lowercases, and numbers
-  # This will run only if the .clean file doesn't exist
-  to_clean_train_path = clean_enfr_wmt_data(to_train_path+ ".clean", to_train_path, language="fr")
-  from_clean_train_path = clean_enfr_wmt_data(from_train_path+ ".clean", from_train_path, language="en")
-  to_clean_dev_path = clean_enfr_wmt_data(to_dev_path+ ".clean", to_dev_path, language="fr")
-  from_clean_dev_path = clean_enfr_wmt_data(from_dev_path+ ".clean", from_dev_path, language="en")
-
-
-  # Create vocabularies based on the cleaned dataset files and the vocabulary paths
-  # This will run only if the vocabulry file doesn't exist
-  to_vocab_path = os.path.join(data_dir, "vocabulary_%d.to" % to_vocabulary_size)
-  from_vocab_path = os.path.join(data_dir, "vocabulary_%d.from" % from_vocabulary_size)
-  create_vocabulary(to_vocab_path, to_clean_train_path , to_vocabulary_size, tokenizer)
-  create_vocabulary(from_vocab_path, from_clean_train_path , from_vocabulary_size, tokenizer)
-
-  #Now, we have a valid vocabulary that has been properly tokenized, so we need to run
-  # some unsupervised learning algorithms
-
-  # Integerize the training data by replacing words with their vocabulary representations (integers)
-  # This will run only if the integerized version of the training set doesn't already exist
-  to_train_ids_path = to_clean_train_path + (".ids_%d" % to_vocabulary_size)
-  from_train_ids_path = from_clean_train_path + (".ids_%d" % from_vocabulary_size)
-  integerize_sentences(to_clean_train_path, to_train_ids_path, to_vocab_path)
-  integerize_sentences(from_clean_train_path, from_train_ids_path, from_vocab_path)
-
-
-  # Create token ids for the development data.
-  # This will run only if the integerized version of the dev set doesn't already exist
-  to_dev_ids_path = to_dev_path + (".ids_%d" % to_vocabulary_size)
-  from_dev_ids_path = from_dev_path + (".ids_%d" % from_vocabulary_size)
-  integerize_sentences(to_clean_dev_path, to_dev_ids_path, to_vocab_path)
-  integerize_sentences(from_clean_dev_path, from_dev_ids_path, from_vocab_path)
+  to_vocab_path_template = os.path.join(data_dir, "vocabulary_%d.to")
+  from_vocab_path_template = os.path.join(data_dir, "vocabulary_%d.from")
+  to_vocab_path = to_vocab_path_template % to_vocabulary_size
+  from_vocab_path = from_vocab_path_template % from_vocabulary_size
+
+  if fused:
+    to_train_ids_path, to_dev_ids_path = prepare_fused_language_data(to_train_path, to_dev_path, "fr", to_vocab_path,
+                                                                     to_vocabulary_size, write_clean_files)
+    from_train_ids_path, from_dev_ids_path = prepare_fused_language_data(from_train_path, from_dev_path, "en", from_vocab_path,
+                                                                         from_vocabulary_size, write_clean_files,
+                                                                         unk_substitution=unk_substitution)
+  else:
+    # Clean the data files by dealing with lowercases, and numbers
+    # This will run only if the .clean file doesn't exist
+    to_clean_train_path = clean_enfr_wmt_data(derived_file_prefix(to_train_path)+ ".clean", to_train_path, language="fr", workers=workers)
+    from_clean_train_path = clean_enfr_wmt_data(derived_file_prefix(from_train_path)+ ".clean", from_train_path, language="en", workers=workers)
+    to_clean_dev_path = clean_enfr_wmt_data(derived_file_prefix(to_dev_path)+ ".clean", to_dev_path, language="fr", workers=workers)
+    from_clean_dev_path = clean_enfr_wmt_data(derived_file_prefix(from_dev_path)+ ".clean", from_dev_path, language="en", workers=workers)
+
+    # Create vocabularies based on the cleaned dataset files and the vocabulary paths
+    # This will run only if the vocabulry file doesn't exist
+    create_vocabulary(to_vocab_path, to_clean_train_path , to_vocabulary_size, tokenizer, workers=workers,
+                      counter_capacity=counter_capacity)
+    create_vocabulary(from_vocab_path, from_clean_train_path , from_vocabulary_size, tokenizer, workers=workers,
+                      counter_capacity=counter_capacity)
+
+    #Now, we have a valid vocabulary that has been properly tokenized, so we need to run
+    # some unsupervised learning algorithms
+    from_substitutes_path = None
+    if unk_substitution:
+      from_substitutes_path = build_unk_substitutes(from_vocab_path, from_vocabulary_size, **unk_substitution)
+
+    # Integerize the training data by replacing words with their vocabulary representations (integers)
+    # This will run only if the integerized version of the training set doesn't already exist. If one exists
+    # for a larger vocabulary, it is remapped instead of integerizing the cleaned file again.
+    to_train_ids_path = integerize_or_remap_sentences(to_clean_train_path, to_clean_train_path + ".ids_%d",
+                                                      to_vocab_path_template, to_vocabulary_size, workers=workers)
+    from_train_ids_path = integerize_or_remap_sentences(from_clean_train_path, from_clean_train_path + ".ids_%d",
+                                                        from_vocab_path_template, from_vocabulary_size, workers=workers,
+                                                        substitutes_path=from_substitutes_path)
+
+
+    # Create token ids for the development data.
+    # This will run only if the integerized version of the dev set doesn't already exist
+    to_dev_ids_path = integerize_or_remap_sentences(to_clean_dev_path, derived_file_prefix(to_dev_path) + ".ids_%d",
+                                                    to_vocab_path_template, to_vocabulary_size, workers=workers)
+    from_dev_ids_path = integerize_or_remap_sentences(from_clean_dev_path, derived_file_prefix(from_dev_path) + ".ids_%d",
+                                                      from_vocab_path_template, from_vocabulary_size, workers=workers,
+                                                      substitutes_path=from_substitutes_path)
+
+  # Write the binary version of every integerized file. load_dataset_in_memory memory maps these instead
+  # of parsing the text files, which is most of the training startup time on a big corpus.
+  dataset_utils.maybe_convert_integerized_file_to_binary(to_train_ids_path, to_vocabulary_size)
+  dataset_utils.maybe_convert_integerized_file_to_binary(from_train_ids_path, from_vocabulary_size)
+  dataset_utils.maybe_convert_integerized_file_to_binary(to_dev_ids_path, to_vocabulary_size)
+  dataset_utils.maybe_convert_integerized_file_to_binary(from_dev_ids_path, from_vocabulary_size)
+
+  # Web crawled corpora repeat many pairs word for word, and every repeat costs a training step.
+  if deduplicate:
+    from_train_ids_path, to_train_ids_path = dataset_utils.maybe_deduplicate_pairs(from_train_ids_path, to_train_ids_path)
 
   # Stats - using 40,000 english and french words and default vanilla tokenizer gives about 1.4% english unknown and 1.7% french unknown words.
   # For reference, "the" occurs at about a 5% hit rate for the english dataset.
@@ -565,7 +1557,8 @@ def load_dataset_in_memory(source_path,
                           max_target_sentence_length,
                           max_size=None,
                           ignore_lines=0,
-                          report_frequency=200000):
+                          report_frequency=200000,
+                          sample_seed=None):
   """Read data from source and target files and put into buckets.
 
   Args:
@@ -580,20 +1573,60 @@ def load_dataset_in_memory(source_path,
     ignore_lines - integer, how many lines to ignore at the beginning of the file.
                   at times, it may be easier to train on a few million at a time.
                   then just stop the model and train on a different part of the data.
-                  this will allow you to load it all in memory
+                  this will allow you to load it all in memory. the files are opened
+                  straight at this line through their saved line indexes (see dataset_utils.LineIndex)
     max_size: maximum number of lines to read, all other will be ignored;
         if 0 or None, all lines will be read.
     report_frequency: integer to specify to console how often to report progress in processing file
+    sample_seed: if not None, max_size pairs are sampled uniformly at random with this seed from all the pairs
+        within the length limits, instead of reading the first max_size lines (see sample_sentence_pairs).
+
+  If binary versions of both files exist (see dataset_utils.binary_corpus_path), they are memory mapped
+  and filtered by their stored sentence lengths instead of parsing the text. Otherwise the lengths come from
+  sidecars next to the text files (see dataset_utils.sentence_lengths), and only the lines that pass the
+  filter are parsed.
 
   Returns:
-    data_set contains a list of
+    data_set is a dataset_utils.SentencePairDataset of
       (source, target) pairs read from the provided data files, but only storing up to max_sentence_length for the
-      source and target. final symbol will always be _EOS
+      source and target. final symbol will always be _EOS. It indexes like a list of pairs, but keeps the ids in
+      contiguous numpy arrays.
   """
 
-  data_set = []
+  if sample_seed is not None and max_size:
+    source_sample_path, target_sample_path, bucketed_data_ratio = sample_sentence_pairs(source_path,
+                                                                                        target_path,
+                                                                                        max_source_sentence_length,
+                                                                                        max_target_sentence_length,
+                                                                                        max_size,
+                                                                                        seed=sample_seed,
+                                                                                        ignore_lines=ignore_lines)
+    data_set, _ = _load_binary_dataset_in_memory(source_sample_path,
+                                                 target_sample_path,
+                                                 max_source_sentence_length,
+                                                 max_target_sentence_length)
+    return data_set, bucketed_data_ratio
+
+  #the binary corpora written by prepare_data are memory mapped instead of parsed, when they exist
+  source_binary_path = dataset_utils.binary_corpus_path(source_path)
+  target_binary_path = dataset_utils.binary_corpus_path(target_path)
+  if gfile.Exists(source_binary_path) and gfile.Exists(target_binary_path):
+    return _load_binary_dataset_in_memory(source_binary_path,
+                                          target_binary_path,
+                                          max_source_sentence_length,
+                                          max_target_sentence_length,
+                                          max_size=max_size,
+                                          ignore_lines=ignore_lines)
+
+  data_set = dataset_utils.SentencePairDatasetBuilder()
   bucketed_data_ratio = 0.
 
+  #the length sidecars tell which lines pass the filter, so only those lines are parsed
+  source_lengths = dataset_utils.sentence_lengths(source_path)[ignore_lines:]
+  target_lengths = dataset_utils.sentence_lengths(target_path)[ignore_lines:]
+  #the target gets an _EOS appended, so its length is one more than what is stored
+  used = (source_lengths[:len(target_lengths)] <= max_source_sentence_length) & (target_lengths[:len(source_lengths)] + 1 < max_target_sentence_length)
+
   with tf.gfile.GFile(source_path, mode="r") as source_file:
     with tf.gfile.GFile(target_path, mode="r") as target_file:
       
@@ -601,35 +1634,33 @@ def load_dataset_in_memory(source_path,
       used_sentence_pairs = 0
       unused_sentence_pairs = 0 #too big to fit in max_size constraints
 
+      #ignore the first x lines of the file by seeking straight past them with the line indexes
+      if ignore_lines > 0:
+        print("Will skip the first %d lines of the dataset" % ignore_lines)
+        source_file.seek(dataset_utils.LineIndex.for_file(source_path).line_start(ignore_lines))
+        target_file.seek(dataset_utils.LineIndex.for_file(target_path).line_start(ignore_lines))
+
       source = source_file.readline()
       target = target_file.readline()
 
       while source and target:
 
-        #ignore the first x lines of the file
-        if ignore_lines > 0:
-          print("Will skip the first %d lines of the dataset" % ignore_lines)
-        for k in range(ignore_lines+1):
-          source = source_file.readline() 
-          target = target_file.readline()         
-
         counter += 1
 
         if counter % report_frequency == 0:
           print("\tloaded up through line %d in memory" % counter)
 
-        #What we read is not quite an integer yet, so convert the string representations to actual integers.
-        source_ids = [ int(x) for x in source.split()]
-        target_ids = [ int(x) for x in target.split()]
-
-        #We always add the end of sentence to the target sentence and do it here so that it doesn't
-        #go above the max target size ever. Do this BEFORE checking the sizes.
-        target_ids.append(EOS_ID)
-
         #Notice here that we use <= to source sentence, because we don't mess with it at all, and can feed these words into the neural network
         #However, target sentence uses <, and this is because we append a _GO symbol to it. This means the max target length could be too large
-        if len(source_ids) <= max_source_sentence_length and len(target_ids) < max_target_sentence_length:
-          data_set.append([source_ids, target_ids])
+        if used[counter - 1]:
+          #What we read is not quite an integer yet, so convert the string representations to actual integers.
+          source_ids = [ int(x) for x in source.split()]
+          target_ids = [ int(x) for x in target.split()]
+
+          #We always add the end of sentence to the target sentence and do it here so that it doesn't
+          #go above the max target size ever.
+          target_ids.append(EOS_ID)
+          data_set.append(source_ids, target_ids)
           used_sentence_pairs += 1
         else:
           unused_sentence_pairs += 1
@@ -642,18 +1673,266 @@ def load_dataset_in_memory(source_path,
         target = target_file.readline()
 
   bucketed_data_ratio = float(used_sentence_pairs) / (used_sentence_pairs+unused_sentence_pairs)
+  data_set = data_set.build()
+  print("Loaded %d sentence pairs in %.1f MB" % (len(data_set), data_set.nbytes / 1e6))
   return data_set, bucketed_data_ratio
 
 
 
-def initialize_glove_embeddings_tensor(num_enc_symbols, embed_size, embedding_file, vocab_verification_file, dtype=None):
+def _load_binary_dataset_in_memory(source_binary_path,
+                                   target_binary_path,
+                                   max_source_sentence_length,
+                                   max_target_sentence_length,
+                                   max_size=None,
+                                   ignore_lines=0):
+  #load_dataset_in_memory for binary corpora. the length filter runs over the stored offsets in one
+  #vectorized pass, so only the pairs we keep are ever read from the mapped files.
+  source_corpus = dataset_utils.IntegerizedCorpus(source_binary_path)
+  target_corpus = dataset_utils.IntegerizedCorpus(target_binary_path)
+
+  start = min(ignore_lines, len(source_corpus), len(target_corpus))
+  end = min(len(source_corpus), len(target_corpus))
+  if max_size:
+    end = min(end, start + max_size)
+  if ignore_lines > 0:
+    print("Will skip the first %d lines of the dataset" % ignore_lines)
+
+  #the target gets an _EOS appended, so its length is one more than what is stored
+  source_lengths = source_corpus.lengths[start:end]
+  target_lengths = target_corpus.lengths[start:end] + 1
+  used = np.nonzero((source_lengths <= max_source_sentence_length) & (target_lengths < max_target_sentence_length))[0] + start
+
+  data_set = dataset_utils.SentencePairDataset.from_corpora(source_corpus, target_corpus, used, target_append_id=EOS_ID)
+  bucketed_data_ratio = float(len(used)) / max(end - start, 1)
+  print("Loaded %d sentence pairs in %.1f MB" % (len(data_set), data_set.nbytes / 1e6))
+  return data_set, bucketed_data_ratio
+
 
+_SAMPLE_VERSION = 2
+
+
+def sampled_corpus_paths(source_path, target_path, sample_size, seed):
+  #the binary corpora holding a sample of the pairs of two integerized files live next to them
+  suffix = ".sample%d_seed%d.bin" % (sample_size, seed)
+  return source_path + suffix, target_path + suffix
+
+
+def _ids_file_vocabulary_size(ids_path, ids):
+  #integerized files are named after their vocabulary size, ie train.fr.clean.ids_40000
+  match = re.search(r"\.ids_(\d+)$", ids_path)
+  return int(match.group(1)) if match else int(max([max(i) for i in ids if len(i)] or [0])) + 1
+
+
+def _sample_text_pairs(source_path, target_path, max_source_sentence_length, max_target_sentence_length,
+                       sample_size, seed, ignore_lines, report_frequency):
+  #one pass over the text files. lengths are found by counting spaces, and only the sampled lines are parsed
+  sampler = dataset_utils.ReservoirSampler(sample_size, seed)
+  counter = 0
+  with gfile.GFile(source_path, mode="rb") as source_file:
+    with gfile.GFile(target_path, mode="rb") as target_file:
+      if ignore_lines > 0:
+        source_file.seek(dataset_utils.LineIndex.for_file(source_path).line_start(ignore_lines))
+        target_file.seek(dataset_utils.LineIndex.for_file(target_path).line_start(ignore_lines))
+      for index, (source, target) in enumerate(zip(source_file, target_file)):
+        counter += 1
+        if counter % report_frequency == 0:
+          print("\tsampled through line %d" % counter)
+        source_length = source.count(b" ") + 1 if source.strip() else 0
+        target_length = target.count(b" ") + 1 if target.strip() else 0
+        #the target gets an _EOS appended when it is loaded, the same filter as load_dataset_in_memory
+        if source_length <= max_source_sentence_length and target_length + 1 < max_target_sentence_length:
+          slot = sampler.next_slot()
+          if slot is not None:
+            sampler.put(slot, (index, [int(x) for x in source.split()], [int(x) for x in target.split()]))
+  pairs = sorted(sampler.items)
+  return [source_ids for _, source_ids, _ in pairs], [target_ids for _, _, target_ids in pairs], counter, sampler.seen
+
+
+def _sample_binary_pairs(source_corpus, target_corpus, max_source_sentence_length, max_target_sentence_length,
+                         sample_size, seed, ignore_lines, block_size=1000000):
+  #the lengths are stored, so the pairs that pass the filter are found without reading a token, a block at a time.
+  #they go through the same reservoir as in _sample_text_pairs, so a seed picks the same pairs from either format
+  start = min(ignore_lines, len(source_corpus), len(target_corpus))
+  end = min(len(source_corpus), len(target_corpus))
+  sampler = dataset_utils.ReservoirSampler(sample_size, seed)
+  for block_start in range(start, end, block_size):
+    block_end = min(block_start + block_size, end)
+    #the lengths property would diff every offset, so only this block's are
+    source_lengths = np.diff(source_corpus.offsets[block_start:block_end + 1])
+    target_lengths = np.diff(target_corpus.offsets[block_start:block_end + 1])
+    passing = np.flatnonzero((source_lengths <= max_source_sentence_length) &
+                             (target_lengths + 1 < max_target_sentence_length))
+    for offset, slot in sampler.take(len(passing)):
+      sampler.put(slot, block_start + int(passing[offset]))
+  chosen = np.sort(np.array(sampler.items, dtype=np.int64))
+  pairs = dataset_utils.SentencePairDataset.from_corpora(source_corpus, target_corpus, chosen)
+  return pairs, end - start, sampler.seen
+
+
+def _write_sampled_corpus(path, values, lengths, vocabulary_size):
+  with artifact_utils.atomic_output(path) as temporary_path:
+    with dataset_utils.IntegerizedCorpusWriter(temporary_path, vocabulary_size) as writer:
+      writer.write_block(values, lengths)
+
+
+def sample_sentence_pairs(source_path,
+                          target_path,
+                          max_source_sentence_length,
+                          max_target_sentence_length,
+                          sample_size,
+                          seed=0,
+                          ignore_lines=0,
+                          report_frequency=1000000):
+  """Write a uniform random sample of the pairs that pass the length filter to a pair of binary corpora.
+
+  Every pair after the first ignore_lines that load_dataset_in_memory would keep is equally likely to be
+  in the sample, unlike taking the first sample_size lines, and the same seed always picks the same pairs.
+  Text files are read in one pass with reservoir sampling, holding only the sample in memory. Binary
+  corpora (see dataset_utils.binary_corpus_path) are sampled straight from their stored lengths instead.
+  The sampled pairs keep their order in the files, and the target _EOS is not stored.
+
+  The sample is reused as long as the input files and arguments are unchanged.
+
+  Returns:
+    a triple (source_sample_path, target_sample_path, used_ratio), where used_ratio is the fraction of
+    the pairs that passed the length filter
+  """
+  source_binary_path = dataset_utils.binary_corpus_path(source_path)
+  target_binary_path = dataset_utils.binary_corpus_path(target_path)
+  binary = gfile.Exists(source_binary_path) and gfile.Exists(target_binary_path)
+  inputs = [source_binary_path, target_binary_path] if binary else [source_path, target_path]
+  params = {"sample_size": sample_size, "seed": seed, "ignore_lines": ignore_lines,
+            "max_source_sentence_length": max_source_sentence_length,
+            "max_target_sentence_length": max_target_sentence_length}
+  source_sample_path, target_sample_path = sampled_corpus_paths(source_path, target_path, sample_size, seed)
+  if (artifact_utils.is_current(source_sample_path, "sample", _SAMPLE_VERSION, inputs, params) and
+      artifact_utils.is_current(target_sample_path, "sample", _SAMPLE_VERSION, inputs, params)):
+    print("Training sample %s already exists. Skipping this step..." % source_sample_path)
+    details = artifact_utils.load_manifest(source_sample_path)["details"]
+  else:
+    print("Sampling %d sentence pairs from %s and %s with seed %d" % (sample_size, inputs[0], inputs[1], seed))
+    if ignore_lines > 0:
+      print("Will skip the first %d lines of the dataset" % ignore_lines)
+    if binary:
+      source_corpus = dataset_utils.IntegerizedCorpus(source_binary_path)
+      target_corpus = dataset_utils.IntegerizedCorpus(target_binary_path)
+      pairs, candidates, used = _sample_binary_pairs(source_corpus, target_corpus, max_source_sentence_length,
+                                                     max_target_sentence_length, sample_size, seed, ignore_lines)
+      _write_sampled_corpus(source_sample_path, pairs.source_values, pairs.source_lengths, source_corpus.vocabulary_size)
+      _write_sampled_corpus(target_sample_path, pairs.target_values, pairs.target_lengths, target_corpus.vocabulary_size)
+    else:
+      source_ids, target_ids, candidates, used = _sample_text_pairs(source_path, target_path, max_source_sentence_length,
+                                                                    max_target_sentence_length, sample_size, seed,
+                                                                    ignore_lines, report_frequency)
+      for path, ids, ids_path in ((source_sample_path, source_ids, source_path), (target_sample_path, target_ids, target_path)):
+        values = np.array([token for sentence in ids for token in sentence], dtype=np.int64)
+        _write_sampled_corpus(path, values, np.array([len(sentence) for sentence in ids], dtype=np.int64),
+                              _ids_file_vocabulary_size(ids_path, ids))
+    details = {"candidates": candidates, "used": used}
+    for path in (source_sample_path, target_sample_path):
+      artifact_utils.record(path, "sample", _SAMPLE_VERSION, inputs, params, details)
+    print("Sampled %d of the %d pairs within the length limits, out of %d" % (min(sample_size, used), used, candidates))
+
+  return source_sample_path, target_sample_path, details["used"] / float(max(details["candidates"], 1))
+
+
+def report_length_caps(source_path,
+                       target_path,
+                       max_source_sentence_length,
+                       max_target_sentence_length,
+                       steps=(-20, -10, 0, 10, 20)):
+  """Print the share of the training pairs that length limits around the chosen ones keep.
+
+  The lengths come from the cached sidecars of dataset_utils.sentence_lengths, so after the first run this
+  costs nothing. Returns the dataset_utils.PairLengthHistogram, to ask about other limits.
+  """
+  histogram = dataset_utils.PairLengthHistogram(dataset_utils.sentence_lengths(source_path),
+                                                dataset_utils.sentence_lengths(target_path))
+  source_caps = sorted(set(max(1, max_source_sentence_length + step) for step in steps))
+  target_caps = sorted(set(max(2, max_target_sentence_length + step) for step in steps))
+  print("Share of the %d training pairs kept by the source (rows) and target (columns) length limits:" % histogram.num_pairs)
+  print("\t" + "\t".join("%d" % cap for cap in target_caps))
+  for source_cap in source_caps:
+    print("%d\t" % source_cap + "\t".join("%.4f" % histogram.kept_ratio(source_cap, target_cap) for target_cap in target_caps))
+  return histogram
+
+
+def open_streaming_dataset(source_path,
+                           target_path,
+                           max_source_sentence_length,
+                           max_target_sentence_length,
+                           max_size=None,
+                           ignore_lines=0,
+                           buffer_size=10000,
+                           weight=1.,
+                           extra_corpora=(),
+                           seed=None):
+  """File backed counterpart of load_dataset_in_memory, for training sets too big for RAM.
+
+  Takes the same arguments, and returns a dataset_utils.StreamingSentencePairSource that samples random
+  pairs from the files with the same length filters, holding only buffer_size pairs at a time.
+  Binary corpora are used when they exist, otherwise the text files are read through a line index.
+
+  extra_corpora is a list of (source_path, target_path, weight) of more integerized corpora made with the
+  same vocabularies. With any, a dataset_utils.MixedSentencePairSource is returned instead, which draws
+  every batch from all the corpora in proportion to their weights, the first corpus having weight.
+  ignore_lines and max_size only apply to the first corpus.
+  """
+  corpora = [(source_path, target_path, weight, ignore_lines, max_size)]
+  corpora += [(extra_source_path, extra_target_path, extra_weight, 0, None)
+              for extra_source_path, extra_target_path, extra_weight in extra_corpora]
+  sources = []
+  for i, (corpus_source_path, corpus_target_path, _, start, size) in enumerate(corpora):
+    source_corpus = dataset_utils.open_integerized_corpus(corpus_source_path)
+    target_corpus = dataset_utils.open_integerized_corpus(corpus_target_path)
+    print("Streaming training pairs from %s and %s" % (source_corpus.path, target_corpus.path))
+    sources.append(dataset_utils.StreamingSentencePairSource(source_corpus,
+                                                             target_corpus,
+                                                             max_source_sentence_length,
+                                                             max_target_sentence_length,
+                                                             start=start,
+                                                             max_size=size,
+                                                             buffer_size=buffer_size,
+                                                             target_append_id=EOS_ID,
+                                                             seed=None if seed is None else seed + i))
+  if len(sources) == 1:
+    return sources[0]
+  return dataset_utils.MixedSentencePairSource(sources, [corpus[2] for corpus in corpora],
+                                               names=[corpus[0] for corpus in corpora], seed=seed)
+
+
+def pretrained_embeddings_matrix(num_enc_symbols, embed_size, embedding_file, vocab_verification_file, algorithm="glove"):
+  """Initial value of an embedding variable as a numpy array: the pretrained vectors of the vocabulary words, in vocabulary order.
+
+  The vectors are read from embedding_file by the reader of the algorithm (see embedding_utils.READERS) once and
+  cached as a matrix next to the vocabulary file (see embedding_utils.load_pretrained_matrix). glove vectors are
+  trained on our own corpus, so every word of the vocabulary must have one. word2vec and fasttext files come from
+  other corpora, and the words they lack get random vectors of the same scale as the ones they have.
+  """
   if not gfile.Exists(embedding_file):
     raise IOError("Embedding file location %s not found" % embedding_file)
   if not gfile.Exists(vocab_verification_file):
     raise IOError("Vocab file location %s not found" % vocab_verification_file)
 
+  words = embedding_utils.read_vocabulary_words(vocab_verification_file, limit=len(_INITIAL_VOCABULARY))
+  assert words == _INITIAL_VOCABULARY[:len(words)], "all initial vocabulary words are expected to come first in a vocab file."
+
+  print("Building and verifying %s embedding tensors against vocabulary files." % algorithm)
+  allow_missing = algorithm != "glove"
+  pretrained = embedding_utils.load_pretrained_matrix(vocab_verification_file, embedding_file, num_enc_symbols, embed_size,
+                                                      reader=embedding_utils.READERS[algorithm], algorithm=algorithm,
+                                                      special_words=_INITIAL_VOCABULARY, allow_missing=allow_missing)
   embeddings = np.zeros(shape=(num_enc_symbols, embed_size), dtype=np.float32) #TODO - fix this dtype
+  embeddings[:len(pretrained)] = pretrained
+
+  if allow_missing:
+    missing = embedding_utils.missing_rows(vocab_verification_file, embedding_file, algorithm, num_enc_symbols, embed_size)
+    if missing:
+      found = np.ones(len(pretrained), dtype=bool)
+      found[:len(_INITIAL_VOCABULARY)] = False
+      found[missing] = False
+      scale = pretrained[found].std() if found.any() else 1.0
+      embeddings[missing] = np.random.normal(scale=scale, size=(len(missing), embed_size))
 
   #PAD can remain all zeros, so let's just not deal with it.
   
@@ -666,46 +1945,15 @@ def initialize_glove_embeddings_tensor(num_enc_symbols, embed_size, embedding_fi
   #randomize the _UNK symbols
   embeddings[3] = np.random.uniform(low=-1.0, high=1.0, size=embed_size)
 
-  #load the pre-trained vectors
-  limit = num_enc_symbols
-
-  embed_dict = OrderedDict()
-  with gfile.GFile(embedding_file, mode="rb") as ef:
-    for line in ef:
-      emb = line.split()
-      vector = emb[1:] #0 is the word, 1: are the word vectors, of which there are 200-300 or 512 or something
-      vector = [float(i) for i in vector]
-      embed_dict[str(emb[0])] = vector
-
-  with gfile.GFile(vocab_verification_file, mode="rb") as vf:
-
-      print("Building and verifying glove embedding tensors against vocabulary files.")
-
-      #get a word in the vocab file
-      words_read=0
-      for line in vf:
-        word = line.split()[0]
-
-        #skip the first four words
-        if word in _INITIAL_VOCABULARY:
-          words_read += 1
-          assert words_read <= len(_INITIAL_VOCABULARY), "all initial vocabulary words are expected to come first in a vocab file."
-          continue
-        found=False
-
-        #place the word vector in the numpy array at the right index
-        try:
-          embeddings[words_read] = embed_dict[word]
-        except KeyError, err:
-          print("The word %s did not occur in the embedding glove file" % word)
-          print(err)
-          raise
-        
-        words_read += 1
-
-        #and quit if we hit our limit in the event that we are testing
-        if limit == words_read:
-          print("Cutting off vocabulary file at line limit %d. Size of dictionary is %d" % (limit, len(embeddings)))
-          break
+  return embeddings
+
 
-  return tf.convert_to_tensor(embeddings, dtype=dtype)
\ No newline at end of file
+def glove_embeddings_matrix(num_enc_symbols, embed_size, embedding_file, vocab_verification_file):
+  #the glove vectors of the vocabulary words, every one of which must have a vector
+  return pretrained_embeddings_matrix(num_enc_symbols, embed_size, embedding_file, vocab_verification_file, algorithm="glove")
+
+
+def initialize_glove_embeddings_tensor(num_enc_symbols, embed_size, embedding_file, vocab_verification_file, dtype=None):
+  #glove_embeddings_matrix as a constant tensor. graphs should feed the matrix instead (see embeddings.initialize_pretrained_embeddings),
+  #since a constant is stored in the GraphDef and in every saved .meta file
+  return tf.convert_to_tensor(glove_embeddings_matrix(num_enc_symbols, embed_size, embedding_file, vocab_verification_file), dtype=dtype)
\ No newline at end of file